@@ -0,0 +1,345 @@
+#!/usr/bin/python -u
+# coding=utf-8
+"""
+Acoustic levels computed from the recorder's live audio stream
+Chunks read by the recorder are handed to a background thread, which fills a one-second
+int16 buffer and computes levels, and optionally octave or third-octave band levels, for
+each completed second with vectorized numpy; results for each recorded minute are written
+to sidecar files named after the minute's audio file. Seconds are aligned to the start of the
+minute's audio, chunks dropped from analysis count towards the position; seconds with no
+analyzed audio have NaN levels
+"""
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from logmanager import MessageHandler
+
+NS_PER_SECOND = 1000000000
+FULL_SCALE_DB = 120.0  # default dB SPL of a full-scale (32768) sample
+ANALYSIS_QUEUE_CHUNKS = 500  # default chunks queued for analysis before further chunks are dropped
+FAST_BLOCKS_PER_SECOND = 8  # 125 ms blocks, 'fast' time weighting, for Lmax
+LEVELS_SUFFIX = '_levels.csv'  # appended to segment file stem to name levels sidecar
+LEVELS_FLOAT_FORMAT = '%.2f'
+BANDS_SUFFIX = '_bands.npz'  # appended to segment file stem to name band levels sidecar
+BAND_FRACTIONS = {'octave': 1, 'third-octave': 3}  # band-analysis options, bands per octave
+BAND_INTERVALS = ['second', 'minute']  # band-interval options
+BAND_MIN_HZ = 20.  # lowest band centre included
+
+
+def get_band_centres(bands_per_octave: int, sample_rate: int):
+    """
+    base-ten nominal band centres (1000 Hz reference) from BAND_MIN_HZ to below Nyquist
+    :param bands_per_octave: 1 for octave, 3 for third-octave bands
+    :param sample_rate: samples per second
+    :return: band centre frequencies, Hz
+    """
+    tenths = np.arange(int(np.round(10. * np.log10(BAND_MIN_HZ / 1000.))),
+                       int(np.ceil(10. * np.log10(sample_rate / 2000.))) + 1)  # centres in tenths of a decade
+    centres = 1000. * 10. ** (tenths[tenths % (3 // bands_per_octave) == 0] / 10.)
+    return centres[centres * 10. ** (1.5 / bands_per_octave / 10.) < sample_rate / 2.]
+
+
+class AudioAnalyzer:
+    """
+    Per-second Leq, Lpeak and Lmax of the first channel of the recorded stream. Lmax is the
+    highest Leq over the 125 ms blocks of each second, a block approximation of fast time weighting.
+    Optionally, band Leq per second or per minute from one FFT per second, power summed into
+    bands with a precomputed bin-to-band map. Levels are relative to the stream's weighting,
+    calibrated by full-scale-db.
+    """
+    _msg_handler: MessageHandler = None  # logging interface
+    _sample_rate: int = None  # samples per second per channel
+    _channels: int = None  # channels in recorded stream
+    _full_scale_db: float = None  # dB SPL of a full-scale sample
+    _queue: queue.Queue = None  # ('start', segment path), ('data', chunk), ('gap', frames) or ('finish', end) items
+    _max_queued_chunks: int = None  # data chunks queued before further chunks are dropped
+    _dropped_frames: int = 0  # frames dropped by feed since last item queued, queued as gap before next item
+    _add_file = None  # function taking path of finished sidecar file, e.g. SegmentUploader.add
+    _second: np.ndarray = None  # int16 samples of second being filled
+    _filled: int = 0  # samples in second being filled
+    _levels: list = None  # (leq, lpeak, lmax) per second of current segment, NaN if no samples analyzed
+    _band_centres: np.ndarray = None  # band centre frequencies, None if band analysis not configured
+    _band_edges: np.ndarray = None  # band edge frequencies, band i from edge i to edge i + 1
+    _band_maps: dict = None  # FFT length -> (band index, weight, in-band mask) of FFT bins
+    _band_interval: str = None  # 'second' or 'minute'
+    _band_squares: list = None  # band mean squares per second of current segment, NaN if no samples analyzed
+    _band_samples: list = None  # samples analyzed per second of current segment, to weight per-minute band levels
+    _cpu_seconds: dict = None  # analysis thread cpu time spent on levels and bands in current segment
+    _segment_path: Path = None  # audio file of segment being analyzed
+    _segment_samples: int = 0  # position in current segment, samples analyzed or dropped
+    _thread: threading.Thread = None  # analysis thread
+    _counts: dict = None  # chunks analyzed and dropped, sidecar files written
+
+    def __init__(self, recorder_info: dict, msg_handler: MessageHandler, add_file=None):
+        self._msg_handler = msg_handler
+        self._sample_rate = recorder_info['sample-rate']
+        self._channels = recorder_info['channels']
+        self._full_scale_db = recorder_info.get('full-scale-db', FULL_SCALE_DB)
+        self._max_queued_chunks = recorder_info.get('analysis-queue-chunks', ANALYSIS_QUEUE_CHUNKS)
+        self._add_file = add_file
+        self._queue = queue.Queue()  # data chunks are bounded in feed, segment markers are never dropped
+        self._second = np.zeros(self._sample_rate, dtype=np.int16)
+        self._filled = 0
+        self._levels = []
+        self._counts = {'analyzed': 0, 'dropped': 0, 'files': 0}
+        self._cpu_seconds = {'levels': 0., 'bands': 0.}
+        band_analysis = recorder_info.get('band-analysis')
+        if band_analysis:
+            if band_analysis not in BAND_FRACTIONS:
+                raise ValueError("band-analysis {0} not one of {1}".format(band_analysis, str(list(BAND_FRACTIONS))))
+            self._band_interval = recorder_info.get('band-interval', 'second')
+            if self._band_interval not in BAND_INTERVALS:
+                raise ValueError("band-interval {0} not one of {1}".format(self._band_interval, str(BAND_INTERVALS)))
+            self._band_centres = get_band_centres(BAND_FRACTIONS[band_analysis], self._sample_rate)
+            half_band = 10. ** (1.5 / BAND_FRACTIONS[band_analysis] / 10.)
+            self._band_edges = np.append(self._band_centres / half_band, self._band_centres[-1] * half_band)
+            self._band_maps = {}
+            self._band_squares = []
+            self._band_samples = []
+        self._thread = threading.Thread(target=self.run_analyzer, name='audio-analyzer')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def start_segment(self, segment_path: Path):
+        self._queue.put(('start', segment_path))
+
+    def feed(self, data):
+        """
+        queue chunk of recorded audio for analysis, never blocks recorder
+        :param data: bytes-like chunk of int16 audio frames, not modified after call
+        :return: None
+        """
+        if self._queue.qsize() >= self._max_queued_chunks:
+            self._counts['dropped'] += 1
+            self._dropped_frames += len(data) // (2 * self._channels)
+            return
+        self.queue_gap()
+        self._queue.put(('data', data))
+
+    def queue_gap(self):
+        """
+        queue frames dropped since last item, so that analyzer keeps its position in the segment
+        :return: None
+        """
+        if self._dropped_frames:
+            self._queue.put(('gap', self._dropped_frames))
+            self._dropped_frames = 0
+
+    def finish_segment(self, end: pd.Timestamp):
+        self.queue_gap()
+        self._queue.put(('finish', end))
+
+    def run_analyzer(self):
+        """
+        analyze queued chunks until None sentinel is received
+        :return: None
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, value = item
+            try:
+                if kind == 'data':
+                    self.analyze_chunk(value)
+                elif kind == 'gap':
+                    self.skip_frames(value)
+                elif kind == 'start':
+                    self._segment_path = value
+                    self._segment_samples = 0
+                    self._filled = 0
+                    self._levels = []
+                    if self._band_centres is not None:
+                        self._band_squares = []
+                        self._band_samples = []
+                else:
+                    self.close_second()
+                    self.write_levels(value)
+                    if self._band_centres is not None:
+                        self.write_bands(value)
+                    self.log_cpu_seconds()
+                    self._segment_path = None
+            except Exception as ex:
+                self._msg_handler.log("analyzer: {0} failed: {1}".format(kind, str(ex)), logging.WARNING)
+
+    def analyze_chunk(self, data):
+        """
+        add chunk to one-second buffer, computing levels each time a second is completed
+        :param data: bytes-like chunk of int16 audio frames
+        :return: None
+        """
+        samples = np.frombuffer(data, dtype=np.int16)[::self._channels]
+        while len(samples) > 0:
+            n = min(len(samples), self._sample_rate - self._segment_samples % self._sample_rate)
+            self._second[self._filled:self._filled + n] = samples[:n]
+            self._filled += n
+            self._segment_samples += n
+            samples = samples[n:]
+            if self._segment_samples % self._sample_rate == 0:
+                self.close_second()
+        self._counts['analyzed'] += 1
+
+    def skip_frames(self, n_frames: int):
+        """
+        advance position in segment over frames dropped from analysis; a second is closed with the samples
+        analyzed in it, or given NaN levels if none were
+        :param n_frames: frames dropped
+        :return: None
+        """
+        while n_frames > 0:
+            n = min(n_frames, self._sample_rate - self._segment_samples % self._sample_rate)
+            self._segment_samples += n
+            n_frames -= n
+            if self._segment_samples % self._sample_rate == 0:
+                if self._filled:
+                    self.close_second()
+                else:
+                    self.add_missing_second()
+
+    def add_missing_second(self):
+        self._levels.append((np.nan, np.nan, np.nan))
+        if self._band_centres is not None:
+            self._band_squares.append(np.full(len(self._band_centres), np.nan))
+            self._band_samples.append(0)
+
+    def close_second(self):
+        """
+        compute levels of samples in one-second buffer (or fewer at end of segment), then empty it
+        :return: None
+        """
+        if self._filled == 0:
+            return
+        cpu_start = time.thread_time()
+        x = self._second[:self._filled].astype(np.float64) / 32768.
+        squares = x * x
+        block = self._sample_rate // FAST_BLOCKS_PER_SECOND
+        blocks = self._filled // block
+        mean_square = squares.mean()
+        max_block_square = squares[:blocks * block].reshape(blocks, block).mean(axis=1).max() \
+            if blocks > 0 else mean_square
+        peak = np.abs(x).max()
+        with np.errstate(divide='ignore'):
+            self._levels.append((10. * np.log10(mean_square) + self._full_scale_db,
+                                 20. * np.log10(peak) + self._full_scale_db,
+                                 10. * np.log10(max_block_square) + self._full_scale_db))
+        cpu_levels = time.thread_time()
+        self._cpu_seconds['levels'] += cpu_levels - cpu_start
+        if self._band_centres is not None:
+            self._band_squares.append(self.get_band_squares(x))
+            self._band_samples.append(len(x))
+            self._cpu_seconds['bands'] += time.thread_time() - cpu_levels
+        self._filled = 0
+
+    def get_band_squares(self, x: np.ndarray):
+        """
+        mean square of signal in each band, from power spectrum so that all bins sum to mean square of x
+        :param x: samples, scaled to full scale
+        :return: float64 array of band mean squares
+        """
+        n = len(x)
+        if n not in self._band_maps:
+            freqs = np.fft.rfftfreq(n, 1. / self._sample_rate)
+            band_index = np.searchsorted(self._band_edges, freqs, side='right') - 1
+            in_band = (band_index >= 0) & (band_index < len(self._band_centres))
+            weights = np.full(len(freqs), 2.)  # one-sided spectrum, dc and nyquist bins counted once
+            weights[0] = 1.
+            if n % 2 == 0:
+                weights[-1] = 1.
+            self._band_maps[n] = (band_index[in_band], weights[in_band] / (n * n), in_band)
+        band_index, weights, in_band = self._band_maps[n]
+        spectrum = np.fft.rfft(x)[in_band]
+        power = weights * (spectrum.real * spectrum.real + spectrum.imag * spectrum.imag)
+        return np.bincount(band_index, weights=power, minlength=len(self._band_centres))
+
+    def get_seconds_end_ns(self, end: pd.Timestamp, n_seconds: int):
+        """
+        end times of seconds of segment, counted from its start, last second ending at end of segment
+        :param end: end of segment
+        :param n_seconds: seconds with levels
+        :return: int64 array of ns since epoch
+        """
+        start_ns = end.value - self._segment_samples * NS_PER_SECOND // self._sample_rate
+        return np.minimum(start_ns + np.arange(1, n_seconds + 1, dtype=np.int64) * NS_PER_SECOND, end.value)
+
+    def write_levels(self, end: pd.Timestamp):
+        """
+        write levels of segment to sidecar file, each second labelled by its end time
+        :param end: end of segment
+        :return: None
+        """
+        if not self._levels or self._segment_path is None:
+            return
+        timestamps = self.get_seconds_end_ns(end, len(self._levels))
+        levels = pd.DataFrame(np.array(self._levels, dtype=np.float32), columns=['leq', 'lpeak', 'lmax'],
+                              index=pd.DatetimeIndex(timestamps, name='timestamp'))
+        levels_path = self._segment_path.with_name(self._segment_path.stem + LEVELS_SUFFIX)
+        partial_path = levels_path.with_name(levels_path.name + '.part')
+        levels.to_csv(partial_path, float_format=LEVELS_FLOAT_FORMAT)
+        partial_path.replace(levels_path)
+        self._counts['files'] += 1
+        self._levels = []
+        if self._add_file is not None:
+            self._add_file(levels_path)
+
+    def write_bands(self, end: pd.Timestamp):
+        """
+        write band levels of segment to sidecar npz file: float32 'levels' (seconds or 1 x bands),
+        'centres_hz' and int64 'timestamp_ns' of the end of each row's interval
+        :param end: end of segment
+        :return: None
+        """
+        if not self._band_squares or self._segment_path is None:
+            return
+        band_squares = np.array(self._band_squares)
+        if self._band_interval == 'minute':
+            band_samples = np.array(self._band_samples)
+            analyzed = band_samples > 0
+            band_squares = np.average(band_squares[analyzed], axis=0, weights=band_samples[analyzed])[np.newaxis, :] \
+                if analyzed.any() else band_squares[:1]
+            timestamps = np.array([end.value], dtype=np.int64)
+        else:
+            timestamps = self.get_seconds_end_ns(end, len(band_squares))
+        with np.errstate(divide='ignore'):
+            band_levels = (10. * np.log10(band_squares) + self._full_scale_db).astype(np.float32)
+        bands_path = self._segment_path.with_name(self._segment_path.stem + BANDS_SUFFIX)
+        partial_path = bands_path.with_name(bands_path.name + '.part')
+        with open(partial_path, 'wb') as f:
+            np.savez(f, levels=band_levels, centres_hz=self._band_centres.astype(np.float32),
+                     timestamp_ns=timestamps.astype(np.int64))
+        partial_path.replace(bands_path)
+        self._counts['files'] += 1
+        self._band_squares = []
+        self._band_samples = []
+        if self._add_file is not None:
+            self._add_file(bands_path)
+
+    def log_cpu_seconds(self):
+        """
+        log analysis thread cpu time for segment, then reset
+        :return: None
+        """
+        self._msg_handler.log("analyzer: {0} cpu levels {1:.3f} s, bands {2:.3f} s"
+                              .format(self._segment_path.name if self._segment_path else '',
+                                      self._cpu_seconds['levels'], self._cpu_seconds['bands']))
+        self._cpu_seconds = {'levels': 0., 'bands': 0.}
+
+    def get_counts(self):
+        return dict(self._counts)
+
+    def close(self, timeout: float = 30.):
+        """
+        analyze chunks still queued, then stop
+        :param timeout: seconds to wait for queued chunks
+        :return: None
+        """
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._msg_handler.log("analyzer: stopped, counts {0}".format(str(self.get_counts())))
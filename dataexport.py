@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+export a time range of sound meter readings from nsrt_data to csv, parquet or numpy file.
+Readings are streamed from the database through a server-side cursor and written one chunk at
+a time, so memory use is bounded by the chunk size rather than the length of the range.
+"""
+import argparse
+import sys
+import time
+import traceback
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, func, select
+
+from datatablecreate import DATA_TABLE_NAME
+from dbinfo import DBInfo
+
+EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.npy': 'npy'}  # file suffix -> export format
+EXPORT_CHUNK_ROWS = 50000  # default rows fetched and written at a time
+EXPORT_DTYPE = np.dtype([('nsrt_id', np.int32), ('timestamp_ns', np.int64), ('lavg', np.float32),
+                         ('leq', np.float32), ('temp_f', np.float32), ('params_id', np.int32)])  # npy layout
+EXPORT_COLUMNS = ['nsrt_id', 'timestamp', 'lavg', 'leq', 'temp_f', 'params_id']
+
+
+def get_time_range_query(db_info: DBInfo, start: pd.Timestamp, end: pd.Timestamp, nsrt_ids: list = None):
+    """
+    :param db_info: database connection holder
+    :param start: start of range, inclusive
+    :param end: end of range, exclusive
+    :param nsrt_ids: meter ids to select, all meters if None
+    :return: data table and condition selecting readings of range
+    """
+    data_table = db_info.get_table(DATA_TABLE_NAME)
+    condition = and_(data_table.c.timestamp >= start.to_pydatetime(), data_table.c.timestamp < end.to_pydatetime())
+    if nsrt_ids:
+        condition = and_(condition, data_table.c.nsrt_id.in_([int(nsrt_id) for nsrt_id in nsrt_ids]))
+    return data_table, condition
+
+
+def read_time_range(db_info: DBInfo, start: pd.Timestamp, end: pd.Timestamp, nsrt_ids: list = None,
+                    chunk_rows: int = EXPORT_CHUNK_ROWS, limit: int = None):
+    """
+    stream readings of time range, ordered by meter and timestamp
+    :param db_info: database connection holder
+    :param start: start of range, inclusive
+    :param end: end of range, exclusive
+    :param nsrt_ids: meter ids to select, all meters if None
+    :param chunk_rows: maximum rows per chunk
+    :param limit: maximum rows read, all if None
+    :return: generator of dataframes with EXPORT_COLUMNS
+    """
+    data_table, condition = get_time_range_query(db_info, start, end, nsrt_ids)
+    query = select(*[data_table.c[col] for col in EXPORT_COLUMNS]).where(condition)\
+        .order_by(data_table.c.nsrt_id, data_table.c.timestamp)
+    if limit is not None:
+        query = query.limit(limit)
+    for chunk in db_info.stream_query_chunks(query, chunk_rows):
+        chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+        yield chunk.astype(dict((col, EXPORT_DTYPE[col]) for col in EXPORT_COLUMNS if col in EXPORT_DTYPE.names))
+
+
+def count_time_range(db_info: DBInfo, start: pd.Timestamp, end: pd.Timestamp, nsrt_ids: list = None):
+    data_table, condition = get_time_range_query(db_info, start, end, nsrt_ids)
+    with db_info.get_engine().connect() as con:
+        return con.execute(select(func.count()).select_from(data_table).where(condition)).scalar()
+
+
+def write_csv_chunks(chunks, out_path: Path):
+    n_rows = 0
+    for chunk in chunks:
+        chunk.to_csv(out_path, mode='w' if n_rows == 0 else 'a', header=n_rows == 0, index=False)
+        n_rows += len(chunk)
+    return n_rows
+
+
+def write_parquet_chunks(chunks, out_path: Path):
+    """
+    write chunks to parquet file, one row group per chunk; requires pyarrow
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    n_rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(str(out_path), table.schema, compression='zstd')
+            writer.write_table(table)
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def write_npy_chunks(chunks, out_path: Path, n_rows: int):
+    """
+    write chunks to numpy file of EXPORT_DTYPE records through memory map, so that written
+    chunks are paged out to file rather than held in memory
+    :param chunks: chunks of readings
+    :param out_path: npy file
+    :param n_rows: number of rows in chunks, sets length of file
+    :return: number of rows written
+    """
+    out_array = np.lib.format.open_memmap(str(out_path), mode='w+', dtype=EXPORT_DTYPE, shape=(n_rows,))
+    position = 0
+    for chunk in chunks:
+        rows = out_array[position:position + len(chunk)]
+        for col in EXPORT_DTYPE.names:
+            rows[col] = chunk['timestamp'].values.astype('datetime64[ns]').astype(np.int64) \
+                if col == 'timestamp_ns' else chunk[col].values
+        position += len(chunk)
+        out_array.flush()
+    del out_array
+    if position != n_rows:
+        raise ValueError("{0:d} rows of {1:d} counted were read, readings removed during export"
+                         .format(position, n_rows))
+    return position
+
+
+def export_time_range(db_info: DBInfo, start: pd.Timestamp, end: pd.Timestamp, out_path: str,
+                      export_format: str = None, nsrt_ids: list = None, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """
+    write readings of time range to file, ordered by meter and timestamp
+    :param db_info: database connection holder
+    :param start: start of range, inclusive
+    :param end: end of range, exclusive
+    :param out_path: file to write
+    :param export_format: 'csv', 'parquet' or 'npy', by suffix of out_path if None
+    :param nsrt_ids: meter ids to export, all meters if None
+    :param chunk_rows: rows fetched and written at a time
+    :return: number of rows written
+    """
+    out_path = Path(out_path)
+    export_format = export_format or EXPORT_FORMATS.get(out_path.suffix.lower())
+    if export_format not in EXPORT_FORMATS.values():
+        raise ValueError("export format must be one of {0}".format(", ".join(EXPORT_FORMATS.values())))
+    if export_format == 'npy':
+        n_rows = count_time_range(db_info, start, end, nsrt_ids)  # rows added after count are left out
+        return write_npy_chunks(read_time_range(db_info, start, end, nsrt_ids, chunk_rows, n_rows), out_path, n_rows)
+    chunks = read_time_range(db_info, start, end, nsrt_ids, chunk_rows)
+    return write_csv_chunks(chunks, out_path) if export_format == 'csv' else write_parquet_chunks(chunks, out_path)
+
+
+def main():
+    try:
+        my_parser = argparse.ArgumentParser(prog='dataexport',
+                                            description='Export time range of sound meter readings to csv, '
+                                                        'parquet or numpy file')
+        my_parser.add_argument('--config_file', type=str, help='database config file')
+        my_parser.add_argument('--db_target_alias', type=str, help='target alias to find in config file')
+        my_parser.add_argument('--start', type=str, required=True, help='start of range, e.g. 2022-02-14')
+        my_parser.add_argument('--end', type=str, required=True, help='end of range (exclusive), e.g. 2022-03-01')
+        my_parser.add_argument('--nsrt_ids', type=int, nargs='*', help='meter ids to export (default all)')
+        my_parser.add_argument('--out_file', type=str, required=True, help='file to write, format by suffix '
+                                                                           '(.csv, .parquet, .npy)')
+        my_parser.add_argument('--format', type=str, choices=sorted(set(EXPORT_FORMATS.values())),
+                               help='export format, overrides suffix of out_file')
+        my_parser.add_argument('--chunk_rows', type=int, default=EXPORT_CHUNK_ROWS,
+                               help='rows fetched and written at a time')
+        args: argparse.Namespace = my_parser.parse_args()
+        db_info: DBInfo = DBInfo.dbinfo_from_configfile(args.config_file, args.db_target_alias)
+        export_start = time.perf_counter()
+        n_rows = export_time_range(db_info, pd.Timestamp(args.start), pd.Timestamp(args.end), args.out_file,
+                                   args.format, args.nsrt_ids, args.chunk_rows)
+        print("exported {0:d} readings to {1} in {2:.1f} s".format(n_rows, args.out_file,
+                                                                   time.perf_counter() - export_start))
+        db_info.close()
+
+    except Exception as ex:
+        print("Exception in user code:")
+        print('-' * 60)
+        print(str(ex))
+        traceback.print_exc(file=sys.stdout)
+        print('-' * 60)
+
+
+if __name__ == '__main__':
+    main()
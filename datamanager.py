@@ -2,17 +2,89 @@
 # coding=utf-8
 """
 Generic Data Manager implementation with concrete subclasses
-Here we include subclasses to handle saving data to csv or to mysql database
+Here we include subclasses to handle saving data to csv, to parquet files, to mysql database or to sqlite file,
+and a subclass passing data to several of these at once
 """
+import copy
+import gzip
 import logging
 import os
+import queue
+import shutil
+import sys
+import threading
+import time
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from dbinfo import DBInfo
+from sqlalchemy import and_, func, insert, literal, select
+from sqlalchemy.exc import DBAPIError, IntegrityError, InterfaceError, OperationalError, \
+    TimeoutError as PoolTimeoutError
+from dbinfo import DBInfo, POOLED_ENGINE_ARGS, df_to_records
 from logmanager import MessageHandler
-from datatablecreate import TABLE_PREFIX, TABLE_SUFFIXES, create_empty_database
+from datatablecreate import TABLE_PREFIX, TABLE_SUFFIXES, SUMMARY_TABLE_SUFFIXES, PARAMS_COLUMNS, \
+    Base, create_empty_database, ensure_future_partitions, ensure_params_unique_key, ensure_summary_tables
+from dataexport import EXPORT_CHUNK_ROWS, read_time_range
+from levelstats import MINUTE_STATS_COLUMNS, ROLLUP_PERIODS_NS, ROLLUP_SUM_COLUMNS, get_minute_stats_frame, \
+    get_rollup_stats_frame
+from readingbuffer import ReadingBlock
+from spool import DataSpool, SpoolForwarder, SPOOL_BATCH_BLOCKS, SPOOL_DEAD_LETTER_ATTEMPTS
 from argparse import Namespace
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None  # ParquetDataManager unavailable
+
+PARAMS_INSERT_ATTEMPTS = 5  # attempts to insert new parameter set when racing other writers for next id
+PARQUET_DAY_FORMAT = '%Y-%m-%d'
+PARQUET_FILENAME_FORM = 'nsrt_{0}.parquet'  # file holding one day of readings
+PARQUET_PARTS_FORM = 'nsrt_{0}'  # folder holding row groups of the day being written
+PARQUET_ROWGROUP_MINUTES = 10  # default minutes of readings buffered per row group
+PARQUET_COMPACT_ROWS = 250000  # maximum rows per row group of compacted day file
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_PARTS_KEY = b'nsrt_parts'  # day file metadata key listing row group files merged into it
+SQLITE_MAINTENANCE_HOURS = 24  # default hours between checkpoint and vacuum of sqlite file
+CSV_ROTATE_OPTIONS = ['none', 'day', 'size']  # csv file rotation, 'none' appends to csv-filename
+CSV_ROTATE_MB = 100  # default file size at which csv file is rotated, if rotating by size
+CSV_DAY_FORMAT = '%Y-%m-%d'  # name of file rotated by day, e.g. nsrt_2022-02-14.csv
+CSV_SIZE_FORMAT = '%Y-%m-%d_%H%M%S'  # name of file rotated by size, by first reading
+CSV_BUFFER_BYTES = 65536
+CSV_GZIP_CLOSE_SECONDS = 60  # wait on close for gzip in progress, remaining files are gzipped at next start
+CSV_HEADER = ",".join(['timestamp', 'lavg', 'leq', 'temp_f', 'nsrt_id'] + PARAMS_COLUMNS) + "\n"
+CSV_ROW_FORMAT = "{0},{1},{2},{3},{4:d},{5}\n"  # timestamp, levels, temperature, meter, parameters
+DB_TRANSIENT_ERRORS = (InterfaceError, OperationalError, PoolTimeoutError)  # database unreachable, locked or busy
+FAN_OUT_QUEUE_MINUTES = 60  # default maximum minute blocks awaiting write per sink
+FAN_OUT_RETRY_ATTEMPTS = 3  # default retries of failed write before block is given up
+FAN_OUT_RETRY_SECONDS = 5.0  # initial wait after failed write or connect, doubled on each failure
+FAN_OUT_MAX_RETRY_SECONDS = 300.0  # maximum wait between attempts
+FAN_OUT_CLOSE_SECONDS = 60.0  # wait on close for each sink to write queued blocks
+
+
+def get_rollup_merge(table, inserted):
+    """
+    update expressions merging inserted partial period into existing rollup row: sums add,
+    extremes take greatest/least, levels are derived from merged sums (assigned first, so
+    they read the sums before update). Not idempotent, so each block is merged once only,
+    see DBDataManager.get_unwritten_blocks
+    :param table: rollup table
+    :param inserted: inserted values of upsert statement
+    :return: list of (column, update expression)
+    """
+    n_readings = table.c.n_readings + inserted.n_readings
+    return [('leq', 10. * func.log10((table.c.energy_sum + inserted.energy_sum) / n_readings)),
+            ('ldn', 10. * func.log10((table.c.ldn_energy_sum + inserted.ldn_energy_sum) / n_readings))] + \
+        [(col, table.c[col] + inserted[col]) for col in ROLLUP_SUM_COLUMNS] + \
+        [('lmax', func.greatest(table.c.lmax, inserted.lmax)), ('lmin', func.least(table.c.lmin, inserted.lmin))]
+
+
+def get_block_key(block: ReadingBlock):
+    """
+    :return: meter id and time of first reading of block, to microseconds as stored, identifying the block
+    """
+    return int(block.nsrt_id), pd.Timestamp(int(block.timestamp_ns[0])).floor('us')
+
 
 class DataManager:
     """
@@ -25,9 +97,33 @@ class DataManager:
         self._meter_info = meter_info
         self._message_handler = message_handler
 
-    def save_reading(self, data: pd.DataFrame):
+    def save_reading(self, data: ReadingBlock):
+        raise NotImplementedError  # implement in subclasses
+
+    def read_time_range(self, start: pd.Timestamp, end: pd.Timestamp, nsrt_ids: list = None,
+                        chunk_rows: int = EXPORT_CHUNK_ROWS):
+        """
+        stream saved readings of time range in bounded chunks
+        :param start: start of range, inclusive
+        :param end: end of range, exclusive
+        :param nsrt_ids: meter ids to read, all meters if None
+        :param chunk_rows: maximum rows per chunk
+        :return: generator of dataframes with columns nsrt_id, timestamp, lavg, leq, temp_f and meter
+        parameters (params_id where parameters are saved in a separate table)
+        """
         raise NotImplementedError  # implement in subclasses
 
+    def close(self):
+        pass  # override in subclasses holding connections or files
+
+    @staticmethod
+    def get_local_files(meter_info: dict):
+        """
+        :param meter_info: config information
+        :return: local files or folders the data manager would write, which no other data manager may share
+        """
+        return [Path(meter_info['spool-file'])] if meter_info.get('spool-file') else []
+
     def __str__(self):
         return str(self._meter_info)
 
@@ -40,47 +136,97 @@ class DBDataManager(DataManager):
     _target_alias: str = None  # target alias to seek in database config file
     _db_name: str = None  # name of database
     _datatable_name: str = None  # name of table for time series data
+    _minutetable_name: str = None  # name of table for per-minute statistics
+    _blocktable_name: str = None  # name of table of blocks written, so replayed blocks are skipped
+    _db_info: DBInfo = None  # pooled database connection, held for life of data manager
+    _params_registry: dict = None  # tuple of meter parameter values -> id in params table
+    _spool: DataSpool = None  # local spool which readings are committed to before database, if configured
+    _forwarder: SpoolForwarder = None  # drains spool to database
+    _partitions_month: pd.Period = None  # month in which future data table partitions were last checked
 
     def __init__(self, meter_info: dict, message_handler: MessageHandler):
         super(DBDataManager, self).__init__(meter_info, message_handler)
-        if not {'db-configfile', 'db-target-alias'}.issubset(set(list(self._meter_info.keys()))):
-            raise ValueError("config information must have specified db-configfile, db-target-alias")
-        self._db_configfile = self._meter_info['db-configfile']
-        self._target_alias = self._meter_info['db-target-alias']
-        db_info: DBInfo = DBInfo.dbinfo_from_configfile(config_filename=self._db_configfile,
-                                                        target_alias=self._target_alias,
-                                                        db=self._meter_info.get('db-name'),
-                                                        table=None)
-        self._db_name = self._meter_info.get('db-name') if self._meter_info.get('db-name') is not None else \
-            db_info.get_connection_data()['db']
+        self._db_info = self.connect_db()
+        self._db_name = self._db_info.get_db_name()
         self._datatable_name = '{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['data'])
-        if db_info.get_connection_data().get('table-name') is not None:
+        self._minutetable_name = '{0}_{1}'.format(TABLE_PREFIX, SUMMARY_TABLE_SUFFIXES['minute'])
+        self._blocktable_name = '{0}_{1}'.format(TABLE_PREFIX, SUMMARY_TABLE_SUFFIXES['block'])
+        if self._db_info.get_connection_data().get('table-name') is not None:
             message_handler.log("Disregarding entered config data table name: {0} in favor of {1}"
-                                .format(db_info.get_connection_data()['table-name'], self._datatable_name),
+                                .format(self._db_info.get_connection_data()['table-name'], self._datatable_name),
                                 logging.WARNING)
-        db_info.close()
         self.create_tables_if_not_exist()
+        for table_suffix in list(TABLE_SUFFIXES.values()) + list(SUMMARY_TABLE_SUFFIXES.values()):
+            # reflect tables up front, never from within a write transaction
+            self._db_info.get_table('{0}_{1}'.format(TABLE_PREFIX, table_suffix))
         self.initialize_meta_info()
+        self.load_params_registry()
+        if self._meter_info.get('spool-file'):
+            self._spool = DataSpool(self._meter_info['spool-file'])
+            self._forwarder = SpoolForwarder(self._spool, self.write_blocks, message_handler,
+                                             int(self._meter_info.get('spool-batch-minutes', SPOOL_BATCH_BLOCKS)),
+                                             DB_TRANSIENT_ERRORS,
+                                             int(self._meter_info.get('spool-dead-letter-attempts',
+                                                                      SPOOL_DEAD_LETTER_ATTEMPTS)))
+            self._forwarder.start()
+            message_handler.log("datamanager: spooling readings to {0}".format(self._meter_info['spool-file']))
+
+    def connect_db(self):
+        """
+        connect to database specified in config
+        :return: DBInfo with pooled connection
+        """
+        if not {'db-configfile', 'db-target-alias'}.issubset(set(list(self._meter_info.keys()))):
+            raise ValueError("config information must have specified db-configfile, db-target-alias")
+        self._db_configfile = self._meter_info['db-configfile']
+        self._target_alias = self._meter_info['db-target-alias']
+        return DBInfo.dbinfo_from_configfile(config_filename=self._db_configfile, target_alias=self._target_alias,
+                                             db=self._meter_info.get('db-name'), table=None,
+                                             engine_args=POOLED_ENGINE_ARGS)
 
     def create_tables_if_not_exist(self):
         """
         if meta, params, and data tables do not exist, create them
         :return: None
         """
-        db_info: DBInfo = DBInfo.dbinfo_from_configfile(config_filename=self._db_configfile,
-                                                        target_alias=self._target_alias,
-                                                        db=self._db_name,
-                                                        table=None)
         required_tables = ['{0}_{1}'.format(TABLE_PREFIX, table_suffix) for table_suffix in TABLE_SUFFIXES]
-        db_tables = db_info.get_table_list_from_engine()
+        db_tables = self._db_info.get_table_list_from_engine()
         if not set(required_tables).issubset(set(db_tables)):
             self._message_handler.log("datamanager: soundmeter data tables don't exist, creating data tables...")
             meter_info_ns = Namespace()
             meter_info_ns.config_file = self._db_configfile
             meter_info_ns.db_target_alias = self._target_alias
+            meter_info_ns.partition = bool(self._meter_info.get('partition-data', False))
             create_empty_database(meter_info_ns)
         else:
             self._message_handler.log("datamanager: soundmeter data tables present, continuing...")
+        try:
+            if ensure_params_unique_key(self._db_info):
+                self._message_handler.log("datamanager: added unique key to meter parameters table")
+        except Exception as ex:
+            self._message_handler.log("datamanager: could not add unique key to meter parameters table, "
+                                      "check for duplicate parameter rows: {0}".format(str(ex)), logging.WARNING)
+        for table_name in ensure_summary_tables(self._db_info):
+            self._message_handler.log("datamanager: created summary table {0}".format(table_name))
+        self.check_future_partitions()
+
+    def check_future_partitions(self):
+        """
+        once a month, add monthly partitions ahead of time if data table is partitioned, so readings
+        never land in the catch-all partition; failure is logged and retried next month
+        :return: None
+        """
+        this_month = pd.Timestamp.now().to_period('M')
+        if this_month == self._partitions_month:
+            return
+        self._partitions_month = this_month
+        try:
+            added = ensure_future_partitions(self._db_info)
+            if added:
+                self._message_handler.log("datamanager: added data table partitions {0}".format(", ".join(added)))
+        except Exception as ex:
+            self._message_handler.log("datamanager: could not add data table partitions: {0}".format(str(ex)),
+                                      logging.WARNING)
 
     def initialize_meta_info(self):
         """
@@ -97,71 +243,257 @@ class DBDataManager(DataManager):
             for k, v in meta_entry.items():
                 if 'time' in k:
                     meta_entry[k] = pd.Timestamp(v)
-            db_info: DBInfo = DBInfo.dbinfo_from_configfile(config_filename=self._db_configfile,
-                                                            target_alias=self._target_alias,
-                                                            db=self._db_name,
-                                                            table=metatable_name)
-            sql_str = "SELECT id FROM {0} WHERE {1} = {2}".format(metatable_name, 'id', meta_entry['id'])
-            has_meta: bool = len(db_info.read_sql_to_df(sql_str)) != 0
+            db_info: DBInfo = self._db_info
+            meta_table = db_info.get_table(metatable_name)
+            with db_info.get_engine().connect() as con:
+                has_meta: bool = con.execute(select(meta_table.c.id)
+                                             .where(meta_table.c.id == meta_entry['id'])).first() is not None
             if not has_meta:
                 self._message_handler.log("inserting metadata to table: \n {0}".format(str(meta_entry)))
                 db_info.insert_dict_to_table(table_name=metatable_name, insert_dict=meta_entry)
             else:
                 self._message_handler.log("metadata id already in table.")
-            db_info.close()
         except Exception as _:
             raise ValueError('meta-entry improperly specified!')
 
-    def save_reading(self, data: pd.DataFrame):
+    def save_reading(self, data: ReadingBlock):
         """
-        saves readings to database
+        saves readings to spool for forwarding to database if configured, otherwise directly to database
         :param data: one minute of sound meter data
         :return:None
         """
-        db_info: DBInfo = DBInfo.dbinfo_from_configfile(config_filename=self._db_configfile,
-                                                        target_alias=self._target_alias,
-                                                        db=self._db_name,
-                                                        table=self._datatable_name)
-        params_index = self.get_params_index(data.iloc[0, 4:], db_info)
-        data_out: pd.DataFrame = data.iloc[:, :4].copy()
-        data_out.insert(loc=0, column='params_id', value=params_index)
-        db_info.insert_df_to_table(table_name=self._datatable_name, df=data_out, if_exists='append')
-        db_info.close()
+        if self._spool is not None:
+            self._spool.append(data)
+            self._forwarder.notify()
+        else:
+            self.write_blocks([data])
+
+    def write_blocks(self, blocks: list):
+        """
+        writes blocks of readings to database, retrying once if the pooled connection was dropped mid-write
+        :param blocks: list of ReadingBlock
+        :return: None
+        """
+        self.check_future_partitions()
+        try:
+            self.write_blocks_to_tables(blocks)
+        except DBAPIError as ex:
+            if not ex.connection_invalidated:
+                raise ex
+            self._message_handler.log("database connection lost during write, reconnecting...", logging.WARNING)
+            self.write_blocks_to_tables(blocks)
+
+    def write_blocks_to_tables(self, blocks: list):
+        """
+        write blocks of readings to data table, their per-minute statistics to minute table and merge
+        them into hourly and daily rollups, over pooled connection in a single transaction which also
+        records the blocks in block table, so a block replayed after a committed write is skipped
+        :param blocks: list of ReadingBlock
+        :return: None
+        """
+        with self._db_info.get_engine().begin() as con:
+            blocks = self.get_unwritten_blocks(blocks, con)
+            if not blocks:
+                return
+            self.insert_blocks(blocks, con)
+            self._db_info.insert_records_to_table(self._blocktable_name, [
+                {'nsrt_id': nsrt_id, 'timestamp': timestamp} for nsrt_id, timestamp in map(get_block_key, blocks)], con)
+
+    def get_unwritten_blocks(self, blocks: list, con):
+        """
+        leave out blocks already written, e.g. replayed from spool after their write was committed
+        but not confirmed, as the rollups add each block to their sums
+        :param blocks: list of ReadingBlock
+        :param con: connection of write transaction
+        :return: list of ReadingBlock not in block table
+        """
+        blocks = [block for block in blocks if len(block) > 0]
+        if not blocks:
+            return blocks
+        block_keys = [get_block_key(block) for block in blocks]
+        block_table = self._db_info.get_table(self._blocktable_name)
+        rows = con.execute(select(block_table.c.nsrt_id, block_table.c.timestamp).where(and_(
+            block_table.c.nsrt_id.in_(sorted(set(nsrt_id for nsrt_id, _ in block_keys))),
+            block_table.c.timestamp >= min(timestamp for _, timestamp in block_keys),
+            block_table.c.timestamp <= max(timestamp for _, timestamp in block_keys)))).fetchall()
+        written = set((row[0], pd.Timestamp(row[1])) for row in rows)
+        unwritten = [block for block, block_key in zip(blocks, block_keys) if block_key not in written]
+        if len(unwritten) < len(blocks):
+            self._message_handler.log("datamanager: skipped {0:d} minutes of readings already written"
+                                      .format(len(blocks) - len(unwritten)), logging.WARNING)
+        return unwritten
 
-    def get_params_index(self, params: pd.Series, db_info: DBInfo):
+    def insert_blocks(self, blocks: list, con):
         """
-        tests to see if reading parameters are already represented in table,
-        if they are, return index, if not insert row and return index
+        write blocks of readings to data, minute and rollup tables
+        :param blocks: list of ReadingBlock
+        :param con: connection of write transaction
+        :return: None
+        """
+        data_out = []
+        for block in blocks:
+            params_indices = dict((k, self.get_params_index(v)) for k, v in block.params.items())
+            block_out: pd.DataFrame = block.to_frame(include_params=False)
+            block_out.insert(loc=0, column='params_id', value=pd.Series(block.params_id).map(params_indices).values)
+            data_out.append(block_out)
+        minute_stats = get_minute_stats_frame(blocks)
+        self._db_info.insert_records_to_table(self._datatable_name, df_to_records(pd.concat(data_out)), con,
+                                              ignore_duplicates=True)
+        self._db_info.upsert_records_to_table(self._minutetable_name, df_to_records(minute_stats),
+                                              MINUTE_STATS_COLUMNS, con)
+        for period in ROLLUP_PERIODS_NS:
+            self._db_info.upsert_records_to_table('{0}_{1}'.format(TABLE_PREFIX, SUMMARY_TABLE_SUFFIXES[period]),
+                                                  df_to_records(get_rollup_stats_frame(blocks, period)),
+                                                  get_rollup_merge, con)
+
+    def read_time_range(self, start: pd.Timestamp, end: pd.Timestamp, nsrt_ids: list = None,
+                        chunk_rows: int = EXPORT_CHUNK_ROWS):
+        return read_time_range(self._db_info, start, end, nsrt_ids, chunk_rows)
+
+    def close(self):
+        if self._forwarder is not None:
+            self._forwarder.close()
+            self._spool.close()
+        self._db_info.close()
+
+    def load_params_registry(self):
+        """
+        load all known meter parameter sets from params table, once at startup
+        :return: None
+        """
+        params_table = self._db_info.get_table('{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['params']))
+        with self._db_info.get_engine().connect() as con:
+            rows = con.execute(select(params_table)).fetchall()
+        self._params_registry = dict((tuple(row[k] for k in PARAMS_COLUMNS), row['id']) for row in rows)
+        self._message_handler.log("loaded {0:d} meter parameter sets".format(len(self._params_registry)))
+
+    def get_params_index(self, params: dict):
+        """
+        get id of reading parameters from registry, if not present insert to params table
+        and add to registry
         :param params: observed meter parameters from querying meter
-        :param db_info: database connection holder
         :return: integer id corresponding to parameter set
         """
-        paramstable_name = '{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['params'])
-        sql_str = "SELECT id FROM {0} WHERE ".format(paramstable_name)
-        for k, v in params.iteritems():
-            sql_str += "{0} = '{1}' AND ".format(k, v)
-        sql_str = sql_str[:-5] + ';'
-        select_df: pd.DataFrame = db_info.read_sql_to_df(sql_str)
-        all_rows: pd.DataFrame = db_info.read_sql_to_df('SELECT * FROM {0};'.format(paramstable_name))
-        if len(all_rows) == 0 or len(select_df) == 0:
-            param_id = 0 if len(all_rows) == 0 else all_rows['id'].max() + 1
-            insert_ind = pd.Index(data=[param_id], name='id')
-            insert_df: pd.DataFrame = pd.DataFrame(index=insert_ind, data=[params.values], columns=params.index)
-            db_info.insert_df_to_table(table_name=paramstable_name, df=insert_df, if_exists='append')
-            params_str = ", ".join(["{0}: {1}".format(k, v) for k, v in params.iteritems()])
+        params_key = tuple(str(params[k]) for k in PARAMS_COLUMNS)
+        if params_key not in self._params_registry:
+            param_id = self.insert_or_get_params(params_key)
+            self._params_registry[params_key] = param_id
+            params_str = ", ".join(["{0}: {1}".format(k, v) for k, v in zip(PARAMS_COLUMNS, params_key)])
             self._message_handler.log("new spl meter parameter set, index: {0:d} \n {1}".format(param_id, params_str))
-        else:
-            param_id = select_df.loc[0, 'id']
-        return param_id
+        return self._params_registry[params_key]
+
+    def insert_or_get_params(self, params_key: tuple):
+        """
+        select id of parameter set, inserting it with next free id if not present. A duplicate key
+        (unique key on parameter columns, or another writer took the same id) rolls back the insert
+        and the attempt is repeated; other database errors are raised.
+        :param params_key: parameter values in order of PARAMS_COLUMNS
+        :return: integer id corresponding to parameter set
+        """
+        params_table = self._db_info.get_table('{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['params']))
+        next_id = func.coalesce(func.max(params_table.c.id) + 1, 0)
+        insert_stmt = insert(params_table).from_select(['id'] + PARAMS_COLUMNS,
+                                                       select(next_id, *[literal(v) for v in params_key])
+                                                       .select_from(params_table))
+        select_stmt = select(params_table.c.id).where(
+            and_(*[params_table.c[k] == v for k, v in zip(PARAMS_COLUMNS, params_key)]))
+        last_error = None
+        for _ in range(PARAMS_INSERT_ATTEMPTS):
+            with self._db_info.get_engine().connect() as con:
+                param_id = con.execute(select_stmt).scalar()
+            if param_id is not None:
+                return int(param_id)
+            try:
+                with self._db_info.get_engine().begin() as con:
+                    con.execute(insert_stmt)
+            except IntegrityError as ex:  # inserted, or id taken, by another writer
+                last_error = ex
+        raise ValueError("could not insert meter parameter set {0}".format(params_key)) from last_error
+
+
+class SQLiteDataManager(DBDataManager):
+    """
+    implements DataManager for a local sqlite file with the tables of the mysql database, written
+    through the DBDataManager code paths. Each write is one transaction, with the write-ahead log
+    checkpointed and free pages vacuumed every sqlite-maintenance-hours.
+    """
+    _sqlite_file: str = None  # path of database file
+    _maintenance_seconds: float = None  # time between maintenance runs
+    _last_maintenance: float = None  # monotonic time of last maintenance run
+
+    @staticmethod
+    def get_local_files(meter_info: dict):
+        return DataManager.get_local_files(meter_info) + [Path(meter_info.get('sqlite-file', ''))]
+
+    def __init__(self, meter_info: dict, message_handler: MessageHandler):
+        super(SQLiteDataManager, self).__init__(meter_info, message_handler)
+        self._maintenance_seconds = 3600. * float(self._meter_info.get('sqlite-maintenance-hours',
+                                                                       SQLITE_MAINTENANCE_HOURS))
+        self._last_maintenance = time.monotonic()
+
+    def connect_db(self):
+        if 'sqlite-file' not in self._meter_info:
+            raise ValueError("config information must have specified sqlite-file")
+        self._sqlite_file = self._meter_info['sqlite-file']
+        return DBInfo.dbinfo_from_sqlite(self._sqlite_file)
+
+    def create_tables_if_not_exist(self):
+        """
+        create tables, with their keys and indexes, missing from sqlite file
+        :return: None
+        """
+        missing_tables = [table for table in Base.metadata.sorted_tables
+                          if table.name not in self._db_info.get_table_list_from_engine()]
+        if missing_tables:
+            self._message_handler.log("datamanager: creating tables {0} in {1}"
+                                      .format(", ".join(table.name for table in missing_tables), self._sqlite_file))
+            Base.metadata.create_all(bind=self._db_info.get_engine(), tables=missing_tables, checkfirst=True)
+
+    def check_future_partitions(self):
+        pass  # sqlite tables are not partitioned
+
+    def write_blocks(self, blocks: list):
+        super(SQLiteDataManager, self).write_blocks(blocks)
+        if time.monotonic() - self._last_maintenance >= self._maintenance_seconds:
+            self.run_maintenance()
+
+    def run_maintenance(self):
+        """
+        fold write-ahead log into database file and truncate it, release free pages and update
+        query planner statistics
+        :return: None
+        """
+        self._last_maintenance = time.monotonic()
+        maintenance_start = time.perf_counter()
+        with self._db_info.get_engine().connect() as con:
+            busy, log_pages, _ = con.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE);").first()
+            con.exec_driver_sql("PRAGMA incremental_vacuum;")
+            con.exec_driver_sql("PRAGMA optimize;")
+        self._message_handler.log("datamanager: sqlite maintenance, checkpointed {0:d} log pages{1} in {2:.2f} s"
+                                  .format(log_pages, " (busy)" if busy else "",
+                                          time.perf_counter() - maintenance_start))
 
 
 class CSVDataManager(DataManager):
     """
-    Implements DataManager for CSV files
+    Implements DataManager for CSV files. Rows are formatted directly from the reading arrays
+    and written through a file handle held open between minutes. Files are optionally rotated
+    by day or size, each with its own header, and closed files gzipped in a background thread.
     """
-    csv_location: str = None  # folder which holds csv file
-    csv_filename: str = None  # filename for csv file
-    csv_path: Path = None  # fully specified path for csv file, folder and filename
+    csv_location: str = None  # folder which holds csv files
+    csv_filename: str = None  # filename for csv file, stem and suffix of rotated files
+    csv_path: Path = None  # fully specified path for current csv file, folder and filename
+    _rotate: str = None  # 'none', 'day' or 'size'
+    _rotate_bytes: int = None  # size at which file is rotated, if rotating by size
+    _gzip: bool = False  # whether closed files are gzipped
+    _csv_file = None  # open handle of current csv file
+    _file_day: str = None  # day of current file, if rotating by day
+    _gzip_queue: queue.Queue = None  # closed files waiting to be gzipped
+    _gzip_thread: threading.Thread = None  # gzips closed files
+
+    @staticmethod
+    def get_local_files(meter_info: dict):
+        return [Path(meter_info.get('csv-location', ''), meter_info.get('csv-filename', ''))]
 
     def __init__(self, meter_info: dict, message_handler: MessageHandler):
         super(CSVDataManager, self).__init__(meter_info, message_handler)
@@ -169,20 +501,486 @@ class CSVDataManager(DataManager):
             raise ValueError("config information must have specified csv-location, csv-filename")
         self.csv_location = self._meter_info['csv-location']
         self.csv_filename = self._meter_info['csv-filename']
+        self._rotate = self._meter_info.get('csv-rotate', 'none')
+        if self._rotate not in CSV_ROTATE_OPTIONS:
+            raise ValueError("csv-rotate must be one of {0}".format(", ".join(CSV_ROTATE_OPTIONS)))
+        self._rotate_bytes = int(float(self._meter_info.get('csv-rotate-mb', CSV_ROTATE_MB)) * 1024 * 1024)
+        self._gzip = bool(self._meter_info.get('csv-gzip', False)) and self._rotate != 'none'
         if not Path(self.csv_location).exists():
             self._message_handler.log("creating directory {0}".format(self.csv_location))
-            os.mkdir(self.csv_location)
-        self.csv_path = Path(self.csv_location, self.csv_filename)
-        self._message_handler.log("csv Path {0}".format(self.csv_path))
-        self._message_handler.log("{0} exists? {1}".format(self.csv_path, self.csv_path.exists()))
+            Path(self.csv_location).mkdir(parents=True)
+        if self._gzip:
+            self._gzip_queue = queue.Queue()
+            self._gzip_thread = threading.Thread(target=self.run_gzip, name='csv-gzip')
+            self._gzip_thread.daemon = True
+            self._gzip_thread.start()
+            self.queue_unzipped_files()
 
-    def save_reading(self, data: pd.DataFrame):
+    def get_rotated_path(self, first_timestamp_ns: int):
         """
-        writes readings to csv file, with or without header as appropriate
-        :param data:
-        :return:
+        :param first_timestamp_ns: timestamp of first reading to be written to file
+        :return: path of new file, named by day or by first reading per rotation
         """
-        if self.csv_path.exists():
-            data.to_csv(path_or_buf=self.csv_path, header=False, index=True, mode='a')
-        else:
-            data.to_csv(path_or_buf=self.csv_path, header=True, index=True, mode='w')
+        if self._rotate == 'none':
+            return Path(self.csv_location, self.csv_filename)
+        name_form = CSV_DAY_FORMAT if self._rotate == 'day' else CSV_SIZE_FORMAT
+        file_time = pd.Timestamp(first_timestamp_ns).strftime(name_form)
+        return Path(self.csv_location, '{0}_{1}{2}'.format(Path(self.csv_filename).stem, file_time,
+                                                            Path(self.csv_filename).suffix))
+
+    def open_file(self, first_timestamp_ns: int):
+        """
+        open file for block starting at first_timestamp_ns, appending to file if present,
+        with header if file is new
+        :return: None
+        """
+        self.csv_path = self.get_rotated_path(first_timestamp_ns)
+        self._file_day = pd.Timestamp(first_timestamp_ns).strftime(CSV_DAY_FORMAT)
+        self._message_handler.log("csv Path {0}, exists? {1}".format(self.csv_path, self.csv_path.exists()))
+        self._csv_file = open(self.csv_path, 'a', buffering=CSV_BUFFER_BYTES, newline='')
+        if self._csv_file.tell() == 0:
+            self._csv_file.write(CSV_HEADER)
+
+    def close_file(self):
+        """
+        close current file, queueing it to be gzipped if configured
+        :return: None
+        """
+        if self._csv_file is None:
+            return
+        self._csv_file.close()
+        self._csv_file = None
+        if self._gzip:
+            self._gzip_queue.put(self.csv_path)
+
+    def check_rotation(self, first_timestamp_ns: int):
+        """
+        close current file if block starting at first_timestamp_ns belongs in a new file
+        :return: None
+        """
+        if self._csv_file is None or self._rotate == 'none':
+            return
+        if (self._rotate == 'day' and pd.Timestamp(first_timestamp_ns).strftime(CSV_DAY_FORMAT) != self._file_day) \
+                or (self._rotate == 'size' and self._csv_file.tell() >= self._rotate_bytes):
+            self.close_file()
+
+    @staticmethod
+    def format_rows(data: ReadingBlock):
+        """
+        :return: csv rows of block, columns as CSV_HEADER, values formatted as by DataFrame.to_csv
+        (microsecond timestamps, shortest repr of float32 values)
+        """
+        timestamps = np.char.replace(np.datetime_as_string(data.timestamp_ns.astype('datetime64[ns]')
+                                                           .astype('datetime64[us]')), 'T', ' ')
+        params = dict((k, ",".join(str(v[col]) for col in PARAMS_COLUMNS)) for k, v in data.params.items())
+        return "".join([CSV_ROW_FORMAT.format(timestamp, lavg, leq, temp_f, data.nsrt_id, params[params_id])
+                        for timestamp, lavg, leq, temp_f, params_id in
+                        zip(timestamps, data.lavg.astype(str), data.leq.astype(str), data.temp_f.astype(str),
+                            data.params_id.tolist())])
+
+    def save_reading(self, data: ReadingBlock):
+        """
+        writes readings to current csv file, rotating file first if due
+        :param data: one minute of sound meter data
+        :return: None
+        """
+        if len(data) == 0:
+            return
+        first_timestamp_ns = int(data.timestamp_ns[0])
+        self.check_rotation(first_timestamp_ns)
+        if self._csv_file is None:
+            self.open_file(first_timestamp_ns)
+        self._csv_file.write(self.format_rows(data))
+        self._csv_file.flush()
+
+    def queue_unzipped_files(self):
+        """
+        queue rotated files left unzipped by previous run, except the file for today if rotating
+        by day, and remove incomplete gzip files
+        :return: None
+        """
+        stem, suffix = Path(self.csv_filename).stem, Path(self.csv_filename).suffix
+        for tmp_path in Path(self.csv_location).glob('{0}_*{1}.gz.tmp'.format(stem, suffix)):
+            tmp_path.unlink()
+        current_path = self.get_rotated_path(pd.Timestamp.now().value) if self._rotate == 'day' else None
+        for csv_path in sorted(Path(self.csv_location).glob('{0}_*{1}'.format(stem, suffix))):
+            if csv_path != current_path:  # files rotated by size are never resumed
+                self._gzip_queue.put(csv_path)
+
+    def run_gzip(self):
+        """
+        gzip closed files to .gz, written under a temporary name and renamed when complete,
+        then remove uncompressed file; None on queue stops thread
+        :return: None
+        """
+        while True:
+            csv_path = self._gzip_queue.get()
+            if csv_path is None:
+                return
+            try:
+                gzip_path = Path('{0}.gz'.format(csv_path))
+                tmp_path = Path('{0}.tmp'.format(gzip_path))
+                with open(csv_path, 'rb') as f_in, gzip.open(tmp_path, 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out, CSV_BUFFER_BYTES)
+                os.replace(tmp_path, gzip_path)
+                csv_path.unlink()
+            except Exception as ex:
+                self._message_handler.log("csv: could not gzip {0}: {1}".format(csv_path, str(ex)),
+                                          logging.WARNING)
+
+    def close(self):
+        if self._csv_file is not None:
+            self._csv_file.close()  # resumed, or gzipped at next start
+            self._csv_file = None
+        if self._gzip:
+            self._gzip_queue.put(None)
+            self._gzip_thread.join(CSV_GZIP_CLOSE_SECONDS)
+
+
+class ParquetDataManager(DataManager):
+    """
+    Implements DataManager for parquet files, one file of typed, compressed columns per day.
+    Minutes of readings are buffered and written as row groups, each to its own file in a
+    folder for the day; when the day is over, its row groups are compacted into the day file.
+    Files are written under a temporary name and renamed when complete, so a crash leaves at
+    most an incomplete temporary file, removed at next start.
+    """
+    _parquet_location: Path = None  # folder which holds day files and row group folders
+    _rowgroup_minutes: int = None  # minutes of readings buffered per row group
+    _compression: str = None  # parquet column compression codec
+    _pending: list = None  # dataframes of buffered minutes
+    _open_day: str = None  # day of buffered readings, PARQUET_DAY_FORMAT
+
+    @staticmethod
+    def get_local_files(meter_info: dict):
+        return [Path(meter_info.get('parquet-location', ''))]
+
+    def __init__(self, meter_info: dict, message_handler: MessageHandler):
+        super(ParquetDataManager, self).__init__(meter_info, message_handler)
+        if pq is None:
+            raise ImportError("ParquetDataManager requires pyarrow")
+        if 'parquet-location' not in self._meter_info:
+            raise ValueError("config information must have specified parquet-location")
+        self._parquet_location = Path(self._meter_info['parquet-location'])
+        self._rowgroup_minutes = int(self._meter_info.get('parquet-rowgroup-minutes', PARQUET_ROWGROUP_MINUTES))
+        self._compression = self._meter_info.get('parquet-compression', PARQUET_COMPRESSION)
+        self._pending = []
+        if not self._parquet_location.exists():
+            self._message_handler.log("creating directory {0}".format(self._parquet_location))
+            self._parquet_location.mkdir(parents=True)
+        self.recover_files()
+
+    def recover_files(self):
+        """
+        remove temporary files left by a crash and compact row groups of days before today
+        :return: None
+        """
+        for tmp_path in list(self._parquet_location.glob('*.tmp')) + \
+                list(self._parquet_location.glob('{0}/*.tmp'.format(PARQUET_PARTS_FORM.format('*')))):
+            self._message_handler.log("datamanager: removing incomplete file {0}".format(tmp_path), logging.WARNING)
+            tmp_path.unlink()
+        today = pd.Timestamp.now().strftime(PARQUET_DAY_FORMAT)
+        for parts_dir in sorted(self._parquet_location.glob(PARQUET_PARTS_FORM.format('*'))):
+            day = parts_dir.name[len(PARQUET_PARTS_FORM.format('')):]
+            if parts_dir.is_dir() and day < today:
+                self.compact_day(day)
+
+    def get_day_path(self, day: str):
+        return Path(self._parquet_location, PARQUET_FILENAME_FORM.format(day))
+
+    def get_parts_dir(self, day: str):
+        return Path(self._parquet_location, PARQUET_PARTS_FORM.format(day))
+
+    @staticmethod
+    def block_to_frame(block: ReadingBlock):
+        """
+        :return: dataframe of block with typed columns, meter parameters as strings
+        """
+        frame = block.to_frame(include_params=True).reset_index()
+        frame['nsrt_id'] = frame['nsrt_id'].astype('int32')
+        for col in PARAMS_COLUMNS:
+            frame[col] = frame[col].astype(str)
+        return frame[['nsrt_id', 'timestamp', 'lavg', 'leq', 'temp_f'] + PARAMS_COLUMNS]
+
+    def save_reading(self, data: ReadingBlock):
+        """
+        buffer readings, writing a row group once parquet-rowgroup-minutes are buffered or the day changes
+        :param data: one minute of sound meter data
+        :return: None
+        """
+        frame = self.block_to_frame(data)
+        for day, day_frame in frame.groupby(frame['timestamp'].dt.strftime(PARQUET_DAY_FORMAT), sort=True):
+            if self._open_day is not None and day != self._open_day:
+                self.write_pending()
+                self.compact_day(self._open_day)
+            self._open_day = day
+            self._pending.append(day_frame)
+        if len(self._pending) >= self._rowgroup_minutes:
+            self.write_pending()
+
+    def write_pending(self):
+        """
+        write buffered readings as one row group file in folder of open day
+        :return: None
+        """
+        if not self._pending:
+            return
+        table = pa.Table.from_pandas(pd.concat(self._pending), preserve_index=False)
+        self._pending = []
+        parts_dir = self.get_parts_dir(self._open_day)
+        parts_dir.mkdir(exist_ok=True)
+        part_path = Path(parts_dir, '{0}.parquet'.format(
+            pd.Timestamp(table.column('timestamp')[0].as_py()).strftime('%H%M%S%f')))
+        tmp_path = part_path.with_suffix('.tmp')
+        pq.write_table(table, str(tmp_path), compression=self._compression)
+        os.replace(tmp_path, part_path)
+
+    def compact_day(self, day: str):
+        """
+        merge row group files of a day, and day file if already present, into a new day file,
+        then remove row group folder. Parts already merged (crash before folder removal) are listed
+        in day file metadata and skipped.
+        :param day: day to compact, PARQUET_DAY_FORMAT
+        :return: None
+        """
+        day_path, parts_dir = self.get_day_path(day), self.get_parts_dir(day)
+        merged = []
+        sources = []
+        if day_path.exists():
+            metadata = pq.read_schema(str(day_path)).metadata or {}
+            merged = metadata.get(PARQUET_PARTS_KEY, b'').decode().split(',')
+        part_paths = [part_path for part_path in sorted(parts_dir.glob('*.parquet')) if part_path.name not in merged]
+        if part_paths:
+            sources = ([day_path] if day_path.exists() else []) + part_paths
+            schema = pq.read_schema(str(part_paths[0])).with_metadata(
+                {PARQUET_PARTS_KEY: ','.join(merged + [part_path.name for part_path in part_paths]).encode()})
+            tmp_path = day_path.with_suffix('.tmp')
+            with pq.ParquetWriter(str(tmp_path), schema, compression=self._compression) as writer:
+                batch, batch_rows = [], 0
+                for source in sources:
+                    table = pq.read_table(str(source)).replace_schema_metadata(schema.metadata)
+                    batch.append(table)
+                    batch_rows += table.num_rows
+                    if batch_rows >= PARQUET_COMPACT_ROWS:
+                        writer.write_table(pa.concat_tables(batch), row_group_size=PARQUET_COMPACT_ROWS)
+                        batch, batch_rows = [], 0
+                if batch:
+                    writer.write_table(pa.concat_tables(batch), row_group_size=PARQUET_COMPACT_ROWS)
+            os.replace(tmp_path, day_path)
+            self._message_handler.log("datamanager: compacted {0:d} row groups into {1}"
+                                      .format(len(part_paths), day_path))
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    def get_day_sources(self, day: str):
+        """
+        :return: files holding readings of day, day file and row group files not yet compacted
+        """
+        day_path = self.get_day_path(day)
+        return ([day_path] if day_path.exists() else []) + sorted(self.get_parts_dir(day).glob('*.parquet'))
+
+    def read_time_range(self, start: pd.Timestamp, end: pd.Timestamp, nsrt_ids: list = None,
+                        chunk_rows: int = EXPORT_CHUNK_ROWS):
+        for day in pd.date_range(start.floor('D'), (end - pd.Timedelta(1)).floor('D'), freq='D')\
+                .strftime(PARQUET_DAY_FORMAT):
+            for source in self.get_day_sources(day):
+                for batch in pq.ParquetFile(str(source)).iter_batches(batch_size=chunk_rows):
+                    chunk = batch.to_pandas()
+                    chunk = chunk[(chunk['timestamp'] >= start) & (chunk['timestamp'] < end)]
+                    if nsrt_ids:
+                        chunk = chunk[chunk['nsrt_id'].isin(nsrt_ids)]
+                    if len(chunk):
+                        yield chunk.reset_index(drop=True)
+
+    def close(self):
+        self.write_pending()
+
+
+class DataSink:
+    """
+    DataManager fed from its own bounded queue by a worker thread. The data manager is created by
+    the worker, failed creation and failed writes are retried with exponential backoff, and blocks
+    arriving while the queue is full are dropped and counted, so a slow or failed sink holds up
+    neither other sinks nor the caller.
+    """
+    _datamanager_name: str = None  # name of DataManager class in this module
+    _meter_info: dict = None  # config information passed to data manager
+    _message_handler: MessageHandler = None  # logging interface
+    _data_manager: DataManager = None  # data manager, None until created by worker
+    _queue: queue.Queue = None  # minute blocks awaiting write, None stops worker
+    _retry_attempts: int = None  # retries of failed write before block is given up
+    _counts: dict = None  # minute blocks written, dropped (queue full) and failed
+    _stop_event: threading.Event = None  # interrupts retry waits on close
+    _thread: threading.Thread = None  # worker thread
+
+    def __init__(self, datamanager_name: str, meter_info: dict, message_handler: MessageHandler):
+        self._datamanager_name = datamanager_name
+        self._meter_info = meter_info
+        self._message_handler = message_handler
+        self._queue = queue.Queue(maxsize=int(meter_info.get('fan-out-queue-minutes', FAN_OUT_QUEUE_MINUTES)))
+        self._retry_attempts = int(meter_info.get('fan-out-retry-attempts', FAN_OUT_RETRY_ATTEMPTS))
+        self._counts = {'written': 0, 'dropped': 0, 'failed': 0}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.run_sink, name='sink-{0}'.format(datamanager_name))
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, block: ReadingBlock):
+        try:
+            self._queue.put_nowait(block)
+        except queue.Full:
+            self._counts['dropped'] += 1
+            self._message_handler.log("sink {0}: queue full, minute dropped ({1:d} dropped)"
+                                      .format(self._datamanager_name, self._counts['dropped']), logging.WARNING)
+
+    def create_data_manager(self):
+        """
+        create data manager, retrying with backoff until created or sink is closed
+        :return: True if created
+        """
+        datamanager_class = getattr(sys.modules[__name__], self._datamanager_name)
+        retry_seconds = FAN_OUT_RETRY_SECONDS
+        while not self._stop_event.is_set():
+            try:
+                self._data_manager = datamanager_class(self._meter_info, self._message_handler)
+                self._message_handler.log("sink {0}: data manager created".format(self._datamanager_name))
+                return True
+            except Exception as ex:
+                self._message_handler.log("sink {0}: could not create data manager, retrying in {1:.0f} s: {2}"
+                                          .format(self._datamanager_name, retry_seconds, str(ex)),
+                                          logging.CRITICAL)
+                self._stop_event.wait(retry_seconds)
+                retry_seconds = min(2. * retry_seconds, FAN_OUT_MAX_RETRY_SECONDS)
+        return False
+
+    def write_block(self, block: ReadingBlock):
+        """
+        save block, retrying failed writes with backoff up to retry attempts
+        :return: None
+        """
+        retry_seconds = FAN_OUT_RETRY_SECONDS
+        for attempt in range(self._retry_attempts + 1):
+            try:
+                self._data_manager.save_reading(block)
+                self._counts['written'] += 1
+                return
+            except Exception as ex:
+                if attempt == self._retry_attempts or self._stop_event.is_set():
+                    self._counts['failed'] += 1
+                    self._message_handler.log("sink {0}: write failed, minute given up: {1}"
+                                              .format(self._datamanager_name, str(ex)), logging.CRITICAL)
+                    return
+                self._message_handler.log("sink {0}: write failed, retrying in {1:.0f} s: {2}"
+                                          .format(self._datamanager_name, retry_seconds, str(ex)), logging.WARNING)
+                self._stop_event.wait(retry_seconds)
+                retry_seconds = min(2. * retry_seconds, FAN_OUT_MAX_RETRY_SECONDS)
+
+    def run_sink(self):
+        """
+        create data manager, then write queued blocks until stop sentinel (None) received or sink closed
+        :return: None
+        """
+        if not self.create_data_manager():
+            return
+        while True:
+            block: ReadingBlock = self._queue.get()
+            if block is None or self._stop_event.is_set():
+                break
+            self.write_block(block)
+
+    def get_data_manager(self):
+        return self._data_manager
+
+    def close(self, timeout: float = FAN_OUT_CLOSE_SECONDS):
+        """
+        write queued blocks and close data manager; after timeout, retries are cut short and
+        blocks still queued are left unwritten
+        :param timeout: seconds to wait for queued writes
+        :return: None
+        """
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._stop_event.set()
+        self._thread.join(FAN_OUT_RETRY_SECONDS)
+        if self._data_manager is not None and not self._thread.is_alive():
+            self._data_manager.close()
+        self._message_handler.log("sink {0} closed: {1}, {2:d} left queued"
+                                  .format(self._datamanager_name, self._counts,
+                                          len([block for block in list(self._queue.queue) if block is not None])))
+
+
+class FanOutDataManager(DataManager):
+    """
+    Implements DataManager writing each minute of readings to several DataManagers, listed in
+    fan-out-managers, each through its own DataSink. Each entry is either the name of a data
+    manager, or a section with key data-manager and entries overriding the config information
+    for that data manager only (e.g. its own spool-file or db-target-alias).
+    """
+    _sinks: list = None  # DataSink per configured data manager
+
+    def __init__(self, meter_info: dict, message_handler: MessageHandler):
+        super(FanOutDataManager, self).__init__(meter_info, message_handler)
+        sink_infos = self.get_sink_infos(self._meter_info)
+        self._sinks = [DataSink(sink_info['data-manager'], sink_info, message_handler) for sink_info in sink_infos]
+        for sink in self._sinks:
+            sink.start()
+
+    @staticmethod
+    def get_sink_infos(meter_info: dict):
+        """
+        config information of each sink, a copy of meter_info with the sink's own entries applied.
+        Sinks whose local files (spool, sqlite, csv or parquet) coincide are rejected.
+        :param meter_info: config information of fan-out data manager
+        :return: list of config information dictionaries
+        """
+        entries = meter_info.get('fan-out-managers')
+        if not entries:
+            raise ValueError("config information must have specified fan-out-managers")
+        sink_infos = []
+        local_files = {}  # resolved path -> data manager writing it
+        for entry in entries:
+            sink_info = copy.deepcopy(meter_info)
+            sink_info.update(copy.deepcopy(entry) if isinstance(entry, dict) else {'data-manager': entry})
+            datamanager_name = sink_info.get('data-manager')
+            datamanager_class = getattr(sys.modules[__name__], str(datamanager_name), None)
+            if not isinstance(datamanager_class, type) or not issubclass(datamanager_class, DataManager) \
+                    or issubclass(datamanager_class, FanOutDataManager):
+                raise ValueError("fan-out-managers entry {0} is not a data manager".format(datamanager_name))
+            for local_file in datamanager_class.get_local_files(sink_info):
+                local_file = local_file.resolve()
+                if local_file in local_files:
+                    raise ValueError("fan-out-managers {0} and {1} would both write {2}, give each its own "
+                                     "entry".format(local_files[local_file], datamanager_name, local_file))
+                local_files[local_file] = datamanager_name
+            sink_infos.append(sink_info)
+        return sink_infos
+
+    def save_reading(self, data: ReadingBlock):
+        """
+        queue readings to each sink, without waiting for writes
+        :param data: one minute of sound meter data
+        :return: None
+        """
+        for sink in self._sinks:
+            sink.put(data)
+
+    def read_time_range(self, start: pd.Timestamp, end: pd.Timestamp, nsrt_ids: list = None,
+                        chunk_rows: int = EXPORT_CHUNK_ROWS):
+        """
+        read from first sink whose data manager is created
+        """
+        for sink in self._sinks:
+            if sink.get_data_manager() is not None:
+                return sink.get_data_manager().read_time_range(start, end, nsrt_ids, chunk_rows)
+        raise ValueError("no data manager of fan-out-managers is available")
+
+    def close(self):
+        closers = [threading.Thread(target=sink.close, name='close-sink') for sink in self._sinks]
+        for closer in closers:
+            closer.start()
+        for closer in closers:
+            closer.join()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+bring the data table of an existing deployment up to the current schema while readings continue
+to be written: add time indexes, move readings into a monthly partitioned table, keep partitions
+ready ahead of time and drop old months of readings
+"""
+import argparse
+import sys
+import time
+import traceback
+
+import pandas as pd
+from sqlalchemy import text
+
+from datatablecreate import DATA_TABLE_NAME, PARTITION_MONTHS_AHEAD, drop_partitions_before, ensure_data_indexes, \
+    ensure_future_partitions, get_data_partitions, partition_data_table
+from dbinfo import DBInfo
+
+MIGRATE_ACTIONS = ['indexes', 'partition', 'add-partitions', 'prune']
+MIGRATE_BATCH_ROWS = 50000  # default rows copied per statement when partitioning
+AUTO_INCREMENT_MARGIN = 1000000  # ids left free for readings written to old table during swap
+
+
+def copy_rows(db_info: DBInfo, from_table: str, to_table: str, after_id: int, last_id: int, batch_rows: int):
+    """
+    copy rows with ids after after_id up to last_id, one batch of ids per transaction
+    :return: None
+    """
+    while after_id < last_id:
+        batch_start = time.perf_counter()
+        batch_last_id = min(after_id + batch_rows, last_id)
+        with db_info.get_engine().begin() as con:
+            n_rows = con.execute(text("INSERT INTO {0} SELECT * FROM {1} WHERE id > :after_id AND id <= :last_id;"
+                                      .format(to_table, from_table)),
+                                 {'after_id': after_id, 'last_id': batch_last_id}).rowcount
+        print("copied {0:d} rows, ids to {1:d} of {2:d}, in {3:.1f} s"
+              .format(n_rows, batch_last_id, last_id, time.perf_counter() - batch_start))
+        after_id = batch_last_id
+
+
+def migrate_to_partitioned(db_info: DBInfo, batch_rows: int = MIGRATE_BATCH_ROWS):
+    """
+    replace unpartitioned data table by a monthly partitioned copy: readings are copied in batches
+    to a partitioned shadow table, which is swapped in by atomic rename, after which readings written
+    to the old table during the copy are carried over. The old table is kept for inspection.
+    :param db_info: database connection holder
+    :param batch_rows: ids copied per statement
+    :return: None
+    """
+    if get_data_partitions(db_info):
+        print("{0} is already partitioned".format(DATA_TABLE_NAME))
+        return
+    for index_name in ensure_data_indexes(db_info):
+        print("added index {0}".format(index_name))
+    new_table, old_table = '{0}_new'.format(DATA_TABLE_NAME), '{0}_old'.format(DATA_TABLE_NAME)
+    with db_info.get_engine().connect() as con:
+        first, last_id = con.execute(text("SELECT MIN(timestamp), MAX(id) FROM {0};".format(DATA_TABLE_NAME))).first()
+        con.execute(text("CREATE TABLE {0} LIKE {1};".format(new_table, DATA_TABLE_NAME)))
+    partition_data_table(db_info, new_table, pd.Timestamp(first) if first is not None else pd.Timestamp.now())
+    copy_rows(db_info, DATA_TABLE_NAME, new_table, 0, last_id or 0, batch_rows)
+    with db_info.get_engine().connect() as con:
+        swap_id = con.execute(text("SELECT MAX(id) FROM {0};".format(DATA_TABLE_NAME))).scalar() or 0
+        con.execute(text("ALTER TABLE {0} AUTO_INCREMENT = {1:d};".format(new_table, swap_id + AUTO_INCREMENT_MARGIN)))
+        con.execute(text("RENAME TABLE {0} TO {1}, {2} TO {0};".format(DATA_TABLE_NAME, old_table, new_table)))
+    print("swapped in partitioned {0}, copying rows written during copy...".format(DATA_TABLE_NAME))
+    with db_info.get_engine().connect() as con:
+        final_id = con.execute(text("SELECT MAX(id) FROM {0};".format(old_table))).scalar() or 0
+    copy_rows(db_info, old_table, DATA_TABLE_NAME, last_id or 0, final_id, batch_rows)
+    db_info.invalidate_table_cache()
+    print("migration complete, drop {0} once satisfied with {1}".format(old_table, DATA_TABLE_NAME))
+
+
+def main():
+    try:
+        my_parser = argparse.ArgumentParser(prog='datamigrate',
+                                            description='Add indexes and monthly partitions to sound meter data '
+                                                        'table of existing database, without stopping writers')
+        my_parser.add_argument('action', type=str, choices=MIGRATE_ACTIONS,
+                               help='indexes: add time indexes; partition: move readings to monthly partitioned '
+                                    'table; add-partitions: add monthly partitions ahead of time; prune: drop '
+                                    'partitions of readings before --before')
+        my_parser.add_argument('--config_file', type=str, help='database config file')
+        my_parser.add_argument('--db_target_alias', type=str, help='target alias to find in config file')
+        my_parser.add_argument('--before', type=str, help='prune: drop months of readings before, e.g. 2022-01-01')
+        my_parser.add_argument('--months_ahead', type=int, default=PARTITION_MONTHS_AHEAD,
+                               help='add-partitions: months beyond current month to add partitions for')
+        my_parser.add_argument('--batch_rows', type=int, default=MIGRATE_BATCH_ROWS,
+                               help='partition: rows copied per statement')
+        args: argparse.Namespace = my_parser.parse_args()
+        db_info: DBInfo = DBInfo.dbinfo_from_configfile(args.config_file, args.db_target_alias)
+        if args.action == 'indexes':
+            print("added indexes: {0}".format(", ".join(ensure_data_indexes(db_info)) or "none"))
+        elif args.action == 'partition':
+            migrate_to_partitioned(db_info, args.batch_rows)
+        elif args.action == 'add-partitions':
+            print("added partitions: {0}".format(", ".join(ensure_future_partitions(db_info, args.months_ahead))
+                                                 or "none"))
+        elif args.action == 'prune':
+            if not args.before:
+                raise ValueError("prune requires --before")
+            print("dropped partitions: {0}".format(", ".join(drop_partitions_before(db_info, pd.Timestamp(args.before)))
+                                                   or "none"))
+        db_info.close()
+
+    except Exception as ex:
+        print("Exception in user code:")
+        print('-' * 60)
+        print(str(ex))
+        traceback.print_exc(file=sys.stdout)
+        print('-' * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,24 +7,40 @@ import os
 import sys
 import traceback
 
-from sqlalchemy import Column, ForeignKey, Integer, BigInteger, String, Float, inspect
-from sqlalchemy.ext.declarative import declarative_base
+import pandas as pd
+from sqlalchemy import Column, ForeignKey, Index, Integer, BigInteger, PrimaryKeyConstraint, String, Float, inspect, \
+    text
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import relationship
 from dbinfo import DBInfo
-from sqlalchemy.dialects.mysql import DATETIME
+from sqlalchemy.dialects.mysql import DATETIME, DOUBLE
 Base = declarative_base()
 
 TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
 MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 TABLE_PREFIX = 'nsrt'
 TABLE_SUFFIXES = {'data': 'data', 'meta': 'meta', 'params': 'params'}
+PARAMS_COLUMNS = ['tau', 'wt', 'freq', 'serial_number', 'firmware_revision', 'date_of_birth',
+                  'date_of_calibration']  # columns which together identify a meter parameter set
+PARAMS_UNIQUE_KEY = 'uq_{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['params'])
+SUMMARY_TABLE_SUFFIXES = {'minute': 'minute', 'hour': 'hour', 'day': 'day',
+                          'block': 'block'}  # summaries of data table, added to existing databases if missing
+DATA_TABLE_NAME = '{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['data'])
+DATA_INDEXES = {'ix_{0}_timestamp'.format(DATA_TABLE_NAME): ['timestamp'],
+                'uq_{0}_nsrt_id_timestamp'.format(DATA_TABLE_NAME): ['nsrt_id', 'timestamp']}  # time-range reads
+DATA_UNIQUE_INDEXES = ['uq_{0}_nsrt_id_timestamp'.format(DATA_TABLE_NAME)]  # replayed readings are not inserted twice
+DATA_SUPERSEDED_INDEXES = ['ix_{0}_nsrt_id_timestamp'.format(DATA_TABLE_NAME)]  # dropped once unique key is added
+PARTITION_NAME_FORMAT = 'p%Y%m'  # monthly partition of data table, holds readings of that month
+PARTITION_MAX = 'pmax'  # catch-all partition for readings beyond last monthly partition
+PARTITION_MONTHS_AHEAD = 3  # monthly partitions kept ready beyond current month
 # https://www.pythoncentral.io/introductory-tutorial-python-sqlalchemy/
 # http://docs.sqlalchemy.org/en/latest/orm/basic_relationships.html
 
 
 class nsrt_data(Base):
     __tablename__ = '{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['data'])
-    id = Column(BigInteger(), primary_key=True, autoincrement=True)  # auto, starts at zero
+    id = Column(BigInteger().with_variant(Integer(), 'sqlite'), primary_key=True,
+                autoincrement=True)  # auto, starts at zero; INTEGER key is autoincremented rowid in sqlite
     timestamp = Column(DATETIME(fsp=6), nullable=False)
     lavg = Column(Float(), nullable=False)
     leq = Column(Float(), nullable=False)
@@ -33,6 +49,8 @@ class nsrt_data(Base):
     nsrt_id = Column(Integer(), ForeignKey('nsrt_meta.id'))
     nsrt_meta = relationship("nsrt_meta")
     spl_params = relationship("spl_params")
+    __table_args__ = tuple(Index(index_name, *index_cols, unique=index_name in DATA_UNIQUE_INDEXES)
+                           for index_name, index_cols in DATA_INDEXES.items())
 
 
 class nsrt_params(Base):
@@ -45,6 +63,60 @@ class nsrt_params(Base):
     firmware_revision = Column(String(10), nullable=False)
     date_of_birth = Column(String(20), nullable=False)
     date_of_calibration = Column(String(20), nullable=False)
+    __table_args__ = (Index(PARAMS_UNIQUE_KEY, *PARAMS_COLUMNS, unique=True),)
+
+
+class nsrt_minute(Base):
+    __tablename__ = '{0}_{1}'.format(TABLE_PREFIX, SUMMARY_TABLE_SUFFIXES['minute'])
+    nsrt_id = Column(Integer(), ForeignKey('nsrt_meta.id'), primary_key=True, autoincrement=False)
+    timestamp = Column(DATETIME(), primary_key=True)  # start of minute
+    leq = Column(Float(), nullable=False)  # energetic average of reading leq
+    l10 = Column(Float(), nullable=False)  # lavg exceeded 10% of minute
+    l50 = Column(Float(), nullable=False)
+    l90 = Column(Float(), nullable=False)
+    lmax = Column(Float(), nullable=False)
+    lmin = Column(Float(), nullable=False)
+    n_readings = Column(Integer(), nullable=False)
+
+
+class nsrt_block(Base):
+    __tablename__ = '{0}_{1}'.format(TABLE_PREFIX, SUMMARY_TABLE_SUFFIXES['block'])
+    nsrt_id = Column(Integer(), ForeignKey('nsrt_meta.id'), primary_key=True, autoincrement=False)
+    timestamp = Column(DATETIME(fsp=6), primary_key=True)  # first reading of block written to rollups, so a
+    # replayed block is not added to them twice
+
+
+class RollupColumns:
+    """
+    columns of hourly and daily rollups, see levelstats; sums merge exactly across partial periods
+    """
+    @declared_attr
+    def nsrt_id(cls):
+        return Column(Integer(), ForeignKey('nsrt_meta.id'), nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return PrimaryKeyConstraint('nsrt_id', 'timestamp'),
+    timestamp = Column(DATETIME(), nullable=False)  # start of period
+    leq = Column(Float(), nullable=False)  # 10 log10(energy_sum / n_readings)
+    ldn = Column(Float(), nullable=False)  # 10 log10(ldn_energy_sum / n_readings)
+    energy_sum = Column(DOUBLE().with_variant(Float(), 'sqlite'), nullable=False)  # sum of 10^(leq / 10) over readings
+    ldn_energy_sum = Column(DOUBLE().with_variant(Float(), 'sqlite'),
+                            nullable=False)  # as energy_sum, night readings with 10 dB penalty
+    n_readings = Column(Integer(), nullable=False)
+    n_over_55 = Column(Integer(), nullable=False)  # readings with lavg over 55 dB, see EXCEEDANCE_THRESHOLDS_DB
+    n_over_65 = Column(Integer(), nullable=False)
+    n_over_75 = Column(Integer(), nullable=False)
+    lmax = Column(Float(), nullable=False)
+    lmin = Column(Float(), nullable=False)
+
+
+class nsrt_hour(RollupColumns, Base):
+    __tablename__ = '{0}_{1}'.format(TABLE_PREFIX, SUMMARY_TABLE_SUFFIXES['hour'])
+
+
+class nsrt_day(RollupColumns, Base):
+    __tablename__ = '{0}_{1}'.format(TABLE_PREFIX, SUMMARY_TABLE_SUFFIXES['day'])
 
 
 class nsrt_meta(Base):
@@ -78,18 +150,171 @@ def create_empty_database(run_args: argparse.Namespace):
     if create_table:
         print("creating tables...")
         Base.metadata.create_all(bind=engine, tables=None, checkfirst=True)
+        if getattr(run_args, 'partition', False):
+            print("partitioning data table by month...")
+            partition_data_table(db_info, DATA_TABLE_NAME, pd.Timestamp.now())
         print("tables created, closing database connection...")
         db_info.close()
     else:
         print("at least one table exists, please drop all tables and run again...")
 
 
+def ensure_params_unique_key(db_info: DBInfo):
+    """
+    adds unique key over parameter columns to params table if missing, e.g. for tables
+    created before the key was defined. Fails if duplicate parameter rows are present.
+    :param db_info: database connection holder
+    :return: True if key was added, False if already present
+    """
+    params_table = nsrt_params.__table__
+    insp = inspect(db_info.get_engine())
+    if PARAMS_UNIQUE_KEY in [index['name'] for index in insp.get_indexes(params_table.name)]:
+        return False
+    [index for index in params_table.indexes if index.name == PARAMS_UNIQUE_KEY][0].create(bind=db_info.get_engine())
+    db_info.invalidate_table_cache(params_table.name)
+    return True
+
+
+def ensure_summary_tables(db_info: DBInfo):
+    """
+    creates summary tables missing from database, e.g. for databases created before they were defined
+    :param db_info: database connection holder
+    :return: list of names of tables created
+    """
+    insp = inspect(db_info.get_engine())
+    summary_tables = [Base.metadata.tables['{0}_{1}'.format(TABLE_PREFIX, table_suffix)]
+                      for table_suffix in SUMMARY_TABLE_SUFFIXES.values()]
+    missing_tables = [table for table in summary_tables if not insp.has_table(table.name)]
+    if missing_tables:
+        Base.metadata.create_all(bind=db_info.get_engine(), tables=missing_tables, checkfirst=True)
+    return [table.name for table in missing_tables]
+
+
+def ensure_data_indexes(db_info: DBInfo, table_name: str = DATA_TABLE_NAME):
+    """
+    adds time indexes missing from data table, e.g. for tables created before they were defined,
+    and drops indexes they supersede. Indexes are built in place without locking the table, so
+    readings continue to be written. Adding the unique key fails if the table holds duplicate
+    readings (same meter and timestamp), which must be deleted first.
+    :param db_info: database connection holder
+    :param table_name: name of data table
+    :return: list of names of indexes added
+    """
+    insp = inspect(db_info.get_engine())
+    present = [index['name'] for index in insp.get_indexes(table_name)]
+    missing = [index_name for index_name in DATA_INDEXES if index_name not in present]
+    with db_info.get_engine().connect() as con:
+        for index_name in missing:
+            con.execute(text("ALTER TABLE {0} ADD {1}INDEX {2} ({3}), ALGORITHM=INPLACE, LOCK=NONE;"
+                             .format(table_name, 'UNIQUE ' if index_name in DATA_UNIQUE_INDEXES else '',
+                                     index_name, ", ".join(DATA_INDEXES[index_name]))))
+        for index_name in DATA_SUPERSEDED_INDEXES:
+            if index_name in present:
+                con.execute(text("ALTER TABLE {0} DROP INDEX {1}, ALGORITHM=INPLACE, LOCK=NONE;"
+                                 .format(table_name, index_name)))
+    db_info.invalidate_table_cache(table_name)
+    return missing
+
+
+def get_partition_clause(months: list):
+    """
+    :param months: month starts, ascending
+    :return: partition definitions for months followed by catch-all partition
+    """
+    definitions = ["PARTITION {0} VALUES LESS THAN ('{1}')"
+                   .format(month.strftime(PARTITION_NAME_FORMAT),
+                           (month + pd.offsets.MonthBegin(1)).strftime(TIMESTAMP_FORMAT))
+                   for month in months]
+    return "({0})".format(", ".join(definitions + ["PARTITION {0} VALUES LESS THAN (MAXVALUE)".format(PARTITION_MAX)]))
+
+
+def get_month_starts(first: pd.Timestamp, last: pd.Timestamp):
+    """
+    :return: starts of months from month of first to month of last, inclusive
+    """
+    return list(pd.date_range(first.to_period('M').to_timestamp(), last.to_period('M').to_timestamp(), freq='MS'))
+
+
+def get_data_partitions(db_info: DBInfo, table_name: str = DATA_TABLE_NAME):
+    """
+    :return: names of partitions of data table in order, empty if table is not partitioned
+    """
+    with db_info.get_engine().connect() as con:
+        results = con.execute(text("SELECT PARTITION_NAME FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = :db "
+                                   "AND TABLE_NAME = :table_name AND PARTITION_NAME IS NOT NULL "
+                                   "ORDER BY PARTITION_ORDINAL_POSITION;"),
+                              {'db': db_info.get_db_name(), 'table_name': table_name})
+        return [result[0] for result in results]
+
+
+def partition_data_table(db_info: DBInfo, table_name: str, first_month: pd.Timestamp):
+    """
+    partition data table by month of timestamp, from month of first_month to PARTITION_MONTHS_AHEAD
+    months beyond current month. Mysql requires the partitioning column in the primary key and no
+    foreign keys on partitioned tables, so the primary key becomes (id, timestamp) and foreign keys
+    are dropped. The table is rebuilt, so use on new or empty tables (see datamigrate.py).
+    :param db_info: database connection holder
+    :param table_name: name of data table
+    :param first_month: timestamp in first month partitioned
+    :return: None
+    """
+    insp = inspect(db_info.get_engine())
+    months = get_month_starts(first_month, pd.Timestamp.now() + pd.offsets.MonthBegin(PARTITION_MONTHS_AHEAD))
+    with db_info.get_engine().connect() as con:
+        for foreign_key in insp.get_foreign_keys(table_name):
+            con.execute(text("ALTER TABLE {0} DROP FOREIGN KEY {1};".format(table_name, foreign_key['name'])))
+        con.execute(text("ALTER TABLE {0} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp);".format(table_name)))
+        con.execute(text("ALTER TABLE {0} PARTITION BY RANGE COLUMNS(timestamp) {1};"
+                         .format(table_name, get_partition_clause(months))))
+    db_info.invalidate_table_cache(table_name)
+
+
+def ensure_future_partitions(db_info: DBInfo, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """
+    if data table is partitioned, split monthly partitions off the catch-all partition up to
+    months_ahead months beyond current month; quick while the catch-all partition is empty
+    :param db_info: database connection holder
+    :param months_ahead: months beyond current month to have partitions for
+    :return: list of names of partitions added
+    """
+    partitions = get_data_partitions(db_info)
+    monthly = [partition for partition in partitions if partition != PARTITION_MAX]
+    if not monthly:
+        return []
+    last_month = pd.to_datetime(monthly[-1], format=PARTITION_NAME_FORMAT)
+    months = get_month_starts(last_month + pd.offsets.MonthBegin(1),
+                              pd.Timestamp.now() + pd.offsets.MonthBegin(months_ahead))
+    if not months:
+        return []
+    with db_info.get_engine().connect() as con:
+        con.execute(text("ALTER TABLE {0} REORGANIZE PARTITION {1} INTO {2};"
+                         .format(DATA_TABLE_NAME, PARTITION_MAX, get_partition_clause(months))))
+    return [month.strftime(PARTITION_NAME_FORMAT) for month in months]
+
+
+def drop_partitions_before(db_info: DBInfo, before: pd.Timestamp):
+    """
+    drop monthly partitions of data table holding only readings before a time; each partition
+    is dropped as a whole, without deleting rows one by one
+    :param db_info: database connection holder
+    :param before: readings before this time may be dropped
+    :return: list of names of partitions dropped
+    """
+    expired = [partition for partition in get_data_partitions(db_info) if partition != PARTITION_MAX
+               and pd.to_datetime(partition, format=PARTITION_NAME_FORMAT) + pd.offsets.MonthBegin(1) <= before]
+    if expired:
+        with db_info.get_engine().connect() as con:
+            con.execute(text("ALTER TABLE {0} DROP PARTITION {1};".format(DATA_TABLE_NAME, ", ".join(expired))))
+    return expired
+
+
 def main():
     try:
         my_parser = argparse.ArgumentParser(prog='datatablecreate',
                                             description='Create data tables for storage of sound meter readings')
         my_parser.add_argument('--config_file', type=str, help='database config file')
         my_parser.add_argument('--db_target_alias', type=str, help='target alias to find in config file')
+        my_parser.add_argument('--partition', action='store_true', help='partition data table by month')
         args: argparse.Namespace = my_parser.parse_args()
         create_empty_database(args)
 
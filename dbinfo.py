@@ -1,23 +1,39 @@
 #!/usr/bin/env python
 """
 Manages connection to mysql database, with useful methods to save data to tables
-in database.
+in database. A local sqlite file can stand in for the mysql database.
 """
+import math
 import os
 import socket
+import sqlite3
 import sys
 import traceback
 from pathlib import Path
 
 import pandas as pd
 import yaml
-from sqlalchemy import MetaData
-from sqlalchemy import create_engine
+from sqlalchemy import MetaData, Table
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.pool import SingletonThreadPool
 from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 SOCKET_NAME = socket.gethostname()
 TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
 MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# engine arguments for long-lived connections: bounded pool, connections tested on checkout and recycled
+# before mysql wait_timeout, so dropped connections are replaced transparently
+POOLED_ENGINE_ARGS = {'pool_size': 2, 'max_overflow': 2, 'pool_timeout': 30, 'pool_pre_ping': True,
+                      'pool_recycle': 3600}
+# set once on new sqlite file, both persist in file: free pages released by incremental vacuum (takes effect only
+# before first table is created), write-ahead log so readers do not block the writer
+SQLITE_FILE_PRAGMAS = ['auto_vacuum=INCREMENTAL', 'journal_mode=WAL']
+# set on each sqlite connection, neither takes a lock: log synced at checkpoints, foreign keys enforced
+SQLITE_PRAGMAS = ['synchronous=NORMAL', 'foreign_keys=ON']
+# mysql functions used in update expressions, registered on sqlite connections
+SQLITE_FUNCTIONS = {'greatest': max, 'least': min, 'log10': math.log10}
 
 
 class DBInfo:
@@ -27,18 +43,21 @@ class DBInfo:
     _connection_data: dict = None
     _target_alias: str = None
     _engine = None
+    _table_cache: dict = None  # table name -> table schema reflected from database
 
     def __init__(self):
-        pass
+        self._table_cache = {}
 
     @classmethod
-    def dbinfo_from_configfile(cls, config_filename: str, target_alias: str, db: str = None, table: str = None):
+    def dbinfo_from_configfile(cls, config_filename: str, target_alias: str, db: str = None, table: str = None,
+                               engine_args: dict = None):
         """
         instantiate DBInfo from configuration file
         :param config_filename: filename with (potentially multiple) database tables
         :param target_alias: identifies particular set of database connection data in config file
         :param db: database name
         :param table: table name
+        :param engine_args: keyword arguments for sqlalchemy create_engine, e.g. POOLED_ENGINE_ARGS
         :return:
         """
         db_info = DBInfo()
@@ -47,7 +66,30 @@ class DBInfo:
             db_info.get_connection_data()['db'] = db
         if table:
             db_info.get_connection_data()['table-name'] = table
-        db_info.connect_to_db(db_info.get_connection_data())
+        db_info.connect_to_db(db_info.get_connection_data(), engine_args=engine_args)
+        return db_info
+
+    @classmethod
+    def dbinfo_from_sqlite(cls, sqlite_filename: str):
+        """
+        instantiate DBInfo for sqlite database file, created if not present. Each thread holds
+        a single connection, so statements issued while a thread's transaction is open use it
+        rather than waiting on its lock.
+        :param sqlite_filename: path of database file
+        :return: DBInfo
+        """
+        db_info = DBInfo()
+        sqlite_path = Path(sqlite_filename)
+        if not sqlite_path.parent.exists():
+            sqlite_path.parent.mkdir(parents=True)
+        if not sqlite_path.exists():
+            connection = sqlite3.connect(str(sqlite_path))
+            for pragma in SQLITE_FILE_PRAGMAS:
+                connection.execute("PRAGMA {0};".format(pragma))
+            connection.close()
+        db_info._connection_data = {'hostname': 'localhost', 'db': sqlite_path.stem, 'sqlite-file': str(sqlite_path)}
+        db_info._engine = create_engine('sqlite:///{0}'.format(sqlite_path), poolclass=SingletonThreadPool)
+        event.listen(db_info._engine, 'connect', configure_sqlite_connection)
         return db_info
 
     @classmethod
@@ -57,11 +99,12 @@ class DBInfo:
         db_info.connect_to_db(db_connect_data)
         return db_info
 
-    def connect_to_db(self, db_connect_data: dict, db: str = None):
+    def connect_to_db(self, db_connect_data: dict, db: str = None, engine_args: dict = None):
         """
         connect to database and test connection
         :param db_connect_data: dictionary of connection information
         :param db: name of database, if not already specified above
+        :param engine_args: keyword arguments for sqlalchemy create_engine
         :return: None
         """
         if not db_connect_data.get('hostname'):
@@ -75,7 +118,7 @@ class DBInfo:
         connect_str = 'mysql+pymysql://{0}:{1}@{2}:{3}/{4}'. \
             format(db_connect_data['user'], db_connect_data['passwd'], db_connect_data['hostname'],
                    db_connect_data['port'], db_connect_data['db'])
-        self._engine = create_engine(connect_str)
+        self._engine = create_engine(connect_str, **(engine_args if engine_args else {}))
         try:
             with self.get_engine().connect() as connection:
                 results = self.get_table_list_from_engine()
@@ -92,6 +135,8 @@ class DBInfo:
         queries list of all tables in database
         :return: list of table names
         """
+        if self.is_sqlite():
+            return inspect(self.get_engine()).get_table_names()
         with self.get_engine().connect() as connection:
             results = connection.execute("SELECT TABLE_NAME FROM information_schema.TABLES"
                                          " WHERE TABLE_TYPE = 'BASE TABLE' "
@@ -116,18 +161,37 @@ class DBInfo:
             raise ValueError("Path to config file {0} does not exist"
                              .format(Path(MODULE_DIRECTORY, config_filename)))
 
+    def get_table(self, table_name: str):
+        """
+        returns table schema, reflected from database on first use and cached thereafter
+        :param table_name: name of table
+        :return: sqlalchemy Table
+        """
+        if table_name not in self._table_cache:
+            try:
+                self._table_cache[table_name] = Table(table_name, MetaData(), autoload_with=self.get_engine())
+            except NoSuchTableError:
+                raise ValueError("table {0} does not exist".format(table_name))
+        return self._table_cache[table_name]
+
+    def invalidate_table_cache(self, table_name: str = None):
+        """
+        drop cached table schema, to be reflected again on next use (e.g. after altering table)
+        :param table_name: name of table, all tables if None
+        :return: None
+        """
+        if table_name is None:
+            self._table_cache.clear()
+        else:
+            self._table_cache.pop(table_name, None)
+
     def get_table_cols(self, table_name: str):
         """
         returns all column names in a table
         :param table_name: name of table
         :return: set of column names
         """
-        db_engine = self._engine
-        meta = MetaData()
-        meta.reflect(bind=db_engine)
-        if table_name not in meta.tables.keys():
-            raise ValueError("table {0} does not exist".format(table_name))
-        return set([column.name for column in meta.tables[table_name].columns])
+        return set([column.name for column in self.get_table(table_name).columns])
 
     def insert_dict_to_table(self, table_name: str, insert_dict: dict, dup_key_update: list = None):
         """
@@ -145,9 +209,7 @@ class DBInfo:
         if dup_key_update:
             if not set(dup_key_update).issubset(insert_cols):
                 raise ValueError("duplicate keys not subset of insert keys")
-        meta = MetaData()
-        meta.reflect(bind=self.get_engine())
-        insert_stmt = insert(meta.tables[table_name]).values(insert_dict)
+        insert_stmt = insert(self.get_table(table_name)).values(insert_dict)
         if dup_key_update:
             dup_key_update_dict = dict([(k, insert_dict[k]) for k in dup_key_update])
             insert_stmt = insert_stmt.on_duplicate_key_update(**dup_key_update_dict)
@@ -158,7 +220,8 @@ class DBInfo:
 
     def insert_df_to_table(self, table_name: str, df: pd.DataFrame, if_exists: str):
         """
-        insert pandas dataframe to table
+        insert pandas dataframe to table, named index is inserted as a column.
+        Appends are written as a single multi-row insert against the cached table schema
         :param table_name: name of table
         :param df: dataframe
         :param if_exists: action if table exists
@@ -167,12 +230,68 @@ class DBInfo:
         valid_calls = {'fail', 'replace', 'append'}
         if if_exists not in valid_calls:
             raise ValueError("incorrect entry to 'if_exists'")
+        if if_exists != 'append':
+            df.to_sql(name=table_name, con=self._engine, if_exists=if_exists)
+            self.invalidate_table_cache(table_name)
+            return
         valid_cols = self.get_table_cols(table_name)
         insert_cols = set(df.columns)
         if not insert_cols.issubset(valid_cols):
             raise ValueError("invalid columns: {0}"
                              .format(", ".join([str(x) for x in list(insert_cols - valid_cols)])))
-        df.to_sql(name=table_name, con=self._engine, if_exists=if_exists)
+        self.insert_records_to_table(table_name, df_to_records(df))
+
+    def insert_records_to_table(self, table_name: str, records: list, con=None, ignore_duplicates: bool = False):
+        """
+        insert list of row dictionaries to table as one multi-row insert
+        :param table_name: name of table
+        :param records: list of dictionaries, all with same keys
+        :param con: connection of transaction to insert in, new transaction if None
+        :param ignore_duplicates: rows whose unique key is already present are left out rather than failing insert
+        :return: None
+        """
+        if len(records) == 0:
+            return
+        insert_stmt = self.get_table(table_name).insert()
+        if ignore_duplicates:
+            insert_stmt = insert_stmt.prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+        if con is None:
+            with self.get_engine().begin() as con:
+                con.execute(insert_stmt, records)
+        else:
+            con.execute(insert_stmt, records)
+
+    def upsert_records_to_table(self, table_name: str, records: list, update_cols, con=None):
+        """
+        insert list of row dictionaries to table, rows whose key is already present are updated
+        :param table_name: name of table
+        :param records: list of dictionaries, all with same keys
+        :param update_cols: list of columns updated from inserted values when key is present, or function
+        of (table, inserted values) returning list of (column, update expression), applied in order
+        :param con: connection of transaction to upsert in, new transaction if None
+        :return: None
+        """
+        if len(records) == 0:
+            return
+        table = self.get_table(table_name)
+        if self.is_sqlite():
+            insert_stmt = sqlite_insert(table)
+            inserted = insert_stmt.excluded
+        else:
+            insert_stmt = insert(table)
+            inserted = insert_stmt.inserted
+        update_exprs = update_cols(table, inserted) if callable(update_cols) else \
+            [(col, inserted[col]) for col in update_cols]
+        if self.is_sqlite():  # sqlite update expressions all see values before update, so order does not matter
+            insert_stmt = insert_stmt.on_conflict_do_update(
+                index_elements=[col.name for col in table.primary_key.columns], set_=dict(update_exprs))
+        else:
+            insert_stmt = insert_stmt.on_duplicate_key_update(update_exprs)
+        if con is None:
+            with self.get_engine().begin() as con:
+                con.execute(insert_stmt, records)
+        else:
+            con.execute(insert_stmt, records)
 
     def read_sql_to_df(self, sqlstr: str):
         """
@@ -183,6 +302,23 @@ class DBInfo:
         with self._engine.connect() as connection:
             return pd.read_sql(sql=sqlstr, con=connection)
 
+    def stream_query_chunks(self, query, chunk_rows: int):
+        """
+        read query result in chunks through a server-side cursor, so that the full result is never
+        held in memory
+        :param query: select statement
+        :param chunk_rows: maximum rows per chunk
+        :return: generator of dataframes
+        """
+        with self._engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(query)
+            columns = list(result.keys())
+            for rows in result.partitions(chunk_rows):
+                yield pd.DataFrame.from_records(rows, columns=columns)
+
+    def is_sqlite(self):
+        return self._engine.dialect.name == 'sqlite'
+
     def get_db_name(self):
         return self._connection_data['db']
 
@@ -196,6 +332,32 @@ class DBInfo:
         self._engine.dispose()
 
 
+def configure_sqlite_connection(dbapi_connection, _):
+    """
+    set SQLITE_PRAGMAS and register SQLITE_FUNCTIONS on new sqlite connection
+    """
+    for name, function in SQLITE_FUNCTIONS.items():
+        dbapi_connection.create_function(name, -1, function, deterministic=True)
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute("PRAGMA {0};".format(pragma))
+    cursor.close()
+
+
+def df_to_records(df: pd.DataFrame):
+    """
+    convert dataframe to list of row dictionaries of python types, named index included as column
+    :param df: dataframe
+    :return: list of dictionaries
+    """
+    if df.index.name is not None:
+        df = df.reset_index()
+    columns = [str(col) for col in df.columns]
+    values = [df[col].dt.to_pydatetime() if pd.api.types.is_datetime64_any_dtype(df[col]) else df[col].tolist()
+              for col in df.columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
 def test_dbase_connect_from_file(configfilename: str, target_alias: str, db: str = None, table: str = None):
     db_info = DBInfo.dbinfo_from_configfile(configfilename, target_alias, db, table)
     print('Checking db connection to alias {0}...'.format(target_alias))
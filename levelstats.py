@@ -0,0 +1,148 @@
+#!/usr/bin/python -u
+# coding=utf-8
+"""
+Statistical summaries of sound meter readings
+Readings are grouped by minute and summarized with vectorized numpy: energetic average of the
+per-reading leq, exceedance levels (L10 is the level exceeded 10% of the time), maximum and
+minimum of the time-weighted level lavg, and the number of readings.
+Hourly and daily rollups hold sums of reading energies (10^(leq/10)) rather than levels, so
+partial periods merge exactly by addition; Leq and Ldn are derived from the sums.
+"""
+import numpy as np
+import pandas as pd
+
+from tickscheduler import NS_PER_MINUTE
+
+EXCEEDANCE_PERCENTS = [10, 50, 90]  # Ln levels summarized
+MINUTE_STATS_COLUMNS = ['leq', 'l10', 'l50', 'l90', 'lmax', 'lmin', 'n_readings']
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+ROLLUP_PERIODS_NS = {'hour': NS_PER_HOUR, 'day': 24 * NS_PER_HOUR}  # rollup tables, by period length
+NIGHT_START_HOUR, NIGHT_END_HOUR = 22, 7  # night period for Ldn, local time
+NIGHT_PENALTY_DB = 10.  # added to night levels for Ldn
+EXCEEDANCE_THRESHOLDS_DB = [55, 65, 75]  # rollups count readings with lavg above each threshold
+EXCEEDANCE_COLUMNS = ['n_over_{0:d}'.format(threshold) for threshold in EXCEEDANCE_THRESHOLDS_DB]
+ROLLUP_SUM_COLUMNS = ['energy_sum', 'ldn_energy_sum', 'n_readings'] + EXCEEDANCE_COLUMNS  # merged by addition
+ROLLUP_COLUMNS = ['leq', 'ldn'] + ROLLUP_SUM_COLUMNS + ['lmax', 'lmin']
+
+
+def get_group_percentiles(sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray, percent: float):
+    """
+    percentile of each group of values, linear interpolation as numpy.percentile
+    :param sorted_values: values sorted within each group, groups contiguous
+    :param starts: position of first value of each group
+    :param counts: number of values in each group
+    :param percent: percentile, 0 to 100
+    :return: array of percentiles, one per group
+    """
+    position = starts + (counts - 1) * percent / 100.
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    fraction = position - lower
+    return sorted_values[lower] * (1. - fraction) + sorted_values[upper] * fraction
+
+
+def get_minute_stats(timestamp_ns: np.ndarray, lavg: np.ndarray, leq: np.ndarray):
+    """
+    per-minute statistics of readings, minutes labelled by their start. Readings with
+    non-finite levels are ignored.
+    :param timestamp_ns: int64 reading timestamps, ns
+    :param lavg: time-weighted level per reading
+    :param leq: leq per reading, each over the interval since the previous reading
+    :return: dictionary of 'minute_ns' and MINUTE_STATS_COLUMNS arrays, one entry per minute
+    """
+    valid = np.isfinite(lavg) & np.isfinite(leq)
+    minute_ns = timestamp_ns[valid] // NS_PER_MINUTE * NS_PER_MINUTE
+    lavg = lavg[valid].astype(np.float64)
+    leq = leq[valid].astype(np.float64)
+    if len(minute_ns) == 0:
+        return dict([('minute_ns', minute_ns)] + [(k, np.array([])) for k in MINUTE_STATS_COLUMNS])
+    order = np.lexsort((lavg, minute_ns))  # by minute, then by level within minute
+    minute_ns, lavg, leq = minute_ns[order], lavg[order], leq[order]
+    starts = np.flatnonzero(np.r_[True, minute_ns[1:] != minute_ns[:-1]])
+    counts = np.diff(np.r_[starts, len(minute_ns)])
+    stats = {'minute_ns': minute_ns[starts],
+             'leq': 10. * np.log10(np.add.reduceat(np.power(10., leq / 10.), starts) / counts),
+             'lmax': lavg[starts + counts - 1], 'lmin': lavg[starts], 'n_readings': counts}
+    for percent in EXCEEDANCE_PERCENTS:  # level exceeded percent of the time
+        stats['l{0:d}'.format(percent)] = get_group_percentiles(lavg, starts, counts, 100. - percent)
+    return stats
+
+
+def get_rollup_stats(timestamp_ns: np.ndarray, lavg: np.ndarray, leq: np.ndarray, period_ns: int):
+    """
+    energy sums, counts and extremes of readings per period, periods labelled by their start.
+    Readings are taken to be of equal duration. Readings with non-finite levels are ignored.
+    :param timestamp_ns: int64 reading timestamps (local time), ns
+    :param lavg: time-weighted level per reading
+    :param leq: leq per reading, each over the interval since the previous reading
+    :param period_ns: period length, e.g. ROLLUP_PERIODS_NS['hour']
+    :return: dictionary of 'period_ns' and ROLLUP_COLUMNS arrays, one entry per period
+    """
+    valid = np.isfinite(lavg) & np.isfinite(leq)
+    timestamp_ns = timestamp_ns[valid]
+    lavg = lavg[valid].astype(np.float64)
+    periods, inverse = np.unique(timestamp_ns // period_ns * period_ns, return_inverse=True)
+    energy = np.power(10., leq[valid].astype(np.float64) / 10.)
+    hour = (timestamp_ns // NS_PER_HOUR) % 24
+    night = (hour >= NIGHT_START_HOUR) | (hour < NIGHT_END_HOUR)
+    stats = {'period_ns': periods, 'energy_sum': np.bincount(inverse, weights=energy, minlength=len(periods)),
+             'ldn_energy_sum': np.bincount(inverse, weights=np.where(night, energy * 10. ** (NIGHT_PENALTY_DB / 10.),
+                                                                     energy), minlength=len(periods)),
+             'n_readings': np.bincount(inverse, minlength=len(periods)),
+             'lmax': np.full(len(periods), -np.inf), 'lmin': np.full(len(periods), np.inf)}
+    np.maximum.at(stats['lmax'], inverse, lavg)
+    np.minimum.at(stats['lmin'], inverse, lavg)
+    for threshold, col in zip(EXCEEDANCE_THRESHOLDS_DB, EXCEEDANCE_COLUMNS):
+        stats[col] = np.bincount(inverse, weights=lavg > threshold, minlength=len(periods)).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['leq'] = 10. * np.log10(stats['energy_sum'] / stats['n_readings'])
+        stats['ldn'] = 10. * np.log10(stats['ldn_energy_sum'] / stats['n_readings'])
+    return stats
+
+
+def get_stats_frame(nsrt_id: int, stats: dict, period_key: str, columns: list):
+    """
+    :return: dataframe of statistics indexed by period start ('timestamp'), columns nsrt_id and columns
+    """
+    frame = pd.DataFrame(dict((k, stats[k]) for k in columns),
+                         index=pd.DatetimeIndex(stats[period_key].astype('datetime64[ns]'), name='timestamp'))
+    frame.insert(loc=0, column='nsrt_id', value=nsrt_id)
+    return frame
+
+
+def get_meter_readings(blocks: list):
+    """
+    concatenated readings of blocks, per meter
+    :param blocks: list of ReadingBlock
+    :return: list of (nsrt_id, timestamp_ns, lavg, leq) tuples
+    """
+    meter_readings = []
+    for nsrt_id in sorted(set(block.nsrt_id for block in blocks)):
+        meter_blocks = [block for block in blocks if block.nsrt_id == nsrt_id]
+        meter_readings.append(tuple([nsrt_id] + [np.concatenate([getattr(block, col) for block in meter_blocks])
+                                                 for col in ['timestamp_ns', 'lavg', 'leq']]))
+    return meter_readings
+
+
+def get_minute_stats_frame(blocks: list):
+    """
+    per-minute statistics of blocks of readings, for the minute summary table
+    :param blocks: list of ReadingBlock
+    :return: dataframe indexed by minute start ('timestamp'), columns nsrt_id and MINUTE_STATS_COLUMNS
+    """
+    frames = [get_stats_frame(nsrt_id, get_minute_stats(timestamp_ns, lavg, leq), 'minute_ns', MINUTE_STATS_COLUMNS)
+              for nsrt_id, timestamp_ns, lavg, leq in get_meter_readings(blocks)]
+    return pd.concat(frames) if frames else pd.DataFrame(columns=['nsrt_id'] + MINUTE_STATS_COLUMNS)
+
+
+def get_rollup_stats_frame(blocks: list, period: str):
+    """
+    per-period energy sums, counts and extremes of blocks of readings, for the rollup tables
+    :param blocks: list of ReadingBlock
+    :param period: key of ROLLUP_PERIODS_NS
+    :return: dataframe indexed by period start ('timestamp'), columns nsrt_id and ROLLUP_COLUMNS
+    """
+    frames = [get_stats_frame(nsrt_id, get_rollup_stats(timestamp_ns, lavg, leq, ROLLUP_PERIODS_NS[period]),
+                              'period_ns', ROLLUP_COLUMNS)
+              for nsrt_id, timestamp_ns, lavg, leq in get_meter_readings(blocks)]
+    return pd.concat(frames) if frames else pd.DataFrame(columns=['nsrt_id'] + ROLLUP_COLUMNS)
@@ -6,8 +6,10 @@ Generic class to handle all logging activity, define handlers
 import logging
 import logging.handlers
 import os
+import queue
 import smtplib
 import sys
+import threading
 import time
 import traceback
 from datetime import datetime
@@ -23,31 +25,52 @@ from sqlalchemy import Column, Integer, String, DateTime, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.mysql import LONGTEXT
 
-from dbinfo import DBInfo
+from dbinfo import DBInfo, POOLED_ENGINE_ARGS
 
 IS_WINDOWS = os.name != 'posix'
 TIMESTAMP_FORMAT_ALT = '%m/%d/%Y %H:%M:%S'
 TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
 MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DBHANDLER_BUFFER_SIZE = 1000  # default maximum log records held awaiting database insert
+DBHANDLER_BATCH_SIZE = 50  # default number of records which triggers an insert
+DBHANDLER_FLUSH_SECONDS = 5.0  # default maximum time a record waits before insert
 
 
 class DBHandler(logging.Handler):
     """
-    Handler for mysql database
+    Handler for mysql database. Records are placed in a bounded buffer and inserted in batches
+    by a background thread, so logging never waits on the database. Records arriving when the
+    buffer is full are dropped and counted.
     """
     log_config: dict = None  # dictionary for logging configuration
     db_info: DBInfo = None  # database connection information
     table_name: str = None  # logging table name
+    batch_size: int = None  # number of buffered records which triggers an insert
+    flush_seconds: float = None  # maximum time a record waits in buffer before insert
+    written_count: int = 0  # records inserted to database
+    dropped_count: int = 0  # records dropped because buffer was full
+    failed_count: int = 0  # records lost to failed inserts
+    _buffer: queue.Queue = None  # log rows awaiting insert
+    _stop_event: threading.Event = None  # signals flusher thread to drain buffer and exit
+    _flusher: threading.Thread = None  # background thread inserting buffered rows
 
     def __init__(self, log_config: dict):
         super(DBHandler, self).__init__()
         self.log_config = log_config
-        self.db_info = DBInfo.dbinfo_from_configfile(log_config['db-configfile'], log_config['db-target-alias'])
+        self.db_info = DBInfo.dbinfo_from_configfile(log_config['db-configfile'], log_config['db-target-alias'],
+                                                     engine_args=POOLED_ENGINE_ARGS)
         if self.db_info.get_connection_data().get('table-name'):
             self.table_name = self.db_info.get_connection_data()['table-name']
         else:
             raise ValueError("configfile {0} must contain table name".format(log_config['db-configfile']))
         self.create_table_if_not_exists()
+        self.batch_size = int(log_config.get('batch-size', DBHANDLER_BATCH_SIZE))
+        self.flush_seconds = float(log_config.get('flush-seconds', DBHANDLER_FLUSH_SECONDS))
+        self._buffer = queue.Queue(maxsize=int(log_config.get('buffer-size', DBHANDLER_BUFFER_SIZE)))
+        self._stop_event = threading.Event()
+        self._flusher = threading.Thread(target=self.run_flusher, name='dbhandler-flusher')
+        self._flusher.daemon = True
+        self._flusher.start()
 
     def create_table_if_not_exists(self):
         """
@@ -75,18 +98,74 @@ class DBHandler(logging.Handler):
 
             base.metadata.create_all(bind=engine, tables=None, checkfirst=True)
 
+    def run_flusher(self):
+        """
+        insert buffered rows whenever batch size is reached or flush time elapses,
+        until stopped and buffer is drained
+        :return: None
+        """
+        rows = []
+        next_flush = time.monotonic() + self.flush_seconds
+        while not (self._stop_event.is_set() and self._buffer.empty()):
+            try:
+                row = self._buffer.get(timeout=max(0., next_flush - time.monotonic()))
+                if row is not None:  # None is wake-up from close
+                    rows.append(row)
+            except queue.Empty:
+                pass
+            if len(rows) >= self.batch_size or time.monotonic() >= next_flush:
+                self.write_rows(rows)
+                rows = []
+                next_flush = time.monotonic() + self.flush_seconds
+        self.write_rows(rows)
+
+    def write_rows(self, rows: list):
+        """
+        insert rows to logging table as one multi-row insert
+        :param rows: list of log row dictionaries
+        :return: None
+        """
+        if len(rows) == 0:
+            return
+        try:
+            self.db_info.insert_records_to_table(table_name=self.table_name, records=rows)
+            self.written_count += len(rows)
+        except Exception as ex:
+            self.failed_count += len(rows)
+            print("from logmanager--failed to insert {0:d} log records to {1}: {2}"
+                  .format(len(rows), self.table_name, str(ex)), file=sys.stderr)
+
+    def get_counts(self):
+        return {'written': self.written_count, 'dropped': self.dropped_count, 'failed': self.failed_count,
+                'buffered': self._buffer.qsize()}
+
     def close(self):
-        self.db_info.close()
+        """
+        flush buffered records, stop flusher thread and release database connection
+        :return: None
+        """
+        if self._stop_event is not None and not self._stop_event.is_set():
+            self._stop_event.set()
+            try:
+                self._buffer.put_nowait(None)
+            except queue.Full:
+                pass
+            self._flusher.join(self.flush_seconds + 30.)
+            self.db_info.close()
+        super(DBHandler, self).close()
 
     def emit(self, record):
         """
-        emit logging record
+        emit logging record to buffer, dropping it if buffer is full
         :param record: logging element
         :return: None
         """
-        log_dict = {'timestamp': time.strptime(record.asctime, TIMESTAMP_FORMAT_ALT),
+        log_dict = {'timestamp': datetime.fromtimestamp(record.created),
                     'logger_name': record.name, 'level': record.levelname, 'message': record.msg}
-        self.db_info.insert_dict_to_table(table_name=self.table_name, insert_dict=log_dict)
+        try:
+            self._buffer.put_nowait(log_dict)
+        except queue.Full:
+            self.dropped_count += 1
 
 
 class MessageHandler:
@@ -162,6 +241,8 @@ class MessageHandler:
 
     def close(self):
         if self.db_handler:
+            self.log("database log handler: {0}".format(", ".join(["{0} {1:d}".format(k, v) for k, v
+                                                                    in self.db_handler.get_counts().items()])))
             self.db_handler.close()
 
     # @staticmethod
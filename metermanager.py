@@ -9,21 +9,24 @@ import argparse
 import importlib
 import logging
 import os
+import queue
 import sys
+import threading
 import time
 import traceback
 from collections import OrderedDict
-from collections import deque
 from pathlib import Path
 from pprint import pprint
 
 import pandas as pd
 import yaml
 from nsrt_mk3_dev import NsrtMk3Dev
-from pandas.tseries.offsets import Minute, Second, Milli
+from pandas.tseries.offsets import Minute, Second
 
 from datamanager import DataManager
 from logmanager import MessageHandler
+from readingbuffer import ReadingBlock, ReadingBuffer
+from tickscheduler import TickScheduler, NS_PER_MINUTE, NS_PER_SECOND
 
 MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 os.chdir(MODULE_DIRECTORY)
@@ -33,6 +36,16 @@ NSRT_WEIGHTINGS = dict([('DB_A', NsrtMk3Dev.Weighting.DB_A), ('DB_C', NsrtMk3Dev
                         ('DB_Z', NsrtMk3Dev.Weighting.DB_Z)])
 TIME_PADDING_SECONDS = 0.001  # time after mark to call meter for measurement (ensures meter queried 'after' mark
 MIN_RUN_TIME_SECONDS = 5.0  # must run for this minimum time before recording
+PARAMS_REVALIDATE_MINUTES = 60.0  # default time between re-reads of static meter parameters
+PARAMS_READ_SLACK_SECONDS = 0.05  # time before next tick needed to re-read a meter parameter in the sampling loop
+PARAMS_READERS = OrderedDict([('tau', lambda nsrt: "{0:.2f}".format(nsrt.read_tau())),
+                              ('wt', lambda nsrt: nsrt.read_weighting().name),
+                              ('freq', lambda nsrt: "{0:d}".format(nsrt.read_fs())),
+                              ('serial_number', lambda nsrt: nsrt.read_sn()),
+                              ('firmware_revision', lambda nsrt: nsrt.read_fw_rev()),
+                              ('date_of_birth', lambda nsrt: nsrt.read_dob()),
+                              ('date_of_calibration', lambda nsrt: nsrt.read_doc())])  # static meter parameters
+WRITE_QUEUE_BLOCKS = 5  # default maximum minute blocks awaiting write by writer thread
 
 
 class MeterManager:
@@ -40,7 +53,7 @@ class MeterManager:
     Main meter manager class
     """
     nsrt: NsrtMk3Dev = None  # nsrt meter representation from NsrtMk3Dev
-    sound_readings: deque = None  # running fixed queue of sound readings
+    sound_readings: ReadingBuffer = None  # running fixed buffer of sound readings
     _measurement_frequency: float = None  # how often to query meter (e.g. 1 sec, 0.5 sec)
     _meter_info: dict = None  # dictionary of meter configurations
     _data_manager: DataManager = None  # data manager for output
@@ -50,6 +63,15 @@ class MeterManager:
     _tau: float = None  # time period for 'L' reading (e.g. 1 sec for 'slow' 0.125 sec for 'fast'
     _freq: int = None  # frequency setting
     _meter_id: int = None  # meter identification defined in config file for meta data
+    _meter_params: OrderedDict = None  # cached static meter parameters (tau, weighting, serial number etc.)
+    _params_id: int = None  # id of cached meter parameters in reading buffer
+    _params_read_time: float = None  # monotonic time of last read of static meter parameters
+    _params_revalidate_seconds: float = None  # time between re-reads of static meter parameters
+    _params_pending: OrderedDict = None  # meter parameters re-read so far by revalidation in progress, else None
+    _write_queue: queue.Queue = None  # minute blocks awaiting write by writer thread
+    _writer_thread: threading.Thread = None  # thread passing minute blocks to data manager
+    _write_counts: dict = None  # minute blocks written, dropped (queue full) and failed
+    _max_write_seconds: float = 0.  # longest time taken by data manager to save a minute block
 
     def __init__(self):
         pass
@@ -71,15 +93,21 @@ class MeterManager:
         try:
             # 3 minutes of readings
             queue_length = int(1. / meter_manager.get_meter_info()['measurement-frequency'] * 60. * 3.)
-            meter_manager.sound_readings = deque([], queue_length)
+            meter_manager.sound_readings = ReadingBuffer(queue_length, meter_manager.get_meter_info()['meter-id'])
             meter_manager._measurement_frequency = meter_manager.get_meter_info()['measurement-frequency']
             meter_manager._device_port = meter_manager.get_meter_info()['device-port']
             meter_manager._weighting = NSRT_WEIGHTINGS[meter_manager.get_meter_info()['weighting']]
             meter_manager._tau = meter_manager.get_meter_info()['tau']
             meter_manager._freq = meter_manager.get_meter_info()['freq']
             meter_manager._meter_id = meter_manager.get_meter_info()['meter-id']
+            meter_manager._params_revalidate_seconds = 60. * float(meter_manager.get_meter_info()
+                                                                   .get('params-revalidate-minutes',
+                                                                        PARAMS_REVALIDATE_MINUTES))
             meter_manager.nsrt = NsrtMk3Dev(meter_manager._device_port)
             meter_manager.connect_and_set()
+            meter_manager._write_queue = queue.Queue(maxsize=int(meter_manager.get_meter_info()
+                                                                 .get('write-queue-minutes', WRITE_QUEUE_BLOCKS)))
+            meter_manager._write_counts = {'written': 0, 'dropped': 0, 'failed': 0}
         except Exception as ex1:
             message_handler.log("Error--meter manager improperly specified, check run parameters\n{0}"
                                 .format(traceback.format_exc()), lvl=logging.CRITICAL)
@@ -114,26 +142,66 @@ class MeterManager:
                                   .format(self.nsrt.read_fs(), success))
         self._message_handler.log("usb device connected, measurement frequency (seconds): {0:.2f}"
                                   .format(self._measurement_frequency))
+        params_read_seconds = self.read_meter_params()
+        self._message_handler.log("meter parameters cached, saves {0:.1f} ms of serial reads per measurement"
+                                  .format(params_read_seconds * 1000.))
 
-    def generate_spl(self):
+    def read_meter_params(self):
         """
-        query meter, load readings into dictionary, add to queue
+        query meter for parameters which do not change between readings, cache for use in readings
+        :return: seconds spent querying meter for parameters
+        """
+        read_start = time.perf_counter()
+        meter_params = OrderedDict((k, read_param(self.nsrt)) for k, read_param in PARAMS_READERS.items())
+        read_seconds = time.perf_counter() - read_start
+        self.set_meter_params(meter_params)
+        return read_seconds
+
+    def set_meter_params(self, meter_params: OrderedDict):
+        """
+        cache meter parameters for use in readings, warning if they changed
+        :param meter_params: parameters as read from meter, keys as PARAMS_READERS
+        :return: None
+        """
+        if self._meter_params is not None and meter_params != self._meter_params:
+            self._message_handler.log("meter parameters changed from {0} to {1}"
+                                      .format(dict(self._meter_params), dict(meter_params)), logging.WARNING)
+        self._meter_params = meter_params
+        self._params_id = self.sound_readings.register_params(meter_params)
+        self._params_read_time = time.monotonic()
+
+    def revalidate_params_step(self, slack_seconds: float):
+        """
+        once revalidation period has elapsed, re-read cached meter parameters one per call, so the
+        serial reads are spread over the time left between ticks rather than delaying a tick.
+        Readings keep the cached parameters until all have been re-read.
+        :param slack_seconds: time until next tick, nothing is read if less than PARAMS_READ_SLACK_SECONDS
+        :return: None
+        """
+        if self._params_pending is None:
+            if time.monotonic() - self._params_read_time <= self._params_revalidate_seconds:
+                return
+            self._message_handler.log("revalidating cached meter parameters...")
+            self._params_pending = OrderedDict()
+        if slack_seconds < PARAMS_READ_SLACK_SECONDS:
+            return
+        param_name = [k for k in PARAMS_READERS if k not in self._params_pending][0]
+        self._params_pending[param_name] = PARAMS_READERS[param_name](self.nsrt)
+        if len(self._params_pending) == len(PARAMS_READERS):
+            self.set_meter_params(self._params_pending)
+            self._params_pending = None
+
+    def generate_spl(self, timestamp_ns: int = None):
+        """
+        query meter for level, leq and temperature, add to reading buffer with id of cached parameters
+        :param timestamp_ns: time of reading (local, ns since epoch), now if None
         :return: None
         """
-        sound_meter_reading = [('timestamp', pd.Timestamp.now()),
-                               ('lavg', self.nsrt.read_level()),
-                               ('leq', self.nsrt.read_leq()),
-                               ('temp_f', self.nsrt.read_temperature() * 9. / 5. + 32.),
-                               ('nsrt_id', self._meter_id),
-                               ('tau', "{0:.2f}".format(self.nsrt.read_tau())),
-                               ('wt', self.nsrt.read_weighting().name),
-                               ('freq', "{0:d}".format(self.nsrt.read_fs())),
-                               ('serial_number', self.nsrt.read_sn()),
-                               ('firmware_revision', self.nsrt.read_fw_rev()),
-                               ('date_of_birth', self.nsrt.read_dob()),
-                               ('date_of_calibration', self.nsrt.read_doc())]
-        # self.print_reading(sound_meter_reading)
-        self.sound_readings.append(OrderedDict(sound_meter_reading))  # right side of queue
+        self.sound_readings.append(timestamp_ns=timestamp_ns if timestamp_ns is not None else pd.Timestamp.now().value,
+                                   lavg=self.nsrt.read_level(),
+                                   leq=self.nsrt.read_leq(),
+                                   temp_f=self.nsrt.read_temperature() * 9. / 5. + 32.,
+                                   params_id=self._params_id)
 
     def load_meter_data(self, this_config_filename):
         """
@@ -151,30 +219,99 @@ class MeterManager:
             raise ValueError("Path to config file {0} does not exist"
                              .format(Path(MODULE_DIRECTORY, this_config_filename)))
 
-    def write_readings_block(self):
+    def queue_readings_block(self, end_ns: int = None):
+        """
+        copy last minute of readings from buffer and queue for writer thread, never waits on writer:
+        if queue is full the minute is dropped and counted
+        :param end_ns: end of minute (local, ns since epoch), current minute if None
+        :return:
+        """
+        if end_ns is None:
+            end_ns = pd.Timestamp.now().floor('min').value
+        block: ReadingBlock = self.sound_readings.get_block(end_ns - NS_PER_MINUTE, end_ns).copy()
+        try:
+            self._write_queue.put_nowait(block)
+        except queue.Full:
+            self._write_counts['dropped'] += 1
+
+    def start_writer(self):
+        """
+        start thread writing queued minute blocks per DataManager specification
+        :return: None
+        """
+        self._writer_thread = threading.Thread(target=self.run_writer, name='meter-writer')
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def run_writer(self):
+        """
+        write queued minute blocks until stop sentinel (None) received, logging write latency
+        and queue depth; failed writes are logged and counted, writer continues
+        :return: None
+        """
+        while True:
+            block: ReadingBlock = self._write_queue.get()
+            if block is None:
+                break
+            if len(block) == 0:
+                self._message_handler.log("no readings for minute, nothing written", logging.WARNING)
+                continue
+            minute_end = pd.Timestamp(block.timestamp_ns[-1]).ceil(freq='min')
+            try:
+                write_start = time.perf_counter()
+                self.write_readings_block(block)
+                write_seconds = time.perf_counter() - write_start
+                self._write_counts['written'] += 1
+                self._max_write_seconds = max(self._max_write_seconds, write_seconds)
+                self._message_handler.log("writer: minute ending {0} written in {1:.1f} ms, queue depth {2:d}, "
+                                          "dropped {3:d}, max write {4:.1f} ms"
+                                          .format(minute_end, write_seconds * 1000., self._write_queue.qsize(),
+                                                  self._write_counts['dropped'], self._max_write_seconds * 1000.))
+            except Exception as _:
+                self._write_counts['failed'] += 1
+                self._message_handler.log("Error writing minute ending {0}\n{1}"
+                                          .format(minute_end, traceback.format_exc()), lvl=logging.CRITICAL)
+
+    def write_readings_block(self, block: ReadingBlock):
         """
         write one minute of data per DataManager specification
+        :param block: minute of readings
         :return:
         """
-        end_reading: pd.Timestamp = pd.Timestamp.now().floor('min')
-        start_reading = end_reading - Minute(1)
-        df: pd.DataFrame = pd.DataFrame.from_records(list(self.sound_readings))
-        df = df[df['timestamp'].between(start_reading, end_reading)]
-        df.set_index('timestamp', inplace=True)
-        self._message_handler.log("writing minute ending {0} to database..."
-                                  .format(df.index.to_list()[-1].ceil(freq='T')))
-        self._data_manager.save_reading(data=df)
+        self._data_manager.save_reading(data=block)
+
+    def stop_writer(self, timeout: float = 60.):
+        """
+        write remaining queued blocks and stop writer thread
+        :param timeout: seconds to wait for remaining writes
+        :return: None
+        """
+        if self._writer_thread is not None:
+            try:
+                self._write_queue.put(None, timeout=timeout)
+                self._writer_thread.join(timeout)
+            except queue.Full:  # writer stuck on data manager
+                self._message_handler.log("writer not stopped, queue full after {0:.0f} s, "
+                                          "{1:d} minutes not written: {2}".format(timeout, self._write_queue.qsize(),
+                                                                                 self._write_counts),
+                                          lvl=logging.CRITICAL)
+                return
+            self._message_handler.log("writer stopped: {0}".format(self._write_counts))
 
     # noinspection PyTypeChecker
     def close(self):
         """
-        close serial port
+        close serial port, stop writer and close data manager
         :return: None
         """
         print("closing serial port...")
         self.nsrt.serial.close()
         print("Serial connection is closed: {0}".format(not self.nsrt.serial.is_open))
         self.nsrt = None
+        try:
+            self.stop_writer()
+        finally:
+            self._data_manager.close()
 
 
 def run_meter(config_filename: str):
@@ -203,26 +340,39 @@ def run_meter(config_filename: str):
                                 .format(start_time.strftime(TIMESTAMP_FORMAT), end_time.strftime(TIMESTAMP_FORMAT)))
     else:
         run_message_handler.log("start data saving: {0}".format(start_time.strftime(TIMESTAMP_FORMAT)))
-    next_summary_time = start_time + Minute(1)
-    sleep_until = ((pd.Timestamp.now().ceil('s') + Second(1)) - pd.Timestamp.now()).total_seconds() + \
-                  TIME_PADDING_SECONDS
-    run_message_handler.log("start pinging soundmeter: {0}"
-                            .format((pd.Timestamp.now() + Milli(int(sleep_until * 1000.)))
-                                    .strftime("%Y-%m-%d %H:%M:%S.%f")))
-    time.sleep(sleep_until)
+    next_summary_ns = (start_time + Minute(1)).value
+    end_ns = end_time.value if end_time is not None else None
+    scheduler = TickScheduler(meter_manager.get_measurement_frequency(), TIME_PADDING_SECONDS)
+    scheduler.start()
+    run_message_handler.log("start pinging soundmeter: {0}, every {1:d} ms"
+                            .format(pd.Timestamp(scheduler.get_next_tick_local_ns()).strftime("%Y-%m-%d %H:%M:%S.%f"),
+                                    measurement_freq_ms))
+    meter_manager.start_writer()
     while True:   # now, run meter for specified period
         try:
-            meter_manager.generate_spl()
-            time.sleep((pd.Timestamp.now().floor('{0:d}ms'.format(measurement_freq_ms)) + Milli(measurement_freq_ms)
-                        - pd.Timestamp.now()).total_seconds() + TIME_PADDING_SECONDS)
-            updated_time = pd.Timestamp.now()
-            if end_time is not None and updated_time > end_time:
+            scheduler.wait_next_tick()
+            tick_ns = scheduler.local_time_ns()
+            meter_manager.generate_spl(tick_ns)
+            if end_ns is not None and tick_ns > end_ns:
                 run_message_handler.log("Maximum time exceeded, closing...")
                 meter_manager.close()
                 break
-            if updated_time > next_summary_time:  # time to write minute of reading data
-                meter_manager.write_readings_block()
-                next_summary_time += Minute(1)
+            if tick_ns > next_summary_ns:  # time to write minute of reading data
+                meter_manager.queue_readings_block(next_summary_ns)
+                tick_stats = scheduler.pop_stats()
+                run_message_handler.log("scheduler: {0}".format(tick_stats),
+                                        logging.WARNING if tick_stats['missed'] else logging.DEBUG)
+                scheduler.refresh_utc_offset()
+                next_summary_ns += NS_PER_MINUTE
+                clock_step = scheduler.check_wall_clock()
+                if clock_step:  # readings since last block carry pre-step timestamps and are not written
+                    next_summary_ns = (scheduler.local_time_ns() // NS_PER_MINUTE + 1) * NS_PER_MINUTE
+                    if end_ns is not None:  # keep configured run length
+                        end_ns += int(clock_step * NS_PER_SECOND)
+                    run_message_handler.log("wall clock stepped by {0:.3f} s, scheduler re-anchored, "
+                                            "next block ends {1}".format(clock_step, pd.Timestamp(next_summary_ns)
+                                                                         .strftime(TIMESTAMP_FORMAT)), logging.WARNING)
+            meter_manager.revalidate_params_step(scheduler.get_slack_seconds())
         except Exception as ex1:
             run_message_handler.log("Error during running of meter manager\n{0}"
                                     .format(traceback.format_exc()), lvl=logging.CRITICAL)
@@ -188,4 +188,45 @@ print("sound files of length: {0:d}".format(len(sound_files)))
 #%%
 #%%
 #%%
-#%%
\ No newline at end of file
+#%%
+# %%
+# benchmark flac encoding of one minute of audio, as done by the recorder writer with output-codec: flac
+# uses test recording above (record_secs = 60); run on the Pi to check encode cost fits alongside capture
+import resource
+import time
+from subprocess import Popen, PIPE
+wav_output_filename = './logs/test1.wav'
+with wave.open(wav_output_filename, 'rb') as f:
+    audio_seconds = f.getnframes() / f.getframerate()
+for flac_level in [0, 5, 8]:
+    flac_filename = './logs/test1_{0:d}.flac'.format(flac_level)
+    usage_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    encode_start = time.perf_counter()
+    p1 = Popen(['flac', '--silent', '--force', '-{0:d}'.format(flac_level), '-o', flac_filename,
+                wav_output_filename], stdout=PIPE, stderr=PIPE)
+    p1.communicate()
+    encode_seconds = time.perf_counter() - encode_start
+    usage_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_seconds = (usage_end.ru_utime + usage_end.ru_stime) - (usage_start.ru_utime + usage_start.ru_stime)
+    print("flac level {0:d}: {1:.2f} s cpu, {2:.2f} s elapsed per minute of audio, size {3:.0%} of wav"
+          .format(flac_level, cpu_seconds * 60. / audio_seconds, encode_seconds * 60. / audio_seconds,
+                  Path(flac_filename).stat().st_size / Path(wav_output_filename).stat().st_size))
+# %%
+# benchmark analysis of one minute of audio, levels and third-octave bands, as done by the recorder
+# with analysis: true and band-analysis: 'third-octave'; run on the Pi to check cost fits alongside capture
+import numpy as np
+from audioanalysis import AudioAnalyzer
+with wave.open(wav_output_filename, 'rb') as f:
+    audio_rate = f.getframerate()
+    audio_frames = f.readframes(f.getnframes())
+for band_analysis in [None, 'octave', 'third-octave']:
+    analyzer = AudioAnalyzer({'sample-rate': audio_rate, 'channels': 1, 'band-analysis': band_analysis},
+                             msg_handler=None)
+    analyzer.start_segment(Path(wav_output_filename))
+    cpu_start = time.process_time()
+    for ii in range(0, len(audio_frames), 2 * chunk):
+        analyzer.analyze_chunk(audio_frames[ii:ii + 2 * chunk])
+    analyzer.close_second()
+    cpu_seconds = time.process_time() - cpu_start
+    print("band analysis {0}: {1:.3f} s cpu per minute of audio"
+          .format(band_analysis, cpu_seconds * 60. / (len(audio_frames) / 2 / audio_rate)))
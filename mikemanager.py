@@ -5,21 +5,28 @@ Manage microphone with pyaudio
 """
 import logging
 import os
+import shutil
 import sys
 import threading
 import time
 import traceback
 import wave
-from collections import deque
+from collections import OrderedDict, deque
 from pathlib import Path
 from subprocess import Popen, PIPE
 import argparse
 import glob
+import json
 import yaml
 import pandas as pd
 from pandas.tseries.offsets import Minute
 from pyaudio import PyAudio
 from logmanager import MessageHandler
+from audioanalysis import AudioAnalyzer
+try:
+    import resource  # unix only, cpu time of flac encoder
+except ImportError:
+    resource = None  # flac encoder cpu time not reported
 
 TIMESTAMP_FORMAT = '%m/%d/%Y %H:%M:%S.%f'
 TIMESTAMP_FORMAT_SQL = '%Y-%m-%d %H:%M:%S'
@@ -27,8 +34,523 @@ WAV_FILE_TIMESTAMP = '%Y%m%d%H%M'
 MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 os.chdir(MODULE_DIRECTORY)
 LOG_DIR = str(Path('./logs').absolute())
-OUTPUT_QUEUE = deque([], 5)  # used to queue frames for saving to wav file
-STOP_QUEUE = deque([], 1)  # used to issue stop command
+STAGING_DIR = str(Path(LOG_DIR, 'staging'))  # default local directory segments are recorded to
+SEGMENT_FILENAME_FORM = '{0}{1}.wav'  # segment end timestamp, output name
+SEGMENT_KEY_LENGTH = 12  # length of segment end timestamp starting each file name
+OUTPUT_CODECS = ['wav', 'flac']  # output-codec options, segments are recorded as wav and encoded by writer
+FLAC_COMPRESSION_LEVEL = 5  # default flac compression level, 0 (fastest) to 8 (smallest)
+QUEUE_SEGMENTS = 5  # default segments queued in memory for writer before spilling
+SPILL_SEGMENTS = 1440  # default segments spilled to local disk before oldest are dropped
+SPILL_DIR_NAME = 'spill'  # subdirectory of staging directory holding spilled segments
+UPLOAD_DIR_NAME = 'upload'  # subdirectory of staging directory holding files waiting for upload
+UPLOAD_MANIFEST_NAME = 'pending_uploads.json'  # persisted list of files waiting for upload
+UPLOAD_RETRY_SECONDS = 5.0  # initial wait after failed upload, doubled on each failure
+UPLOAD_MAX_RETRY_SECONDS = 300.0  # maximum wait between upload attempts
+UPLOAD_CLOSE_SECONDS = 60.0  # time allowed on shutdown for pending uploads, rest resume on next run
+RETENTION_INDEX_NAME = 'retention_index.json'  # persisted index of segments saved to destination
+RETENTION_KEEP_SEGMENTS = 10  # default segments kept in destination when delete-old is set
+RETENTION_BATCH_FILES = 100  # maximum files deleted per retention pass
+RETENTION_CHECK_SECONDS = 60.0  # retention policies are checked at least this often
+
+
+class SegmentQueue:
+    """
+    FIFO hand-off of recorded segment files from recorder to writer. Up to capacity segments
+    are queued in memory; while the writer is behind, further segments are spilled, i.e. their
+    files are moved to a spill directory on local disk, and handed to the writer in order once it
+    catches up. Spilled segments left by a previous run are picked up on start. Past spill_limit
+    spilled segments, the oldest is deleted and logged as dropped.
+    """
+    _msg_handler: MessageHandler = None  # logging interface
+    _capacity: int = None  # segments queued in memory
+    _spill_limit: int = None  # segments spilled before oldest spilled segment is dropped
+    _spill_dir: Path = None  # local directory holding spilled segments
+    _queue: deque = None  # (segment path, segment end) in memory, oldest first
+    _spilled: deque = None  # (segment path, segment end) on spill directory, oldest first
+    _condition: threading.Condition = None  # guards queues, signals writer
+    _stop_event: threading.Event = None  # set when recording has finished
+    _counts: dict = None  # segments queued, spilled, dropped and written
+    _max_lag_seconds: float = 0.  # maximum time between end of segment and end of its write
+
+    def __init__(self, recorder_info: dict, msg_handler: MessageHandler):
+        self._msg_handler = msg_handler
+        self._capacity = recorder_info.get('queue-segments', QUEUE_SEGMENTS)
+        self._spill_limit = recorder_info.get('spill-segments', SPILL_SEGMENTS)
+        self._spill_dir = Path(recorder_info.get('staging-dir', STAGING_DIR), SPILL_DIR_NAME)
+        if not self._spill_dir.exists():
+            self._spill_dir.mkdir(parents=True)
+        self._queue = deque()
+        self._spilled = deque()
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._counts = {'queued': 0, 'spilled': 0, 'dropped': 0, 'written': 0}
+        self._max_lag_seconds = 0.
+        for spilled_file in sorted(self._spill_dir.glob('*.wav')):
+            try:
+                end = pd.to_datetime(spilled_file.name[:SEGMENT_KEY_LENGTH], format=WAV_FILE_TIMESTAMP)
+            except ValueError:
+                continue
+            self._spilled.append((spilled_file, end))
+        if self._spilled:
+            msg_handler.log("{0:d} spilled segments pending from previous run".format(len(self._spilled)))
+
+    def put(self, segment_path: Path, end: pd.Timestamp):
+        """
+        hand segment to writer, never blocks recorder. Segments are spilled while the memory
+        queue is full or earlier segments are still spilled, so order is preserved
+        :param segment_path: recorded segment file
+        :param end: end of segment
+        :return: None
+        """
+        with self._condition:
+            if len(self._queue) < self._capacity and not self._spilled:
+                self._queue.append((segment_path, end))
+                self._counts['queued'] += 1
+            else:
+                spill_path = Path(self._spill_dir, segment_path.name)
+                os.replace(str(segment_path), str(spill_path))
+                self._spilled.append((spill_path, end))
+                self._counts['spilled'] += 1
+                if len(self._spilled) > self._spill_limit:
+                    dropped_path, _ = self._spilled.popleft()
+                    os.remove(str(dropped_path))
+                    self._counts['dropped'] += 1
+                    self._msg_handler.log("segment queue: {0:d} segments spilled, writer behind, dropped oldest {1} "
+                                          "({2:d} dropped)".format(self._spill_limit, dropped_path.name,
+                                                                   self._counts['dropped']), logging.WARNING)
+            self._condition.notify()
+
+    def get(self):
+        """
+        oldest segment not yet written, blocks until one is available
+        :return: (segment path, segment end), None once stopped and all segments handed out
+        """
+        with self._condition:
+            while not self._queue and not self._spilled:
+                if self._stop_event.is_set():
+                    return None
+                self._condition.wait()
+            if self._queue:
+                return self._queue.popleft()
+            return self._spilled.popleft()
+
+    def mark_written(self, end: pd.Timestamp):
+        """
+        record that segment has been written
+        :param end: end of segment
+        :return: lag between end of segment and now, seconds
+        """
+        lag_seconds = (pd.Timestamp.now() - end).total_seconds()
+        with self._condition:
+            self._counts['written'] += 1
+            self._max_lag_seconds = max(self._max_lag_seconds, lag_seconds)
+        return lag_seconds
+
+    def __len__(self):
+        with self._condition:
+            return len(self._queue) + len(self._spilled)
+
+    def get_counts(self):
+        with self._condition:
+            return dict(self._counts, pending=len(self._queue) + len(self._spilled),
+                        max_lag_seconds=self._max_lag_seconds)
+
+    def stop(self):
+        """
+        signal that no more segments will be put, writer exits once queue is drained
+        :return: None
+        """
+        with self._condition:
+            self._stop_event.set()
+            self._condition.notify_all()
+
+    def wait_stopped(self, timeout: float = None):
+        return self._stop_event.wait(timeout)
+
+
+class SegmentWriter:
+    """
+    Writes an audio segment to a wav file chunk by chunk as it is recorded. The file is
+    written under a partial name, the header is finalized and the file renamed on close
+    """
+    segment_path: Path = None  # final path of segment file
+    frames_written: int = 0  # audio frames written to segment
+    _partial_path: Path = None  # path of segment file while being written
+    _wavefile: wave.Wave_write = None  # open wav file
+    _frame_bytes: int = None  # bytes per audio frame, all channels
+
+    def __init__(self, segment_path: Path, recorder_info: dict):
+        self.segment_path = segment_path
+        self._partial_path = segment_path.with_name(segment_path.name + '.part')
+        self._frame_bytes = 2 * recorder_info['channels']
+        self._wavefile = wave.open(str(self._partial_path), 'wb')
+        self._wavefile.setnchannels(recorder_info['channels'])
+        self._wavefile.setsampwidth(2)  # really audio.get_sample_size(FORM_1)
+        self._wavefile.setframerate(recorder_info['sample-rate'])
+        self.frames_written = 0
+
+    def write(self, data):
+        """
+        append chunk of audio to segment file
+        :param data: bytes-like chunk of audio frames
+        :return: None
+        """
+        self._wavefile.writeframesraw(data)
+        self.frames_written += len(data) // self._frame_bytes
+
+    def close(self):
+        """
+        finalize header and move segment file to final name
+        :return: path of segment file
+        """
+        self._wavefile.close()
+        os.replace(str(self._partial_path), str(self.segment_path))
+        return self.segment_path
+
+
+class RetentionManager:
+    """
+    Deletes old recordings from the destination directory. Keeps an index of saved segments,
+    persisted in the staging directory, so policies are applied without listing the destination.
+    Segments are removed oldest first while there are more than keep-segments, the oldest is
+    older than keep-hours or all segments total more than keep-megabytes; deletion runs in
+    batches on its own thread.
+    """
+    _recorder_info: dict = None  # configuration information
+    _msg_handler: MessageHandler = None  # logging interface
+    _index_path: Path = None  # persisted index of segments
+    _segments: OrderedDict = None  # segment timestamp -> {file name: bytes}, oldest first
+    _total_bytes: int = 0  # bytes of all indexed files
+    _keep_segments: int = None  # maximum segments kept, None for no limit
+    _keep_seconds: float = None  # maximum age of segments kept, None for no limit
+    _keep_bytes: int = None  # maximum bytes of segments kept, None for no limit
+    _lock: threading.Lock = None  # guards index
+    _wake_event: threading.Event = None  # set when segment added or on stop
+    _stop_event: threading.Event = None  # signals thread to exit
+    _thread: threading.Thread = None  # deletion thread
+    _deleted_count: int = 0  # files deleted
+
+    def __init__(self, recorder_info: dict, msg_handler: MessageHandler):
+        self._recorder_info = recorder_info
+        self._msg_handler = msg_handler
+        self._index_path = Path(recorder_info.get('staging-dir', STAGING_DIR), RETENTION_INDEX_NAME)
+        policies = [recorder_info.get(k) for k in ('keep-segments', 'keep-hours', 'keep-megabytes')]
+        if all(policy is None for policy in policies):
+            policies[0] = RETENTION_KEEP_SEGMENTS
+        self._keep_segments = policies[0]
+        self._keep_seconds = policies[1] * 3600. if policies[1] is not None else None
+        self._keep_bytes = int(policies[2] * 1e6) if policies[2] is not None else None
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._segments = OrderedDict()
+        if self._index_path.exists():
+            try:
+                with open(self._index_path, 'r') as f:
+                    self._segments = OrderedDict((k, v) for k, v in json.load(f))
+            except ValueError as ex:
+                self._msg_handler.log("retention: could not read index, rebuilding: {0}".format(str(ex)),
+                                      logging.WARNING)
+        self._total_bytes = sum(sum(files.values()) for files in self._segments.values())
+        self._thread = threading.Thread(target=self.run_retention, name='retention')
+        self._thread.daemon = True
+
+    def start(self):
+        self._msg_handler.log("retention: {0:d} segments indexed, keep segments {1}, hours {2}, megabytes {3}"
+                              .format(len(self._segments), self._keep_segments,
+                                      self._recorder_info.get('keep-hours'), self._recorder_info.get('keep-megabytes')))
+        self._thread.start()
+
+    def add(self, filename: str, file_bytes: int):
+        """
+        index file saved to destination, files are grouped by the segment timestamp which starts their name
+        :param filename: name of file in destination directory
+        :param file_bytes: size of file
+        :return: None
+        """
+        segment_key = filename[:SEGMENT_KEY_LENGTH]
+        with self._lock:
+            if segment_key not in self._segments:
+                in_order = not self._segments or segment_key > next(reversed(self._segments))
+                self._segments[segment_key] = {}
+                if not in_order:
+                    self._segments = OrderedDict(sorted(self._segments.items()))
+            self._total_bytes += file_bytes - self._segments[segment_key].get(filename, 0)
+            self._segments[segment_key][filename] = file_bytes
+        self._wake_event.set()
+
+    def seed_from_destination(self):
+        """
+        index existing recordings, once, when there is no persisted index
+        :return: None
+        """
+        dest_dir = Path(self._recorder_info['dest-dir'])
+        sound_files = sorted(glob.glob(str(Path(dest_dir, '*{0}*'.format(self._recorder_info['output-name'])))))
+        for sound_file in sound_files:
+            self.add(Path(sound_file).name, Path(sound_file).stat().st_size)
+        self._msg_handler.log("retention: indexed {0:d} existing files in {1}".format(len(sound_files), dest_dir))
+
+    def get_expired(self):
+        """
+        oldest files breaching a retention policy, up to a batch; caller holds lock
+        :return: list of (segment timestamp, file name) tuples
+        """
+        expired = []
+        segments_left = len(self._segments)
+        bytes_left = self._total_bytes
+        oldest_kept = (pd.Timestamp.now() - pd.Timedelta(seconds=self._keep_seconds)).strftime(WAV_FILE_TIMESTAMP)\
+            if self._keep_seconds is not None else None
+        for segment_key, files in self._segments.items():
+            if not ((self._keep_segments is not None and segments_left > self._keep_segments)
+                    or (oldest_kept is not None and segment_key < oldest_kept)
+                    or (self._keep_bytes is not None and bytes_left > self._keep_bytes)):
+                break
+            expired += [(segment_key, filename) for filename in files]
+            segments_left -= 1
+            bytes_left -= sum(files.values())
+            if len(expired) >= RETENTION_BATCH_FILES:
+                break
+        return expired
+
+    def delete_expired(self):
+        """
+        delete a batch of expired files and persist index
+        :return: number of files deleted
+        """
+        with self._lock:
+            expired = self.get_expired()
+        deleted = []
+        for segment_key, filename in expired:
+            try:
+                os.remove(str(Path(self._recorder_info['dest-dir'], filename)))
+            except FileNotFoundError:
+                pass
+            except OSError as ex:
+                self._msg_handler.log("retention: could not delete {0}, retrying later: {1}"
+                                      .format(filename, str(ex)), logging.WARNING)
+                break
+            deleted.append((segment_key, filename))
+        with self._lock:
+            for segment_key, filename in deleted:
+                self._total_bytes -= self._segments[segment_key].pop(filename)
+                if not self._segments[segment_key]:
+                    del self._segments[segment_key]
+            self._deleted_count += len(deleted)
+            index_tmp = self._index_path.with_name(RETENTION_INDEX_NAME + '.tmp')
+            with open(index_tmp, 'w') as f:
+                json.dump(list(self._segments.items()), f)
+            os.replace(str(index_tmp), str(self._index_path))
+        if deleted:
+            self._msg_handler.log("retention: deleted {0} and older, {1:d} files, {2:d} segments kept"
+                                  .format(deleted[-1][1], len(deleted), len(self._segments)))
+        return len(deleted)
+
+    def run_retention(self):
+        """
+        apply retention policies when a segment is added and at least every RETENTION_CHECK_SECONDS
+        :return: None
+        """
+        seeded = self._index_path.exists()
+        while not self._stop_event.is_set():
+            self._wake_event.wait(RETENTION_CHECK_SECONDS)
+            self._wake_event.clear()
+            if not Path(self._recorder_info['dest-dir']).exists():
+                continue  # destination not mounted, uploader will mount it
+            try:
+                if not seeded:
+                    self.seed_from_destination()
+                    seeded = True
+                while self.delete_expired() >= RETENTION_BATCH_FILES and not self._stop_event.is_set():
+                    pass
+            except Exception as ex:
+                self._msg_handler.log("retention: pass failed: {0}".format(str(ex)), logging.WARNING)
+
+    def close(self, timeout: float = 30.):
+        self._stop_event.set()
+        self._wake_event.set()
+        self._thread.join(timeout)
+        self._msg_handler.log("retention: stopped, {0:d} files deleted".format(self._deleted_count))
+
+
+class SegmentUploader:
+    """
+    Background thread which copies finished files from the local upload directory to the
+    destination directory (typically on a network share), oldest first. Pending files are
+    listed in a manifest persisted in the upload directory, so uploads resume after a restart.
+    Mounting the share and retrying failed uploads, with exponential backoff, happen on this
+    thread only, so a slow or missing share never holds up recording or the writer.
+    """
+    _recorder_info: dict = None  # configuration information
+    _msg_handler: MessageHandler = None  # logging interface
+    _upload_dir: Path = None  # local directory holding files waiting for upload
+    _manifest_path: Path = None  # persisted list of files waiting for upload
+    _pending: deque = None  # names of files waiting for upload, oldest first
+    _lock: threading.Lock = None  # guards pending list and manifest
+    _wake_event: threading.Event = None  # set when file added or on stop
+    _stop_event: threading.Event = None  # signals thread to exit once pending files are uploaded
+    _thread: threading.Thread = None  # upload thread
+    _counts: dict = None  # files uploaded, failed upload attempts, files missing when due for upload
+    _bytes_uploaded: int = 0  # total bytes uploaded
+    _upload_seconds: float = 0.  # total time spent copying uploaded files
+    _retention: RetentionManager = None  # deletes old recordings from destination, None to keep all
+
+    def __init__(self, recorder_info: dict, msg_handler: MessageHandler, retention: RetentionManager = None):
+        self._recorder_info = recorder_info
+        self._msg_handler = msg_handler
+        self._retention = retention
+        self._upload_dir = Path(recorder_info.get('staging-dir', STAGING_DIR), UPLOAD_DIR_NAME)
+        if not self._upload_dir.exists():
+            self._upload_dir.mkdir(parents=True)
+        self._manifest_path = Path(self._upload_dir, UPLOAD_MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._counts = {'uploaded': 0, 'failed': 0, 'missing': 0}
+        self._pending = deque(self.load_manifest())
+        self._thread = threading.Thread(target=self.run_uploader, name='segment-uploader')
+        self._thread.daemon = True
+
+    def load_manifest(self):
+        """
+        files pending from a previous run: manifest entries whose files still exist, plus any
+        file moved to the upload directory before the manifest was saved
+        :return: list of file names, oldest first
+        """
+        pending = []
+        if self._manifest_path.exists():
+            try:
+                with open(self._manifest_path, 'r') as f:
+                    pending = json.load(f)
+            except ValueError as ex:
+                self._msg_handler.log("uploader: could not read manifest, rebuilding: {0}".format(str(ex)),
+                                      logging.WARNING)
+        on_disk = set(p.name for p in self._upload_dir.iterdir()
+                      if p.is_file() and p.name != UPLOAD_MANIFEST_NAME and not p.name.endswith('.tmp'))
+        pending = [name for name in pending if name in on_disk]
+        pending += sorted(on_disk.difference(pending))
+        return pending
+
+    def save_manifest(self):
+        """
+        persist list of pending files, replacing manifest atomically; caller holds lock
+        :return: None
+        """
+        manifest_tmp = self._manifest_path.with_name(UPLOAD_MANIFEST_NAME + '.tmp')
+        with open(manifest_tmp, 'w') as f:
+            json.dump(list(self._pending), f)
+        os.replace(str(manifest_tmp), str(self._manifest_path))
+
+    def start(self):
+        with self._lock:
+            if self._pending:
+                self._msg_handler.log("uploader: {0:d} files pending from previous run".format(len(self._pending)))
+            self.save_manifest()
+        self._thread.start()
+
+    def add(self, file_path: Path):
+        """
+        move file to upload directory and queue it for upload
+        :param file_path: local file, on same file system as staging directory
+        :return: None
+        """
+        os.replace(str(file_path), str(Path(self._upload_dir, file_path.name)))
+        with self._lock:
+            self._pending.append(file_path.name)
+            self.save_manifest()
+        self._wake_event.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def run_uploader(self):
+        """
+        upload oldest pending file until none are left, then wait for more; on failure wait
+        with exponential backoff and retry. Once stopped, exits when nothing is pending or an
+        upload fails, files left pending are uploaded on next run
+        :return: None
+        """
+        retry_seconds = UPLOAD_RETRY_SECONDS
+        while True:
+            with self._lock:
+                filename = self._pending[0] if self._pending else None
+            if filename is None:
+                if self._stop_event.is_set():
+                    break
+                self._wake_event.wait()
+                self._wake_event.clear()
+                continue
+            try:
+                self.upload_file(filename)
+            except Exception as ex:
+                self._counts['failed'] += 1
+                self._msg_handler.log("uploader: upload of {0} failed, {1:d} pending, retrying in {2:.0f} s: {3}"
+                                      .format(filename, len(self), retry_seconds, str(ex)), logging.WARNING)
+                if self._stop_event.wait(retry_seconds):
+                    break
+                retry_seconds = min(2. * retry_seconds, UPLOAD_MAX_RETRY_SECONDS)
+                continue
+            retry_seconds = UPLOAD_RETRY_SECONDS
+
+    def upload_file(self, filename: str):
+        """
+        copy file to destination under a partial name, rename, then remove local copy. A file missing
+        from the upload directory cannot be uploaded by retrying, so its entry is dropped.
+        :param filename: name of file in upload directory
+        :return: None
+        """
+        local_path = Path(self._upload_dir, filename)
+        try:
+            file_bytes = local_path.stat().st_size
+        except FileNotFoundError:
+            with self._lock:
+                self._pending.popleft()
+                self.save_manifest()
+                self._counts['missing'] += 1
+            self._msg_handler.log("uploader: {0} missing from {1}, dropped from pending uploads"
+                                  .format(filename, self._upload_dir), logging.WARNING)
+            return
+        dest_dir = self._recorder_info['dest-dir']
+        if not Path(dest_dir).exists():
+            mount_destination(self._recorder_info, self._msg_handler)
+            if not Path(dest_dir).exists():
+                raise OSError("destination {0} not available".format(dest_dir))
+        dest_path = Path(dest_dir, filename)
+        partial_path = dest_path.with_name(filename + '.part')
+        copy_start = time.perf_counter()
+        shutil.copyfile(str(local_path), str(partial_path))
+        os.replace(str(partial_path), str(dest_path))
+        copy_seconds = time.perf_counter() - copy_start
+        os.remove(str(local_path))
+        with self._lock:
+            self._pending.popleft()
+            self.save_manifest()
+            self._counts['uploaded'] += 1
+            self._bytes_uploaded += file_bytes
+            self._upload_seconds += copy_seconds
+            pending = len(self._pending)
+        self._msg_handler.log("uploader: {0} uploaded, {1:d} bytes in {2:.2f} s ({3:.0f} kB/s), {4:d} pending"
+                              .format(filename, file_bytes, copy_seconds,
+                                      file_bytes / 1000. / max(copy_seconds, 1e-6), pending))
+        if self._retention is not None:
+            self._retention.add(filename, file_bytes)
+
+    def get_counts(self):
+        with self._lock:
+            return dict(self._counts, pending=len(self._pending), bytes_uploaded=self._bytes_uploaded,
+                        mean_kbps=self._bytes_uploaded / 1000. / self._upload_seconds
+                        if self._upload_seconds else 0.)
+
+    def close(self, timeout: float = UPLOAD_CLOSE_SECONDS):
+        """
+        stop uploader once pending files are uploaded, waiting at most timeout
+        :param timeout: seconds to wait for pending uploads
+        :return: None
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        self._thread.join(timeout)
+        self._msg_handler.log("uploader: stopped, counts {0}".format(str(self.get_counts())))
 
 
 class MikeManager:
@@ -38,10 +560,22 @@ class MikeManager:
     _recorder_info: dict = None  # configuration information
     _msg_handler: MessageHandler = None  # logging interface
     py_audio: PyAudio = None  # PyAudio representation of microphone
+    _staging_dir: Path = None  # local directory segments are recorded to before saving to destination
+    _segment_writer: SegmentWriter = None  # writer for segment being recorded
+    _segment_end: pd.Timestamp = None  # end of segment being recorded
+    _segment_queue: SegmentQueue = None  # hand-off of recorded segments to writer
+    _analyzer: AudioAnalyzer = None  # computes levels from recorded chunks, None if analysis not configured
 
-    def __init__(self, recorder_info: dict, msg_handler: MessageHandler):
+    def __init__(self, recorder_info: dict, msg_handler: MessageHandler, segment_queue: SegmentQueue = None,
+                 analyzer: AudioAnalyzer = None):
         self._recorder_info = recorder_info
         self._msg_handler = msg_handler
+        self._segment_queue = segment_queue
+        self._analyzer = analyzer
+        self._staging_dir = Path(recorder_info.get('staging-dir', STAGING_DIR))
+        if not self._staging_dir.exists():
+            self._msg_handler.log("creating directory {0}".format(self._staging_dir))
+            self._staging_dir.mkdir(parents=True)
         self.initialize()
 
     def initialize(self):
@@ -61,6 +595,17 @@ class MikeManager:
                   .format(device_ind, self.py_audio.get_device_info_by_index(device_ind).get('name')))
         self.py_audio.terminate()
 
+    def open_stream(self):
+        """
+        open PyAudio input stream in accordance with config file
+        :return: PyAudio stream
+        """
+        return self.py_audio.open(format=self._recorder_info['format'], rate=self._recorder_info['sample-rate'],
+                                  channels=self._recorder_info['channels'],
+                                  input_device_index=self._recorder_info['device-index'],
+                                  input=self._recorder_info['input'],
+                                  frames_per_buffer=self._recorder_info['chunk'])
+
     def create_recording(self, end: pd.Timestamp):
         """
         create audio recording in accordiance with config file, append to queue
@@ -68,81 +613,215 @@ class MikeManager:
         :return:
         """
         now = pd.Timestamp.now()
-        record_secs = (end - now).seconds
-        record_frames_num = int((self._recorder_info['sample-rate'] / self._recorder_info['chunk']) * record_secs)
-        self._msg_handler.log("recording until {0}, {1:d} seconds"
+        record_secs = (end - now).total_seconds()
+        record_frames_num = int(round((self._recorder_info['sample-rate'] / self._recorder_info['chunk'])
+                                      * record_secs))
+        self._msg_handler.log("recording until {0}, {1:.3f} seconds"
                               .format(end.strftime(TIMESTAMP_FORMAT_SQL), record_secs))
-        stream = self.py_audio.open(format=self._recorder_info['format'], rate=self._recorder_info['sample-rate'],
-                                    channels=self._recorder_info['channels'],
-                                    input_device_index=self._recorder_info['device-index'],
-                                    input=self._recorder_info['input'],
-                                    frames_per_buffer=self._recorder_info['chunk'])
+        stream = self.open_stream()
         self._msg_handler.log("recording {0:d} frames".format(record_frames_num))
-        frames = []
+        self.start_segment(end)
+        chunks_read = 0
         for ii in range(0, record_frames_num):
             data = stream.read(self._recorder_info['chunk'], exception_on_overflow=False)
-            frames.append(data)
-        if len(frames) != record_frames_num:
-            self._msg_handler.log("Warning: {0:d) requested, {1:d} frames received"
-                                  .format(len(frames), record_frames_num))
-        if len(frames) == 0:
+            self.append_segment(data)
+            chunks_read += 1
+        if chunks_read != record_frames_num:
+            self._msg_handler.log("Warning: {0:d} requested, {1:d} frames received"
+                                  .format(record_frames_num, chunks_read))
+        if chunks_read == 0:
             self._msg_handler.log(msg="No Frames received, reinitializing...", lvl=logging.WARNING)
             self.close()
             self.initialize()
-        self._msg_handler.log("finished recording {0:d} frames".format(len(frames)))
+        self._msg_handler.log("finished recording {0:d} frames".format(chunks_read))
         # stop the stream, close it, and terminate the pyaudio instantiation
         stream.stop_stream()
         stream.close()
         self._msg_handler.log("stopped stream appending to queue..")
-        OUTPUT_QUEUE.append((frames, end))
+        self.finish_segment()
+
+    def record_continuous(self, first_end: pd.Timestamp, segments: int = None):
+        """
+        record from a single long-lived stream, cut into one-minute segments. Segments are cut
+        at exact sample counts, within a chunk if need be, so no samples are lost between segments.
+        Frames lost while a failed stream is reopened are written as silence, so segments stay on
+        minute boundaries; if the segment end passed meanwhile, recording restarts at the next one.
+        :param first_end: end of first segment, which runs from now
+        :param segments: number of segments to record, indefinitely if None
+        :return: None
+        """
+        sample_rate = self._recorder_info['sample-rate']
+        chunk = self._recorder_info['chunk']
+        frame_bytes = 2 * self._recorder_info['channels']  # 16-bit samples
+        segment_frames = 60 * sample_rate
+        self._msg_handler.log("continuous recording, first segment ends {0}"
+                              .format(first_end.strftime(TIMESTAMP_FORMAT_SQL)))
+        stream = self.open_stream()
+        frames_left = int(round((first_end - pd.Timestamp.now()).total_seconds() * sample_rate))
+        self.start_segment(first_end)
+        segments_done = 0
+        while segments is None or segments_done < segments:
+            try:
+                data = memoryview(stream.read(chunk, exception_on_overflow=False))
+            except OSError as ex:
+                self._msg_handler.log("stream read failed, reopening stream: {0}".format(str(ex)), logging.WARNING)
+                stream.close()
+                self.close()
+                self.initialize()
+                stream = self.open_stream()
+                due_frames = int(round((self._segment_end - pd.Timestamp.now()).total_seconds() * sample_rate))
+                if due_frames > 0:
+                    data = memoryview(bytes(max(frames_left - due_frames, 0) * frame_bytes))
+                    self._msg_handler.log("stream reopened, {0:d} lost frames written as silence"
+                                          .format(len(data) // frame_bytes), logging.WARNING)
+                else:
+                    self.append_segment(bytes(frames_left * frame_bytes))
+                    self.finish_segment()
+                    segments_done += 1
+                    if segments is not None and segments_done >= segments:
+                        break
+                    next_end = pd.Timestamp.now().floor('min') + Minute(1)
+                    self._msg_handler.log("stream reopened after end of segment {0}, rest written as silence, "
+                                          "recording resumes with segment ending {1}"
+                                          .format(self._segment_end.strftime(TIMESTAMP_FORMAT_SQL),
+                                                  next_end.strftime(TIMESTAMP_FORMAT_SQL)), logging.WARNING)
+                    self.start_segment(next_end)
+                    frames_left = int(round((next_end - pd.Timestamp.now()).total_seconds() * sample_rate))
+                    continue
+            while len(data) >= frames_left * frame_bytes:  # chunk completes current segment
+                self.append_segment(data[:frames_left * frame_bytes])
+                data = data[frames_left * frame_bytes:]
+                self.finish_segment()
+                segments_done += 1
+                self._msg_handler.log("segment ending {0} complete, {1:.3f} s after wall clock"
+                                      .format(self._segment_end.strftime(TIMESTAMP_FORMAT_SQL),
+                                              (pd.Timestamp.now() - self._segment_end).total_seconds()))
+                if segments is not None and segments_done >= segments:
+                    break
+                self.start_segment(self._segment_end + Minute(1))
+                frames_left = segment_frames
+            if len(data) > 0 and (segments is None or segments_done < segments):
+                self.append_segment(data)
+                frames_left -= len(data) // frame_bytes
+        stream.stop_stream()
+        stream.close()
+        self._msg_handler.log("continuous recording finished, {0:d} segments".format(segments_done))
 
+    def start_segment(self, end: pd.Timestamp):
+        """
+        open local file for segment ending at end
+        :param end: end of segment, names segment file
+        :return: None
+        """
+        self._segment_end = end
+        filename = SEGMENT_FILENAME_FORM.format(end.strftime(WAV_FILE_TIMESTAMP), self._recorder_info['output-name'])
+        self._segment_writer = SegmentWriter(Path(self._staging_dir, filename), self._recorder_info)
+        if self._analyzer is not None:
+            self._analyzer.start_segment(self._segment_writer.segment_path)
+
+    def append_segment(self, data):
+        self._segment_writer.write(data)
+        if self._analyzer is not None:
+            self._analyzer.feed(data)
+
+    def finish_segment(self):
+        """
+        close segment file, queue it for saving to destination; empty segments are discarded
+        :return: None
+        """
+        segment_path = self._segment_writer.close()
+        if self._analyzer is not None:
+            self._analyzer.finish_segment(self._segment_end)
+        if self._segment_writer.frames_written == 0:
+            os.remove(str(segment_path))
+            return
+        self._segment_queue.put(segment_path, self._segment_end)
 
-def check_queue_and_write(recorder_info: dict, msg_handler: MessageHandler):
+
+def check_queue_and_write(recorder_info: dict, msg_handler: MessageHandler, segment_queue: SegmentQueue,
+                          uploader: SegmentUploader):
     """
-    check recording queue, write audio file to specified location
+    take recorded segments from queue in order, hand audio files to uploader for saving to destination
     :param recorder_info: configuration dictionary
     :param msg_handler: logger
+    :param segment_queue: hand-off of recorded segments
+    :param uploader: uploader to destination directory
     :return: None
     """
     msg_handler.log("Initializing writer thread...")
-    delete_old = recorder_info['delete-old']
-    if delete_old:
-        msg_handler.log("deleting old files...")
-    wav_output_filename_form = '{0}{1}.wav'
     while True:
-        if OUTPUT_QUEUE:  # check output queue, write frames
-            frames, end = OUTPUT_QUEUE.pop()
-            filename = wav_output_filename_form\
-                .format(end.strftime(WAV_FILE_TIMESTAMP), recorder_info['output-name'])
-            save_folder_path = recorder_info['dest-dir']
-            if not Path(recorder_info['dest-dir']).exists():
-                save_folder_path = mount_destination(recorder_info, msg_handler)
-            wav_output_filepath = str(Path(save_folder_path, filename).absolute())
-            if len(frames) > 0:
-                msg_handler.log("writer: saving {0} writing {1:d} frames"
-                                .format(str(wav_output_filepath), len(frames)))
-                with wave.open(wav_output_filepath, 'wb') as wavefile:
-                    wavefile.setnchannels(recorder_info['channels'])
-                    wavefile.setsampwidth(2)  # really audio.get_sample_size(FORM_1)
-                    wavefile.setframerate(recorder_info['sample-rate'])
-                    wavefile.writeframes(b''.join(frames))
-                    # wavefile.close()
-                msg_handler.log("writer: {0} save complete".format(str(filename)))
-                if delete_old:  # if delete old specified, only keep last 10 sound files, delete rest
-                    index_to_delete = 10
-                    sound_files = list(reversed(sorted(glob.glob(str(
-                        Path(save_folder_path, '*{0}.wav'.format(recorder_info['output-name'])))))))
-                    if len(sound_files) > index_to_delete:
-                        msg_handler.log("deleting: {0} and older, {1:d} files"
-                                        .format(Path(sound_files[index_to_delete]).stem,
-                                                len(sound_files[index_to_delete:])))
-                        for sound_file in sound_files[index_to_delete:]:
-                            os.remove(sound_file)
-        else:
-            if STOP_QUEUE:
-                msg_handler.log("writer: stop queue detected by writer thread, breaking...")
-                break
-            time.sleep(1)
+        queued_segment = segment_queue.get()
+        if queued_segment is None:
+            segment_counts = segment_queue.get_counts()
+            msg_handler.log("writer: stop detected and queue empty, segment counts {0}".format(str(segment_counts)))
+            if segment_counts['dropped']:
+                msg_handler.log("writer: {0:d} recorded segments were dropped while writer was behind"
+                                .format(segment_counts['dropped']), logging.WARNING)
+            break
+        segment_path, end = queued_segment
+        if recorder_info.get('output-codec', 'wav') == 'flac':
+            segment_path = encode_flac(segment_path, recorder_info, msg_handler)
+        uploader.add(segment_path)
+        msg_handler.log("writer: {0} queued for upload, lag {1:.1f} s, {2:d} segments pending"
+                        .format(segment_path.name, segment_queue.mark_written(end), len(segment_queue)))
+
+
+def check_output_codec(recorder_info: dict):
+    """
+    check configured output codec is known and its encoder is installed
+    :param recorder_info: configuration dictionary
+    :return: None
+    """
+    output_codec = recorder_info.get('output-codec', 'wav')
+    if output_codec not in OUTPUT_CODECS:
+        raise ValueError("output-codec {0} not one of {1}".format(output_codec, str(OUTPUT_CODECS)))
+    if output_codec == 'flac' and shutil.which('flac') is None:
+        raise ValueError("output-codec flac requires the flac encoder, e.g. sudo apt-get install flac")
+
+
+def get_children_cpu_seconds():
+    """
+    :return: cpu seconds used by finished child processes, None where not available (windows)
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def encode_flac(segment_path: Path, recorder_info: dict, msg_handler: MessageHandler):
+    """
+    losslessly encode wav segment to flac alongside it, in a separate process, removing wav file
+    :param segment_path: recorded wav segment
+    :param recorder_info: configuration dictionary
+    :param msg_handler: logger
+    :return: path of flac file, or of wav file if encoding failed
+    """
+    flac_path = segment_path.with_suffix('.flac')
+    partial_path = flac_path.with_name(flac_path.name + '.part')
+    encode_cmd = ['flac', '--silent', '--force',
+                  '-{0:d}'.format(recorder_info.get('flac-level', FLAC_COMPRESSION_LEVEL)),
+                  '-o', str(partial_path), str(segment_path)]
+    cpu_start = get_children_cpu_seconds()
+    encode_start = time.perf_counter()
+    p1 = Popen(encode_cmd, stdout=PIPE, stderr=PIPE)
+    stdoutdata, stderrdata = p1.communicate()
+    encode_seconds = time.perf_counter() - encode_start
+    cpu_end = get_children_cpu_seconds()
+    if p1.returncode != 0:
+        msg_handler.log("writer: flac encoding of {0} failed, keeping wav: {1}"
+                        .format(segment_path.name, stderrdata), logging.WARNING)
+        if partial_path.exists():
+            os.remove(str(partial_path))
+        return segment_path
+    os.replace(str(partial_path), str(flac_path))
+    wav_bytes = segment_path.stat().st_size
+    os.remove(str(segment_path))
+    cpu_text = "{0:.2f} s".format(cpu_end - cpu_start) if cpu_start is not None else "n/a"
+    msg_handler.log("writer: encoded {0}, {1:d} to {2:d} bytes ({3:.0%}), {4} cpu, {5:.2f} s elapsed"
+                    .format(flac_path.name, wav_bytes, flac_path.stat().st_size,
+                            flac_path.stat().st_size / max(wav_bytes, 1), cpu_text, encode_seconds))
+    return flac_path
 
 
 # noinspection PyTypeChecker
@@ -152,11 +831,14 @@ def check_audio_devices(recorder_info: dict, msg_handler: MessageHandler):
     mike_manager.close()
 
 
-def run_mike(recorder_info: dict, msg_handler: MessageHandler):
+def run_mike(recorder_info: dict, msg_handler: MessageHandler, segment_queue: SegmentQueue,
+             analyzer: AudioAnalyzer = None):
     """
     manage microphone, recording sounds to queue
     :param recorder_info: config specifications
     :param msg_handler: logger
+    :param segment_queue: hand-off of recorded segments to writer
+    :param analyzer: computes levels from recorded chunks, None if analysis not configured
     :return: None
     """
     start_time = pd.Timestamp.now()
@@ -176,7 +858,13 @@ def run_mike(recorder_info: dict, msg_handler: MessageHandler):
     if run_mins:
         msg_handler.log(str(end_times))
 
-    mike_manager = MikeManager(recorder_info, msg_handler)
+    mike_manager = MikeManager(recorder_info, msg_handler, segment_queue, analyzer)
+    if recorder_info.get('continuous'):
+        mike_manager.record_continuous(first_end=start_time, segments=run_mins)
+        mike_manager.close()
+        segment_queue.stop()
+        msg_handler.log("recording program thread ended")
+        return
     next_recording_time = end_times.pop(0)
     while True:
         if next_recording_time:
@@ -184,10 +872,8 @@ def run_mike(recorder_info: dict, msg_handler: MessageHandler):
         else:
             msg_handler.log("Maximum reads exceeded, closing...")
             mike_manager.close()
-            STOP_QUEUE.append("STOP")
-            secs_to_sleep = 10
-            msg_handler.log("Appended stop queue, Sleeping for {0:d} seconds".format(secs_to_sleep))
-            time.sleep(secs_to_sleep)
+            segment_queue.stop()
+            msg_handler.log("Signalled stop to writer")
             break
         if run_mins:
             if len(end_times) > 0:
@@ -247,35 +933,51 @@ def run_sound_recorder(recorder_info: dict, run_message_handler: MessageHandler)
     :param run_message_handler: logger
     :return:
     """
-    run_message_handler.log("Establishing destination directory...")
-    dest_dir = mount_destination(recorder_info, run_message_handler)
-    run_message_handler.log("Destination directory is {0}".format(dest_dir))
-    run_message_handler.log("writing sound files to {0}".format(dest_dir))
-    recorder_info['dest-dir'] = dest_dir
+    check_output_codec(recorder_info)
+    run_message_handler.log("uploading {0} sound files to {1}, mounting if needed"
+                            .format(recorder_info.get('output-codec', 'wav'), recorder_info['dest-dir']))
+    retention = None
+    if recorder_info['delete-old']:
+        run_message_handler.log("deleting old files...")
+        retention = RetentionManager(recorder_info, run_message_handler)
+        retention.start()
+    segment_queue = SegmentQueue(recorder_info, run_message_handler)
+    uploader = SegmentUploader(recorder_info, run_message_handler, retention)
+    uploader.start()
+    analyzer = None
+    if recorder_info.get('analysis'):
+        run_message_handler.log("writing per-second levels alongside sound files")
+        analyzer = AudioAnalyzer(recorder_info, run_message_handler, uploader.add)
+        analyzer.start()
     # create threads and start
     write_thread: threading.Thread = threading.Thread(target=check_queue_and_write,
-                                                      args=(recorder_info, run_message_handler,))
-    record_thread: threading.Thread = threading.Thread(target=run_mike, args=(recorder_info, run_message_handler,))
+                                                      args=(recorder_info, run_message_handler, segment_queue,
+                                                            uploader,))
+    record_thread: threading.Thread = threading.Thread(target=run_mike,
+                                                       args=(recorder_info, run_message_handler, segment_queue,
+                                                             analyzer,))
     write_thread.daemon = True
     record_thread.daemon = True
     write_thread.start()
     record_thread.start()
-    while True:
-        if STOP_QUEUE and not OUTPUT_QUEUE:  # gracefully stop threads if stop point reached
-            run_message_handler.log("Program stop signal received, stopping threads")
-            join_timout = 30.
-            write_thread.join(join_timout)
-            record_thread.join(join_timout)
-            if write_thread.is_alive():
-                run_message_handler.log("Write Thread is ALIVE!")
-            elif record_thread.is_alive():
-                run_message_handler.log("Record Thread is ALIVE!")
-            else:
-                run_message_handler.log("All threads joined, closing logger and exiting")
-            run_message_handler.close()
-            sys.exit(0)
-        else:
-            time.sleep(1)
+    segment_queue.wait_stopped()  # gracefully stop threads once recording has finished
+    run_message_handler.log("Program stop signal received, stopping threads")
+    join_timout = 30.
+    record_thread.join(join_timout)
+    write_thread.join(join_timout)  # writer exits once queue is drained
+    if analyzer is not None:
+        analyzer.close()
+    uploader.close()
+    if retention is not None:
+        retention.close()
+    if write_thread.is_alive():
+        run_message_handler.log("Write Thread is ALIVE!")
+    elif record_thread.is_alive():
+        run_message_handler.log("Record Thread is ALIVE!")
+    else:
+        run_message_handler.log("All threads joined, closing logger and exiting")
+    run_message_handler.close()
+    sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -40,4 +40,33 @@ print(pd.Timestamp.now().floor('250ms'))
 df = pd.read_csv('./logs/nsrt.csv')
 #%%
 df.loc[df.index.max(), :].to_markdown()
+#%%
+# per-insert latency: full database reflection per insert (previous behavior) vs cached table schema
+import time
+from sqlalchemy import MetaData, text
+from sqlalchemy.dialects.mysql import insert
+bench_table = 'bench_insert'
+with db_info.get_engine().begin() as con:
+    con.execute(text("CREATE TABLE IF NOT EXISTS {0} (id INT AUTO_INCREMENT PRIMARY KEY, "
+                     "timestamp DATETIME(6), message VARCHAR(50));".format(bench_table)))
+db_info.invalidate_table_cache()
+n_inserts = 50
+insert_row = {'timestamp': pd.Timestamp.now().to_pydatetime(), 'message': 'benchmark'}
+bench_start = time.perf_counter()
+for _ in range(n_inserts):
+    meta = MetaData()
+    meta.reflect(bind=db_info.get_engine())
+    meta = MetaData()
+    meta.reflect(bind=db_info.get_engine())
+    with db_info.get_engine().connect() as con:
+        con.execute(insert(meta.tables[bench_table]).values(insert_row))
+reflect_ms = (time.perf_counter() - bench_start) / n_inserts * 1000.
+bench_start = time.perf_counter()
+for _ in range(n_inserts):
+    db_info.insert_dict_to_table(table_name=bench_table, insert_dict=insert_row)
+cached_ms = (time.perf_counter() - bench_start) / n_inserts * 1000.
+print("per-insert latency, reflection: {0:.2f} ms, cached schema: {1:.2f} ms".format(reflect_ms, cached_ms))
+with db_info.get_engine().begin() as con:
+    con.execute(text("DROP TABLE {0};".format(bench_table)))
+db_info.invalidate_table_cache(bench_table)
 #%%
\ No newline at end of file
@@ -0,0 +1,165 @@
+#!/usr/bin/python -u
+# coding=utf-8
+"""
+Fixed-capacity, numpy-backed ring buffer for sound meter readings
+Readings are stored column-wise, meter parameters are stored once and referenced by id,
+blocks of readings are handed to a DataManager as views into the buffer
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from datatablecreate import PARAMS_COLUMNS
+
+READING_COLUMNS = ['lavg', 'leq', 'temp_f']  # measured values, stored as float32
+
+
+class ReadingBlock:
+    """
+    Consecutive sound meter readings for one meter, held as numpy arrays
+    """
+    nsrt_id: int = None  # meter identification defined in config file for meta data
+    timestamp_ns: np.ndarray = None  # int64 nanoseconds since epoch (local time, as pd.Timestamp.now().value)
+    lavg: np.ndarray = None  # float32 'L' level per reading
+    leq: np.ndarray = None  # float32 leq per reading
+    temp_f: np.ndarray = None  # float32 temperature (F) per reading
+    params_id: np.ndarray = None  # int16 local parameter set id per reading
+    params: dict = None  # local parameter set id -> OrderedDict of meter parameters
+
+    def __init__(self, nsrt_id: int, timestamp_ns: np.ndarray, lavg: np.ndarray, leq: np.ndarray,
+                 temp_f: np.ndarray, params_id: np.ndarray, params: dict):
+        self.nsrt_id = nsrt_id
+        self.timestamp_ns = timestamp_ns
+        self.lavg = lavg
+        self.leq = leq
+        self.temp_f = temp_f
+        self.params_id = params_id
+        self.params = params
+
+    def __len__(self):
+        return len(self.timestamp_ns)
+
+    def copy(self):
+        """
+        copy of block which no longer references the ring buffer
+        :return: ReadingBlock
+        """
+        return ReadingBlock(self.nsrt_id, self.timestamp_ns.copy(), self.lavg.copy(), self.leq.copy(),
+                            self.temp_f.copy(), self.params_id.copy(), dict(self.params))
+
+    def get_timestamps(self):
+        """
+        :return: timestamps of readings as pandas DatetimeIndex
+        """
+        return pd.DatetimeIndex(self.timestamp_ns.astype('datetime64[ns]'), name='timestamp')
+
+    def get_params_frame(self):
+        """
+        :return: dataframe of meter parameters for each reading
+        """
+        params_frame = pd.DataFrame.from_dict(self.params, orient='index', columns=PARAMS_COLUMNS)
+        return params_frame.loc[self.params_id].set_index(self.get_timestamps())
+
+    def to_frame(self, include_params: bool = True):
+        """
+        convert block to dataframe indexed by timestamp, columns as originally queued from meter
+        :param include_params: whether to include meter parameter columns
+        :return: dataframe of readings
+        """
+        df = pd.DataFrame({'lavg': self.lavg, 'leq': self.leq, 'temp_f': self.temp_f}, index=self.get_timestamps())
+        df['nsrt_id'] = self.nsrt_id
+        if include_params:
+            df = pd.concat([df, self.get_params_frame()], axis=1)
+        return df
+
+
+class ReadingBuffer:
+    """
+    Ring buffer of sound meter readings. Each reading is written twice, at position
+    i and i + capacity, so the most recent readings are always contiguous and any
+    block of them can be returned as a slice without copying.
+    """
+    _capacity: int = None  # maximum number of readings retained
+    _count: int = 0  # total number of readings appended
+    _nsrt_id: int = None  # meter identification defined in config file for meta data
+    _timestamp_ns: np.ndarray = None
+    _lavg: np.ndarray = None
+    _leq: np.ndarray = None
+    _temp_f: np.ndarray = None
+    _params_id: np.ndarray = None
+    _params: OrderedDict = None  # local parameter set id -> OrderedDict of meter parameters
+    _params_lookup: dict = None  # tuple of parameter values -> local parameter set id
+
+    def __init__(self, capacity: int, nsrt_id: int):
+        if capacity < 1:
+            raise ValueError("reading buffer capacity must be positive")
+        self._capacity = capacity
+        self._count = 0
+        self._nsrt_id = nsrt_id
+        self._timestamp_ns = np.zeros(2 * capacity, dtype=np.int64)
+        self._lavg = np.zeros(2 * capacity, dtype=np.float32)
+        self._leq = np.zeros(2 * capacity, dtype=np.float32)
+        self._temp_f = np.zeros(2 * capacity, dtype=np.float32)
+        self._params_id = np.zeros(2 * capacity, dtype=np.int16)
+        self._params = OrderedDict()
+        self._params_lookup = {}
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def get_capacity(self):
+        return self._capacity
+
+    def register_params(self, params: OrderedDict):
+        """
+        get local id for a set of meter parameters, adding it if not seen before
+        :param params: meter parameters
+        :return: local parameter set id
+        """
+        params_key = tuple(params[k] for k in PARAMS_COLUMNS)
+        if params_key not in self._params_lookup:
+            params_id = len(self._params)
+            self._params_lookup[params_key] = params_id
+            self._params[params_id] = OrderedDict((k, params[k]) for k in PARAMS_COLUMNS)
+        return self._params_lookup[params_key]
+
+    def append(self, timestamp_ns: int, lavg: float, leq: float, temp_f: float, params_id: int):
+        """
+        add reading to buffer, overwriting oldest reading if full
+        :return: None
+        """
+        for pos in (self._count % self._capacity, self._count % self._capacity + self._capacity):
+            self._timestamp_ns[pos] = timestamp_ns
+            self._lavg[pos] = lavg
+            self._leq[pos] = leq
+            self._temp_f[pos] = temp_f
+            self._params_id[pos] = params_id
+        self._count += 1
+
+    def _get_window(self):
+        """
+        :return: start and stop positions of retained readings, oldest to newest
+        """
+        if self._count == 0:
+            return 0, 0
+        stop = (self._count - 1) % self._capacity + self._capacity + 1
+        return stop - len(self), stop
+
+    def get_block(self, start_ns: int, end_ns: int):
+        """
+        readings with timestamps between start and end (inclusive), as views into buffer.
+        Views are only valid until the buffer wraps, copy block if it is to be held.
+        :param start_ns: start time in nanoseconds
+        :param end_ns: end time in nanoseconds
+        :return: ReadingBlock
+        """
+        start, stop = self._get_window()
+        timestamps = self._timestamp_ns[start:stop]
+        stop = start + int(np.searchsorted(timestamps, end_ns, side='right'))
+        start = start + int(np.searchsorted(timestamps, start_ns, side='left'))
+        params_id = self._params_id[start:stop]
+        return ReadingBlock(nsrt_id=self._nsrt_id, timestamp_ns=self._timestamp_ns[start:stop],
+                            lavg=self._lavg[start:stop], leq=self._leq[start:stop], temp_f=self._temp_f[start:stop],
+                            params_id=params_id,
+                            params=dict((int(k), self._params[int(k)]) for k in np.unique(params_id)))
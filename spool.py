@@ -0,0 +1,215 @@
+#!/usr/bin/python -u
+# coding=utf-8
+"""
+Local store-and-forward spool for sound meter data
+Blocks of readings are committed to a local sqlite database (WAL mode) before any attempt
+to write them to their destination; a background forwarder drains the spool in batches,
+retrying with exponential backoff while the destination is unreachable. A block which keeps
+failing for reasons other than an unreachable destination is moved to a dead letter table.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from logmanager import MessageHandler
+from readingbuffer import ReadingBlock
+
+SPOOL_DTYPE = np.dtype([('timestamp_ns', np.int64), ('lavg', np.float32), ('leq', np.float32),
+                        ('temp_f', np.float32), ('params_id', np.int16)])  # layout of spooled readings
+SPOOL_BATCH_BLOCKS = 60  # default maximum blocks (minutes) forwarded per write
+SPOOL_RETRY_SECONDS = 5.0  # initial wait after failed forward, doubled on each failure
+SPOOL_MAX_RETRY_SECONDS = 300.0  # maximum wait between forward attempts
+SPOOL_IDLE_SECONDS = 60.0  # forwarder checks spool at least this often when not notified
+SPOOL_DEAD_LETTER_ATTEMPTS = 5  # default failed forwards of a single block before it is moved to dead letter table
+
+
+class DataSpool:
+    """
+    Append-only sqlite spool of reading blocks, one row per block
+    """
+    _spool_path: Path = None  # location of sqlite spool file
+    _connection: sqlite3.Connection = None  # connection shared by writer and forwarder threads
+    _lock: threading.Lock = None  # serializes use of connection
+
+    def __init__(self, spool_path: str):
+        self._spool_path = Path(spool_path)
+        if not self._spool_path.parent.exists():
+            self._spool_path.parent.mkdir(parents=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self._spool_path), isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL;")
+        self._connection.execute("PRAGMA synchronous=FULL;")  # block survives power loss once committed
+        self._connection.execute("CREATE TABLE IF NOT EXISTS spool_blocks (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                 "nsrt_id INTEGER NOT NULL, params TEXT NOT NULL, readings BLOB NOT NULL);")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS spool_dead (id INTEGER PRIMARY KEY, "
+                                 "nsrt_id INTEGER NOT NULL, params TEXT NOT NULL, readings BLOB NOT NULL, "
+                                 "error TEXT NOT NULL, failed_time TEXT NOT NULL);")
+
+    def append(self, block: ReadingBlock):
+        """
+        commit block of readings to spool
+        :param block: block of readings
+        :return: None
+        """
+        readings = np.empty(len(block), dtype=SPOOL_DTYPE)
+        for col in SPOOL_DTYPE.names:
+            readings[col] = getattr(block, col)
+        params = json.dumps(dict((str(k), list(v.items())) for k, v in block.params.items()))
+        with self._lock:
+            self._connection.execute("INSERT INTO spool_blocks (nsrt_id, params, readings) VALUES (?, ?, ?);",
+                                     (int(block.nsrt_id), params, readings.tobytes()))
+
+    def read_batch(self, max_blocks: int):
+        """
+        oldest blocks in spool
+        :param max_blocks: maximum number of blocks to return
+        :return: list of (spool id, ReadingBlock) tuples
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT id, nsrt_id, params, readings FROM spool_blocks "
+                                            "ORDER BY id LIMIT ?;", (max_blocks,)).fetchall()
+        batch = []
+        for spool_id, nsrt_id, params, readings in rows:
+            readings = np.frombuffer(readings, dtype=SPOOL_DTYPE)
+            params = dict((int(k), dict(v)) for k, v in json.loads(params).items())
+            batch.append((spool_id, ReadingBlock(nsrt_id=nsrt_id, timestamp_ns=readings['timestamp_ns'],
+                                                 lavg=readings['lavg'], leq=readings['leq'],
+                                                 temp_f=readings['temp_f'], params_id=readings['params_id'],
+                                                 params=params)))
+        return batch
+
+    def remove(self, spool_ids: list):
+        """
+        remove forwarded blocks from spool
+        :param spool_ids: ids of blocks as returned by read_batch
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM spool_blocks WHERE id <= ?;", (max(spool_ids),))
+
+    def dead_letter(self, spool_id: int, error: str):
+        """
+        move block which cannot be forwarded to dead letter table spool_dead, kept for inspection
+        :param spool_id: id of block as returned by read_batch
+        :param error: reason forward failed
+        :return: None
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN;")
+                self._connection.execute("INSERT INTO spool_dead (id, nsrt_id, params, readings, error, failed_time) "
+                                         "SELECT id, nsrt_id, params, readings, ?, datetime('now', 'localtime') "
+                                         "FROM spool_blocks WHERE id = ?;", (error, spool_id))
+                self._connection.execute("DELETE FROM spool_blocks WHERE id = ?;", (spool_id,))
+
+    def count(self, table_name: str = 'spool_blocks'):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM {0};".format(table_name)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SpoolForwarder:
+    """
+    Background thread which drains a DataSpool through a write function taking a list of blocks
+    """
+    _spool: DataSpool = None  # spool to drain
+    _write_blocks = None  # function writing list of ReadingBlock to destination, raises on failure
+    _message_handler: MessageHandler = None  # logging interface
+    _batch_blocks: int = None  # maximum blocks per write
+    _transient_errors: tuple = None  # exception types of unreachable destination, retried without limit
+    _dead_letter_attempts: int = None  # failed forwards of a single block before it is moved to dead letter table
+    _wake_event: threading.Event = None  # set when new block spooled or on stop
+    _stop_event: threading.Event = None  # signals thread to exit
+    _thread: threading.Thread = None  # forwarding thread
+
+    def __init__(self, spool: DataSpool, write_blocks, message_handler: MessageHandler,
+                 batch_blocks: int = SPOOL_BATCH_BLOCKS, transient_errors: tuple = (),
+                 dead_letter_attempts: int = SPOOL_DEAD_LETTER_ATTEMPTS):
+        self._spool = spool
+        self._write_blocks = write_blocks
+        self._message_handler = message_handler
+        self._batch_blocks = batch_blocks
+        self._transient_errors = transient_errors
+        self._dead_letter_attempts = dead_letter_attempts
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.run_forwarder, name='spool-forwarder')
+        self._thread.daemon = True
+
+    def start(self):
+        pending = self._spool.count()
+        if pending:
+            self._message_handler.log("spool: {0:d} blocks pending from previous run".format(pending))
+        dead = self._spool.count('spool_dead')
+        if dead:
+            self._message_handler.log("spool: {0:d} blocks in dead letter table spool_dead".format(dead),
+                                      logging.WARNING)
+        self._thread.start()
+
+    def notify(self):
+        self._wake_event.set()
+
+    def run_forwarder(self):
+        """
+        forward oldest spooled blocks until spool is empty, then wait for notification;
+        on failure wait with exponential backoff and retry. After a batch fails other than with
+        one of transient_errors, its blocks are forwarded one at a time, and a block failing
+        dead_letter_attempts times in a row is moved to dead letter table, so it does not hold
+        up the blocks behind it.
+        :return: None
+        """
+        retry_seconds = SPOOL_RETRY_SECONDS
+        suspect_id = 0  # blocks up to this id are forwarded one at a time, after failure of their batch
+        block_failures = 0  # consecutive failures of single block at head of spool
+        while not self._stop_event.is_set():
+            batch = self._spool.read_batch(self._batch_blocks)
+            if len(batch) == 0:
+                self._wake_event.wait(SPOOL_IDLE_SECONDS)
+                self._wake_event.clear()
+                continue
+            if batch[0][0] <= suspect_id:
+                batch = batch[:1]
+            try:
+                write_start = time.perf_counter()
+                self._write_blocks([block for _, block in batch])
+                self._spool.remove([spool_id for spool_id, _ in batch])
+            except Exception as ex:
+                if not isinstance(ex, self._transient_errors):
+                    suspect_id = max(suspect_id, batch[-1][0])
+                    block_failures = block_failures + 1 if len(batch) == 1 else 0
+                    if block_failures >= self._dead_letter_attempts:
+                        self._spool.dead_letter(batch[0][0], str(ex))
+                        self._message_handler.log("spool: block {0:d} failed {1:d} times, moved to dead letter "
+                                                  "table spool_dead: {2}".format(batch[0][0], block_failures, str(ex)),
+                                                  logging.ERROR)
+                        block_failures = 0
+                        continue
+                self._message_handler.log("spool: forward of {0:d} blocks failed, retrying in {1:.0f} s: {2}"
+                                          .format(len(batch), retry_seconds, str(ex)), logging.WARNING)
+                self._stop_event.wait(retry_seconds)
+                retry_seconds = min(2. * retry_seconds, SPOOL_MAX_RETRY_SECONDS)
+                continue
+            block_failures = 0
+            if retry_seconds > SPOOL_RETRY_SECONDS or len(batch) > 1:
+                self._message_handler.log("spool: forwarded {0:d} blocks in {1:.2f} s, {2:d} pending"
+                                          .format(len(batch), time.perf_counter() - write_start,
+                                                  self._spool.count()))
+            retry_seconds = SPOOL_RETRY_SECONDS
+
+    def close(self, timeout: float = 30.):
+        """
+        stop forwarding, blocks not yet forwarded remain in spool for next run
+        :param timeout: seconds to wait for a write in progress
+        :return: None
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        self._thread.join(timeout)
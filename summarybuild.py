@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+rebuild per-minute summaries and hourly/daily rollups from historical sound meter data,
+reading nsrt_data one chunk of whole days at a time
+"""
+import argparse
+import sys
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, func, select
+
+from datatablecreate import TABLE_PREFIX, TABLE_SUFFIXES, SUMMARY_TABLE_SUFFIXES, ensure_summary_tables
+from dbinfo import DBInfo, df_to_records
+from levelstats import MINUTE_STATS_COLUMNS, ROLLUP_COLUMNS, ROLLUP_PERIODS_NS, get_minute_stats_frame, \
+    get_rollup_stats_frame
+from readingbuffer import ReadingBlock
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+REBUILD_CHUNK_DAYS = 1  # default days of readings read and summarized at a time
+
+
+def read_readings_blocks(db_info: DBInfo, start: pd.Timestamp, end: pd.Timestamp):
+    """
+    read readings with timestamps from start (inclusive) to end (exclusive)
+    :param db_info: database connection holder
+    :param start: start of range
+    :param end: end of range
+    :return: list of ReadingBlock, one per meter
+    """
+    data_table = db_info.get_table('{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['data']))
+    query = select(data_table.c.nsrt_id, data_table.c.timestamp, data_table.c.lavg, data_table.c.leq)\
+        .where(and_(data_table.c.timestamp >= start.to_pydatetime(), data_table.c.timestamp < end.to_pydatetime()))
+    with db_info.get_engine().connect() as con:
+        df = pd.read_sql(query, con)
+    blocks = []
+    for nsrt_id, meter_df in df.groupby('nsrt_id'):
+        timestamp_ns = meter_df['timestamp'].values.astype('datetime64[ns]').astype(np.int64)
+        blocks.append(ReadingBlock(nsrt_id=int(nsrt_id), timestamp_ns=timestamp_ns,
+                                   lavg=meter_df['lavg'].values.astype(np.float32),
+                                   leq=meter_df['leq'].values.astype(np.float32),
+                                   temp_f=np.zeros(len(meter_df), dtype=np.float32),
+                                   params_id=np.zeros(len(meter_df), dtype=np.int16), params={}))
+    return blocks
+
+
+def rebuild_summaries(db_info: DBInfo, start: pd.Timestamp = None, end: pd.Timestamp = None,
+                      chunk_days: int = REBUILD_CHUNK_DAYS):
+    """
+    recompute minute, hour and day summaries from data table, replacing existing summary rows.
+    Chunks are whole days, so every summary row is computed from all of its readings.
+    :param db_info: database connection holder
+    :param start: first day to rebuild, first day of data if None
+    :param end: day after last day to rebuild, day after last day of data if None
+    :param chunk_days: days read and summarized at a time
+    :return: None
+    """
+    for table_name in ensure_summary_tables(db_info):
+        print("created summary table {0}".format(table_name))
+    data_table = db_info.get_table('{0}_{1}'.format(TABLE_PREFIX, TABLE_SUFFIXES['data']))
+    with db_info.get_engine().connect() as con:
+        first, last = con.execute(select(func.min(data_table.c.timestamp), func.max(data_table.c.timestamp))).first()
+    if first is None:
+        print("no readings in data table")
+        return
+    start = (start if start is not None else pd.Timestamp(first)).floor('D')
+    end = end.ceil('D') if end is not None else pd.Timestamp(last).floor('D') + pd.Timedelta(days=1)
+    summary_tables = dict((k, '{0}_{1}'.format(TABLE_PREFIX, v)) for k, v in SUMMARY_TABLE_SUFFIXES.items())
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + pd.Timedelta(days=chunk_days), end)
+        read_start = time.perf_counter()
+        blocks = read_readings_blocks(db_info, chunk_start, chunk_end)
+        n_readings = sum(len(block) for block in blocks)
+        with db_info.get_engine().begin() as con:
+            db_info.upsert_records_to_table(summary_tables['minute'], df_to_records(get_minute_stats_frame(blocks)),
+                                            MINUTE_STATS_COLUMNS, con)
+            for period in ROLLUP_PERIODS_NS:
+                db_info.upsert_records_to_table(summary_tables[period],
+                                                df_to_records(get_rollup_stats_frame(blocks, period)),
+                                                ROLLUP_COLUMNS, con)
+        print("{0} to {1}: {2:d} readings summarized in {3:.1f} s"
+              .format(chunk_start.strftime(TIMESTAMP_FORMAT), chunk_end.strftime(TIMESTAMP_FORMAT), n_readings,
+                      time.perf_counter() - read_start))
+        chunk_start = chunk_end
+
+
+def main():
+    try:
+        my_parser = argparse.ArgumentParser(prog='summarybuild',
+                                            description='Rebuild minute, hour and day summaries of sound meter '
+                                                        'readings from data table')
+        my_parser.add_argument('--config_file', type=str, help='database config file')
+        my_parser.add_argument('--db_target_alias', type=str, help='target alias to find in config file')
+        my_parser.add_argument('--start', type=str, help='first day to rebuild, e.g. 2022-02-14 (default first day '
+                                                         'of data)')
+        my_parser.add_argument('--end', type=str, help='day after last day to rebuild (default day after last day '
+                                                       'of data)')
+        my_parser.add_argument('--chunk_days', type=int, default=REBUILD_CHUNK_DAYS,
+                               help='days of readings read at a time')
+        args: argparse.Namespace = my_parser.parse_args()
+        db_info: DBInfo = DBInfo.dbinfo_from_configfile(args.config_file, args.db_target_alias)
+        rebuild_summaries(db_info, pd.Timestamp(args.start) if args.start else None,
+                          pd.Timestamp(args.end) if args.end else None, args.chunk_days)
+        db_info.close()
+
+    except Exception as ex:
+        print("Exception in user code:")
+        print('-' * 60)
+        print(str(ex))
+        traceback.print_exc(file=sys.stdout)
+        print('-' * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+shared fixtures for tests of soundmonitor modules, run with python -m pytest from repository root
+"""
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from datatablecreate import PARAMS_COLUMNS  # noqa: E402
+from readingbuffer import ReadingBlock  # noqa: E402
+
+
+class LogCollector:
+    """
+    stands in for MessageHandler, keeps logged messages
+    """
+    def __init__(self):
+        self.messages = []
+
+    def log(self, msg: str, lvl: int = None):
+        self.messages.append(msg)
+
+
+def make_block(start: str, n_readings: int = 60, nsrt_id: int = 1, lavg: np.ndarray = None):
+    """
+    one reading per second from start, leq 51 dB, lavg 40 to 60 dB unless given
+    """
+    timestamp_ns = (np.datetime64(start, 'ns') + np.arange(n_readings) * np.timedelta64(1, 's')).astype(np.int64)
+    if lavg is None:
+        lavg = np.linspace(40., 60., n_readings)
+    params = {0: OrderedDict((col, 'p_{0}'.format(col)) for col in PARAMS_COLUMNS)}
+    return ReadingBlock(nsrt_id, timestamp_ns, np.asarray(lavg, dtype=np.float32),
+                        np.full(n_readings, 51., dtype=np.float32), np.full(n_readings, 70., dtype=np.float32),
+                        np.zeros(n_readings, dtype=np.int16), params)
+
+
+@pytest.fixture
+def message_handler():
+    return LogCollector()
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from audioanalysis import AudioAnalyzer, get_band_centres
+
+SAMPLE_RATE = 48000
+
+
+def get_analyzer(message_handler, band_analysis='octave', band_interval='second'):
+    return AudioAnalyzer({'sample-rate': SAMPLE_RATE, 'channels': 1, 'band-analysis': band_analysis,
+                          'band-interval': band_interval}, message_handler)
+
+
+def get_sine(frequency, amplitude, n_samples=SAMPLE_RATE):
+    return amplitude * np.sin(2. * np.pi * frequency * np.arange(n_samples) / SAMPLE_RATE)
+
+
+def test_band_centres():
+    np.testing.assert_allclose(get_band_centres(1, SAMPLE_RATE)[:3], [31.62, 63.1, 125.9], rtol=1e-3)
+    centres = get_band_centres(3, SAMPLE_RATE)
+    np.testing.assert_allclose(centres[1:] / centres[:-1], 10. ** 0.1)
+    assert centres[-1] * 10. ** (0.5 / 10.) < SAMPLE_RATE / 2.
+
+
+@pytest.mark.parametrize('band_analysis', ['octave', 'third-octave'])
+def test_sine_power_in_its_band(message_handler, band_analysis):
+    analyzer = get_analyzer(message_handler, band_analysis)
+    band_squares = analyzer.get_band_squares(get_sine(1000., 0.5))
+    centres = get_band_centres(1 if band_analysis == 'octave' else 3, SAMPLE_RATE)
+    band = int(np.argmin(np.abs(centres - 1000.)))
+    assert band_squares[band] == pytest.approx(0.5 * 0.5 / 2., rel=1e-6)
+    assert np.delete(band_squares, band).sum() < 1e-12
+
+
+def test_bands_sum_to_mean_square(message_handler):
+    analyzer = get_analyzer(message_handler, 'third-octave')
+    x = get_sine(250., 0.2) + get_sine(3150., 0.1) + get_sine(8000., 0.05)
+    assert analyzer.get_band_squares(x).sum() == pytest.approx(np.mean(x * x), rel=1e-6)
+
+
+def test_band_levels_written_per_second(tmp_path, message_handler):
+    analyzer = get_analyzer(message_handler)
+    analyzer.start()
+    segment_path = tmp_path / '202202141001test.wav'
+    analyzer.start_segment(segment_path)
+    samples = np.round(get_sine(1000., 0.5, 2 * SAMPLE_RATE) * 32767.).astype(np.int16)
+    for chunk in np.split(samples, 20):
+        analyzer.feed(chunk.tobytes())
+    analyzer.finish_segment(pd.Timestamp('2022-02-14 10:01'))
+    analyzer.close()
+    bands = np.load(str(tmp_path / '202202141001test_bands.npz'))
+    band = int(np.argmin(np.abs(bands['centres_hz'] - 1000.)))
+    assert bands['levels'].shape == (2, len(bands['centres_hz']))
+    np.testing.assert_allclose(bands['levels'][:, band], 10. * np.log10(0.125) + 120., atol=0.01)
+
+
+def run_segment(analyzer, segment_path, chunks, end):
+    analyzer.start_segment(segment_path)
+    for chunk in chunks:
+        analyzer.feed(chunk.tobytes())
+    analyzer.finish_segment(end)
+    analyzer.start()
+    analyzer.close()
+
+
+def read_levels(path):
+    return pd.read_csv(path, index_col='timestamp', parse_dates=['timestamp'])
+
+
+def test_levels_written_per_second(tmp_path, message_handler):
+    analyzer = AudioAnalyzer({'sample-rate': SAMPLE_RATE, 'channels': 1}, message_handler)
+    steady = get_sine(1000., 0.5, 2 * SAMPLE_RATE)
+    burst = np.zeros(SAMPLE_RATE + SAMPLE_RATE // 2)
+    burst[:SAMPLE_RATE // 8] = get_sine(1000., 0.5, SAMPLE_RATE // 8)  # one 125 ms block, then silence
+    samples = np.round(np.append(steady, burst) * 32767.).astype(np.int16)
+    end = pd.Timestamp('2022-02-14 10:01')
+    run_segment(analyzer, tmp_path / '202202141001test.wav', np.split(samples, 35), end)
+    levels = read_levels(tmp_path / '202202141001test_levels.csv')
+    assert list(levels.columns) == ['leq', 'lpeak', 'lmax']
+    start = end - pd.Timedelta(seconds=3.5)
+    assert list(levels.index) == [start + pd.Timedelta(seconds=ii) for ii in (1, 2, 3)] + [end]
+    sine_leq = 10. * np.log10(0.125) + 120.
+    np.testing.assert_allclose(levels['leq'], [sine_leq, sine_leq, sine_leq - 10. * np.log10(8.), -np.inf], atol=0.01)
+    np.testing.assert_allclose(levels['lpeak'][:3], 20. * np.log10(0.5) + 120., atol=0.01)
+    np.testing.assert_allclose(levels['lmax'][:3], sine_leq, atol=0.01)
+    assert analyzer.get_counts() == {'analyzed': 35, 'dropped': 0, 'files': 1}
+
+
+def test_dropped_chunks_keep_position(tmp_path, message_handler):
+    analyzer = AudioAnalyzer({'sample-rate': SAMPLE_RATE, 'channels': 1, 'analysis-queue-chunks': 4,
+                              'band-analysis': 'octave'}, message_handler)
+    samples = np.round(get_sine(1000., 0.5, 3 * SAMPLE_RATE) * 32767.).astype(np.int16)
+    end = pd.Timestamp('2022-02-14 10:01')
+    # analyzer not yet started: segment start and three half-second chunks queued, last three chunks dropped
+    run_segment(analyzer, tmp_path / '202202141001test.wav', np.split(samples, 6), end)
+    assert analyzer.get_counts() == {'analyzed': 3, 'dropped': 3, 'files': 2}
+    levels = read_levels(tmp_path / '202202141001test_levels.csv')
+    assert list(levels.index) == [end - pd.Timedelta(seconds=2), end - pd.Timedelta(seconds=1), end]
+    np.testing.assert_allclose(levels['leq'][:2], 10. * np.log10(0.125) + 120., atol=0.01)
+    assert levels['leq'].isna().tolist() == [False, False, True]
+    bands = np.load(str(tmp_path / '202202141001test_bands.npz'))
+    assert bands['timestamp_ns'].tolist() == [timestamp.value for timestamp in levels.index]
+    assert np.isnan(bands['levels'][2]).all()
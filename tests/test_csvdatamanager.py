@@ -0,0 +1,66 @@
+import gzip
+import io
+
+import numpy as np
+
+from conftest import make_block
+from datamanager import CSV_HEADER, CSVDataManager
+
+
+def test_rows_match_to_csv():
+    block = make_block('2022-02-14T10:00:00.123456', n_readings=5)
+    block.lavg = block.lavg + np.float32(0.123)
+    expected = io.StringIO()
+    block.to_frame().to_csv(expected, header=True, index=True)
+    assert CSV_HEADER + CSVDataManager.format_rows(block) == expected.getvalue()
+
+
+def get_meter_info(tmp_path, **kwargs):
+    meter_info = {'csv-location': str(tmp_path / 'csv'), 'csv-filename': 'nsrt.csv'}
+    meter_info.update(kwargs)
+    return meter_info
+
+
+def read_lines(csv_path):
+    with open(csv_path) as f:
+        return f.read().splitlines()
+
+
+def test_rotate_by_day(tmp_path, message_handler):
+    data_manager = CSVDataManager(get_meter_info(tmp_path, **{'csv-rotate': 'day'}), message_handler)
+    for start in ['2022-02-14T23:58', '2022-02-14T23:59', '2022-02-15T00:00']:
+        data_manager.save_reading(make_block(start))
+    data_manager.close()
+    first_lines = read_lines(tmp_path / 'csv' / 'nsrt_2022-02-14.csv')
+    second_lines = read_lines(tmp_path / 'csv' / 'nsrt_2022-02-15.csv')
+    assert first_lines[0] + '\n' == CSV_HEADER
+    assert len(first_lines) == 121
+    assert second_lines[0] + '\n' == CSV_HEADER
+    assert len(second_lines) == 61
+    assert second_lines[1].startswith('2022-02-15 00:00:00')
+
+
+def test_rotate_by_size(tmp_path, message_handler):
+    data_manager = CSVDataManager(get_meter_info(tmp_path, **{'csv-rotate': 'size', 'csv-rotate-mb': 0.001}),
+                                  message_handler)
+    for start in ['2022-02-14T10:00', '2022-02-14T10:01', '2022-02-14T10:02']:
+        data_manager.save_reading(make_block(start))
+    data_manager.close()
+    csv_paths = sorted((tmp_path / 'csv').glob('nsrt_*.csv'))
+    assert [csv_path.name for csv_path in csv_paths] == ['nsrt_2022-02-14_100000.csv', 'nsrt_2022-02-14_100100.csv',
+                                                         'nsrt_2022-02-14_100200.csv']
+    assert sum(len(read_lines(csv_path)) - 1 for csv_path in csv_paths) == 180
+
+
+def test_rotated_files_gzipped(tmp_path, message_handler):
+    meter_info = get_meter_info(tmp_path, **{'csv-rotate': 'day', 'csv-gzip': True})
+    data_manager = CSVDataManager(meter_info, message_handler)
+    data_manager.save_reading(make_block('2022-02-14T23:59'))
+    data_manager.save_reading(make_block('2022-02-15T00:00'))
+    data_manager.close()
+    with gzip.open(tmp_path / 'csv' / 'nsrt_2022-02-14.csv.gz', 'rt') as f:
+        assert len(f.read().splitlines()) == 61
+    assert not (tmp_path / 'csv' / 'nsrt_2022-02-14.csv').exists()
+    assert (tmp_path / 'csv' / 'nsrt_2022-02-15.csv').exists()  # current file, gzipped at next start
+    CSVDataManager(meter_info, message_handler).close()
+    assert (tmp_path / 'csv' / 'nsrt_2022-02-15.csv.gz').exists()
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import logmanager
+from logmanager import DBHandler
+
+
+class StubDBInfo:
+    """
+    stands in for DBInfo of logging database, keeps inserted batches; inserts wait while release is clear
+    """
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+        self.inserting = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    @staticmethod
+    def get_connection_data():
+        return {'table-name': 'log_test'}
+
+    def insert_records_to_table(self, table_name, records):
+        self.inserting.set()
+        self.release.wait(10.)
+        self.batches.append([record['message'] for record in records])
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def db_info(monkeypatch):
+    stub_db_info = StubDBInfo()
+    monkeypatch.setattr(logmanager.DBInfo, 'dbinfo_from_configfile', lambda *args, **kwargs: stub_db_info)
+    monkeypatch.setattr(DBHandler, 'create_table_if_not_exists', lambda self: None)
+    return stub_db_info
+
+
+def get_handler(**log_config):
+    return DBHandler(dict({'db-configfile': 'ConfigDatabases.yaml', 'db-target-alias': 'test'}, **log_config))
+
+
+def emit_messages(handler, messages):
+    for message in messages:
+        handler.emit(logging.makeLogRecord({'name': 'test', 'levelname': 'INFO', 'msg': message}))
+
+
+def wait_for(condition, timeout=10.):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_flush_on_batch_size(db_info):
+    handler = get_handler(**{'batch-size': 3, 'flush-seconds': 60.})
+    emit_messages(handler, ['a', 'b', 'c', 'd'])
+    assert wait_for(lambda: len(db_info.batches) == 1)
+    assert db_info.batches == [['a', 'b', 'c']]
+    handler.close()
+    assert db_info.batches == [['a', 'b', 'c'], ['d']]
+
+
+def test_flush_on_flush_seconds(db_info):
+    handler = get_handler(**{'batch-size': 100, 'flush-seconds': 0.1})
+    emit_messages(handler, ['a', 'b'])
+    assert wait_for(lambda: len(db_info.batches) == 1)
+    assert db_info.batches == [['a', 'b']]
+    assert handler.get_counts()['written'] == 2
+    handler.close()
+
+
+def test_records_dropped_when_buffer_full(db_info):
+    db_info.release.clear()
+    handler = get_handler(**{'batch-size': 1, 'flush-seconds': 60., 'buffer-size': 2})
+    emit_messages(handler, ['a'])
+    assert db_info.inserting.wait(10.)  # flusher holds 'a', buffer empty
+    emit_messages(handler, ['b', 'c', 'd', 'e'])
+    assert handler.get_counts() == {'written': 0, 'dropped': 2, 'failed': 0, 'buffered': 2}
+    db_info.release.set()
+    handler.close()
+    assert [message for batch in db_info.batches for message in batch] == ['a', 'b', 'c']
+    assert handler.get_counts() == {'written': 3, 'dropped': 2, 'failed': 0, 'buffered': 0}
+
+
+def test_close_drains_buffer(db_info):
+    handler = get_handler(**{'batch-size': 100, 'flush-seconds': 60.})
+    emit_messages(handler, ['a', 'b', 'c', 'd', 'e'])
+    handler.close()
+    assert db_info.batches == [['a', 'b', 'c', 'd', 'e']]
+    assert db_info.closed
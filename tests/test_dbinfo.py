@@ -0,0 +1,51 @@
+from sqlalchemy import Column, Float, Integer, MetaData, Table, select
+
+from dbinfo import DBInfo
+
+
+def get_db_info(tmp_path):
+    db_info = DBInfo.dbinfo_from_sqlite(str(tmp_path / 'test.sqlite'))
+    Table('totals', MetaData(), Column('key', Integer(), primary_key=True, autoincrement=False),
+          Column('value', Float(), nullable=False), Column('total', Float(), nullable=False))\
+        .create(bind=db_info.get_engine())
+    return db_info
+
+
+def read_rows(db_info):
+    table = db_info.get_table('totals')
+    with db_info.get_engine().connect() as con:
+        return [tuple(row) for row in con.execute(select(table).order_by(table.c.key))]
+
+
+def test_upsert_replaces_update_cols(tmp_path):
+    db_info = get_db_info(tmp_path)
+    db_info.upsert_records_to_table('totals', [{'key': 1, 'value': 1., 'total': 1.},
+                                               {'key': 2, 'value': 2., 'total': 2.}], ['value'])
+    db_info.upsert_records_to_table('totals', [{'key': 2, 'value': 5., 'total': 5.},
+                                               {'key': 3, 'value': 3., 'total': 3.}], ['value'])
+    assert read_rows(db_info) == [(1, 1., 1.), (2, 5., 2.), (3, 3., 3.)]
+    db_info.close()
+
+
+def test_upsert_update_expressions(tmp_path):
+    db_info = get_db_info(tmp_path)
+
+    def add_total(table, inserted):
+        return [('total', table.c.total + inserted.total), ('value', inserted.value)]
+
+    for value in [1., 2., 4.]:
+        db_info.upsert_records_to_table('totals', [{'key': 1, 'value': value, 'total': value}], add_total)
+    assert read_rows(db_info) == [(1, 4., 7.)]
+    db_info.close()
+
+
+def test_upsert_in_transaction_rolls_back(tmp_path):
+    db_info = get_db_info(tmp_path)
+    try:
+        with db_info.get_engine().begin() as con:
+            db_info.upsert_records_to_table('totals', [{'key': 1, 'value': 1., 'total': 1.}], ['value'], con)
+            raise ValueError('abort')
+    except ValueError:
+        pass
+    assert read_rows(db_info) == []
+    db_info.close()
@@ -0,0 +1,27 @@
+import pytest
+
+from datamanager import FanOutDataManager
+
+
+def test_sinks_get_own_config(tmp_path):
+    meter_info = {'fan-out-managers': ['CSVDataManager', {'data-manager': 'SQLiteDataManager', 'spool-file': None}],
+                  'spool-file': str(tmp_path / 'spool.db'), 'meta-entry': {'nsrt_id': 1},
+                  'csv-location': str(tmp_path), 'csv-filename': 'nsrt.csv', 'sqlite-file': str(tmp_path / 'nsrt.db')}
+    csv_info, sqlite_info = FanOutDataManager.get_sink_infos(meter_info)
+    assert csv_info['data-manager'] == 'CSVDataManager'
+    assert sqlite_info['data-manager'] == 'SQLiteDataManager'
+    assert sqlite_info['spool-file'] is None
+    assert csv_info['meta-entry'] is not meter_info['meta-entry']
+    assert sqlite_info['meta-entry'] is not csv_info['meta-entry']
+
+
+def test_shared_spool_file_rejected(tmp_path):
+    meter_info = {'fan-out-managers': ['DBDataManager', 'SQLiteDataManager'], 'spool-file': str(tmp_path / 'spool.db'),
+                  'sqlite-file': str(tmp_path / 'nsrt.db')}
+    with pytest.raises(ValueError, match='spool.db'):
+        FanOutDataManager.get_sink_infos(meter_info)
+
+
+def test_unknown_manager_rejected():
+    with pytest.raises(ValueError):
+        FanOutDataManager.get_sink_infos({'fan-out-managers': [{'data-manager': 'ReadingBlock'}]})
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from levelstats import EXCEEDANCE_COLUMNS, NIGHT_PENALTY_DB, ROLLUP_PERIODS_NS, ROLLUP_SUM_COLUMNS, \
+    get_minute_stats, get_rollup_stats
+
+NS_PER_SECOND = 1000000000
+
+
+def get_timestamps(start, n_readings):
+    return pd.Timestamp(start).value + np.arange(n_readings, dtype=np.int64) * NS_PER_SECOND
+
+
+def test_minute_stats_match_numpy():
+    rng = np.random.default_rng(0)
+    timestamp_ns = get_timestamps('2022-02-14 10:00', 180)
+    lavg = rng.uniform(35., 80., 180)
+    leq = rng.uniform(35., 80., 180)
+    stats = get_minute_stats(timestamp_ns, lavg, leq)
+    assert len(stats['minute_ns']) == 3
+    for minute in range(3):
+        minute_lavg, minute_leq = lavg[60 * minute:60 * (minute + 1)], leq[60 * minute:60 * (minute + 1)]
+        assert stats['minute_ns'][minute] == timestamp_ns[60 * minute]
+        assert stats['leq'][minute] == pytest.approx(10. * np.log10(np.mean(10. ** (minute_leq / 10.))))
+        for percent in [10, 50, 90]:
+            assert stats['l{0:d}'.format(percent)][minute] == pytest.approx(np.percentile(minute_lavg, 100 - percent))
+        assert stats['lmax'][minute] == minute_lavg.max()
+        assert stats['lmin'][minute] == minute_lavg.min()
+        assert stats['n_readings'][minute] == 60
+
+
+def test_minute_stats_ignore_non_finite():
+    timestamp_ns = get_timestamps('2022-02-14 10:00', 60)
+    lavg = np.full(60, 50.)
+    lavg[5] = np.nan
+    stats = get_minute_stats(timestamp_ns, lavg, np.full(60, 50.))
+    assert stats['n_readings'][0] == 59
+    assert stats['leq'][0] == pytest.approx(50.)
+
+
+def test_rollup_partial_periods_merge_by_addition():
+    rng = np.random.default_rng(1)
+    timestamp_ns = get_timestamps('2022-02-14 10:30', 3600)
+    lavg, leq = rng.uniform(35., 80., 3600), rng.uniform(35., 80., 3600)
+    whole = get_rollup_stats(timestamp_ns, lavg, leq, ROLLUP_PERIODS_NS['hour'])
+    first = get_rollup_stats(timestamp_ns[:1000], lavg[:1000], leq[:1000], ROLLUP_PERIODS_NS['hour'])
+    rest = get_rollup_stats(timestamp_ns[1000:], lavg[1000:], leq[1000:], ROLLUP_PERIODS_NS['hour'])
+    assert len(whole['period_ns']) == 2
+    for col in ROLLUP_SUM_COLUMNS:
+        merged = np.zeros(2)
+        for part in [first, rest]:
+            merged[np.searchsorted(whole['period_ns'], part['period_ns'])] += part[col]
+        np.testing.assert_allclose(merged, whole[col])
+    assert whole['n_readings'].sum() == 3600
+    for col, threshold in zip(EXCEEDANCE_COLUMNS, [55, 65, 75]):
+        assert whole[col].sum() == np.count_nonzero(lavg > threshold)
+
+
+def test_rollup_night_penalty():
+    timestamp_ns = np.array([pd.Timestamp('2022-02-14 03:00').value, pd.Timestamp('2022-02-14 12:00').value])
+    stats = get_rollup_stats(timestamp_ns, np.full(2, 50.), np.full(2, 50.), ROLLUP_PERIODS_NS['day'])
+    assert stats['leq'][0] == pytest.approx(50.)
+    assert stats['ldn_energy_sum'][0] == pytest.approx(1e5 * (1. + 10. ** (NIGHT_PENALTY_DB / 10.)))
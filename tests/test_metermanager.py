@@ -0,0 +1,174 @@
+import functools
+import queue
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+pytest.importorskip('nsrt_mk3_dev')
+
+from datatablecreate import PARAMS_COLUMNS  # noqa: E402
+from metermanager import PARAMS_READ_SLACK_SECONDS, PARAMS_READERS, MeterManager  # noqa: E402
+from readingbuffer import ReadingBuffer  # noqa: E402
+from tickscheduler import NS_PER_MINUTE, NS_PER_SECOND  # noqa: E402
+
+START_NS = np.datetime64('2022-02-14T10:00', 'ns').astype(np.int64)
+FIRST_NS = START_NS + NS_PER_SECOND // 2  # first reading
+
+
+class FakeWeighting:
+    name = 'DB_A'
+
+
+class FakeMeter:
+    """
+    answers parameter queries, counting serial reads
+    """
+    def __init__(self, serial_number='SN1'):
+        self.reads = 0
+        self.serial_number = serial_number
+
+    def read(self, value):
+        self.reads += 1
+        return value
+
+    def read_tau(self):
+        return self.read(1.)
+
+    def read_weighting(self):
+        return self.read(FakeWeighting())
+
+    def read_fs(self):
+        return self.read(32000)
+
+    def read_sn(self):
+        return self.read(self.serial_number)
+
+    def read_fw_rev(self):
+        return self.read('1.0')
+
+    def read_dob(self):
+        return self.read('2021-01-01')
+
+    def read_doc(self):
+        return self.read('2021-06-01')
+
+
+def test_params_revalidated_one_read_per_tick(message_handler):
+    meter_manager = MeterManager()
+    meter_manager._message_handler = message_handler
+    meter_manager.sound_readings = ReadingBuffer(10, 1)
+    meter_manager.nsrt = FakeMeter()
+    meter_manager.read_meter_params()
+    meter_manager._params_revalidate_seconds = 0.
+    first_params_id = meter_manager._params_id
+    meter_manager.nsrt = FakeMeter(serial_number='SN2')
+    meter_manager.revalidate_params_step(PARAMS_READ_SLACK_SECONDS / 2.)
+    assert meter_manager.nsrt.reads == 0  # too close to next tick
+    for tick in range(len(PARAMS_READERS)):
+        meter_manager.revalidate_params_step(1.)
+        assert meter_manager.nsrt.reads == tick + 1
+        assert (meter_manager._params_id == first_params_id) == (tick < len(PARAMS_READERS) - 1)
+    assert meter_manager._meter_params['serial_number'] == 'SN2'
+
+
+class StubDataManager:
+    """
+    stands in for DataManager, keeps first reading of each saved block; saves wait while release is clear
+    and raise for blocks starting at fail_ns
+    """
+    def __init__(self, fail_ns=None):
+        self.saved = []
+        self.closed = False
+        self.fail_ns = fail_ns
+        self.saving = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def save_reading(self, data):
+        self.saving.set()
+        self.release.wait(10.)
+        if data.timestamp_ns[0] == self.fail_ns:
+            raise ValueError("write failed")
+        self.saved.append(data.timestamp_ns[0])
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSerial:
+    is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+def get_writer_manager(message_handler, data_manager, queue_minutes=5, n_minutes=4):
+    """
+    meter manager with n_minutes of one reading per second from 10:00:00.5, writer not started
+    """
+    meter_manager = MeterManager()
+    meter_manager._message_handler = message_handler
+    meter_manager._data_manager = data_manager
+    meter_manager._write_queue = queue.Queue(maxsize=queue_minutes)
+    meter_manager._write_counts = {'written': 0, 'dropped': 0, 'failed': 0}
+    meter_manager.sound_readings = ReadingBuffer(60 * n_minutes, 1)
+    params_id = meter_manager.sound_readings.register_params(OrderedDict((col, 'p') for col in PARAMS_COLUMNS))
+    for ii in range(60 * n_minutes):
+        meter_manager.sound_readings.append(FIRST_NS + ii * NS_PER_SECOND, 50., 50., 70., params_id)
+    return meter_manager
+
+
+def queue_blocks(meter_manager, n_minutes):
+    for ii in range(n_minutes):
+        meter_manager.queue_readings_block(START_NS + (ii + 1) * NS_PER_MINUTE)
+
+
+def test_minutes_dropped_when_queue_full(message_handler):
+    meter_manager = get_writer_manager(message_handler, StubDataManager(), queue_minutes=2)
+    queue_blocks(meter_manager, 4)
+    assert meter_manager._write_counts == {'written': 0, 'dropped': 2, 'failed': 0}
+    meter_manager.start_writer()
+    meter_manager.stop_writer(timeout=10.)
+    assert meter_manager._data_manager.saved == [FIRST_NS, FIRST_NS + NS_PER_MINUTE]
+
+
+def test_failed_write_counted_and_writer_continues(message_handler):
+    data_manager = StubDataManager(fail_ns=FIRST_NS + NS_PER_MINUTE)
+    meter_manager = get_writer_manager(message_handler, data_manager)
+    queue_blocks(meter_manager, 3)
+    meter_manager.start_writer()
+    meter_manager.stop_writer(timeout=10.)
+    assert meter_manager._write_counts == {'written': 2, 'dropped': 0, 'failed': 1}
+    assert data_manager.saved == [FIRST_NS, FIRST_NS + 2 * NS_PER_MINUTE]
+    assert any(msg.startswith('Error writing minute ending') for msg in message_handler.messages)
+
+
+def test_stop_drains_queued_minutes(message_handler):
+    data_manager = StubDataManager()
+    data_manager.release.clear()
+    meter_manager = get_writer_manager(message_handler, data_manager)
+    meter_manager.start_writer()
+    queue_blocks(meter_manager, 4)
+    assert data_manager.saving.wait(10.)
+    data_manager.release.set()
+    meter_manager.stop_writer(timeout=10.)
+    assert not meter_manager._writer_thread.is_alive()
+    assert meter_manager._write_counts == {'written': 4, 'dropped': 0, 'failed': 0}
+
+
+def test_close_with_stuck_writer_closes_data_manager(message_handler):
+    data_manager = StubDataManager()
+    data_manager.release.clear()
+    meter_manager = get_writer_manager(message_handler, data_manager, queue_minutes=1)
+    meter_manager.nsrt = type('FakeNsrt', (), {'serial': FakeSerial()})()
+    meter_manager.start_writer()
+    queue_blocks(meter_manager, 1)
+    assert data_manager.saving.wait(10.)  # writer holds first minute
+    queue_blocks(meter_manager, 1)  # fills queue
+    meter_manager.stop_writer = functools.partial(meter_manager.stop_writer, timeout=0.1)
+    meter_manager.close()
+    assert data_manager.closed
+    assert any(msg.startswith('writer not stopped') for msg in message_handler.messages)
+    data_manager.release.set()
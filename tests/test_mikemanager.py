@@ -0,0 +1,142 @@
+import shutil
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyaudio')
+
+import mikemanager  # noqa: E402
+from mikemanager import MikeManager, encode_flac  # noqa: E402
+
+SAMPLE_RATE = 100
+CHUNK = 10
+
+
+class FailingStream:
+    """
+    stream of non-zero frames, read number fail_read sleeps fail_seconds then fails
+    """
+    def __init__(self, fail_read: int = None, fail_seconds: float = 0.):
+        self.reads = 0
+        self.fail_read = fail_read
+        self.fail_seconds = fail_seconds
+
+    def read(self, chunk, exception_on_overflow=False):
+        self.reads += 1
+        if self.reads == self.fail_read:
+            time.sleep(self.fail_seconds)
+            raise OSError('input overflowed')
+        return np.ones(chunk, dtype=np.int16).tobytes()
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SegmentCollector:
+    def __init__(self):
+        self.segments = []
+
+    def put(self, segment_path, end):
+        self.segments.append((segment_path, end))
+
+
+class StreamMikeManager(MikeManager):
+    """
+    MikeManager reading from FailingStream, first stream opened fails, reopened streams do not
+    """
+    def __init__(self, recorder_info, msg_handler, segment_queue, first_stream):
+        self.streams = [first_stream]
+        super(StreamMikeManager, self).__init__(recorder_info, msg_handler, segment_queue)
+
+    def initialize(self):
+        pass
+
+    def close(self):
+        pass
+
+    def open_stream(self):
+        return self.streams.pop(0) if self.streams else FailingStream()
+
+
+def read_frames(segment_path):
+    with wave.open(str(segment_path), 'rb') as f:
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+
+
+def get_recorder_info(tmp_path):
+    return {'sample-rate': SAMPLE_RATE, 'chunk': CHUNK, 'channels': 1, 'output-name': 'test',
+            'staging-dir': str(tmp_path)}
+
+
+def test_lost_frames_written_as_silence(tmp_path, message_handler):
+    segment_queue = SegmentCollector()
+    mike_manager = StreamMikeManager(get_recorder_info(tmp_path), message_handler, segment_queue,
+                                     FailingStream(fail_read=3, fail_seconds=0.5))
+    first_end = pd.Timestamp.now() + pd.Timedelta(seconds=1)
+    mike_manager.record_continuous(first_end, segments=1)
+    [(segment_path, end)] = segment_queue.segments
+    frames = read_frames(segment_path)
+    assert end == first_end
+    assert len(frames) == int(round(SAMPLE_RATE * 1.))
+    assert 25 <= np.count_nonzero(frames == 0) <= 35  # 0.5 s failure after 20 of 100 frames
+
+
+def test_segment_end_passed_restarts_at_minute(tmp_path, message_handler):
+    segment_queue = SegmentCollector()
+    mike_manager = StreamMikeManager(get_recorder_info(tmp_path), message_handler, segment_queue,
+                                     FailingStream(fail_read=3, fail_seconds=1.))
+    first_end = pd.Timestamp.now() + pd.Timedelta(seconds=0.5)
+    mike_manager.record_continuous(first_end, segments=2)
+    (first_path, _), (second_path, second_end) = segment_queue.segments
+    assert np.count_nonzero(read_frames(first_path) == 0) > 0
+    assert second_end == second_end.floor('min')
+    assert np.count_nonzero(read_frames(second_path) == 0) == 0
+
+
+def write_wav(segment_path, n_frames=48000):
+    with wave.open(str(segment_path), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(48000)
+        wf.writeframes(np.round(np.sin(np.arange(n_frames) / 10.) * 8000.).astype(np.int16).tobytes())
+
+
+class FailingEncoder:
+    """
+    stands in for Popen of flac encoder: writes part of output file, then exits with error
+    """
+    def __init__(self, cmd, stdout=None, stderr=None):
+        Path(cmd[cmd.index('-o') + 1]).write_bytes(b'fLaC')
+        self.returncode = 1
+
+    @staticmethod
+    def communicate():
+        return b'', b'write error'
+
+
+@pytest.mark.skipif(shutil.which('flac') is None, reason='flac encoder not installed')
+def test_flac_replaces_wav(tmp_path, message_handler):
+    segment_path = tmp_path / '202202141001nsrt.wav'
+    write_wav(segment_path)
+    encoded_path = encode_flac(segment_path, {}, message_handler)
+    assert encoded_path == tmp_path / '202202141001nsrt.flac'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['202202141001nsrt.flac']
+    assert encoded_path.read_bytes()[:4] == b'fLaC'
+
+
+def test_failed_flac_keeps_wav(tmp_path, message_handler, monkeypatch):
+    monkeypatch.setattr(mikemanager, 'Popen', FailingEncoder)
+    segment_path = tmp_path / '202202141001nsrt.wav'
+    write_wav(segment_path)
+    wav_bytes = segment_path.read_bytes()
+    assert encode_flac(segment_path, {}, message_handler) == segment_path
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['202202141001nsrt.wav']
+    assert segment_path.read_bytes() == wav_bytes
+    assert 'write error' in message_handler.messages[-1]
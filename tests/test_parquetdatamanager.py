@@ -0,0 +1,57 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import pyarrow.parquet as pq  # noqa: E402
+
+from conftest import make_block  # noqa: E402
+from datamanager import ParquetDataManager  # noqa: E402
+
+
+def get_meter_info(tmp_path):
+    return {'parquet-location': str(tmp_path / 'parquet'), 'parquet-rowgroup-minutes': 1}
+
+
+def read_day(data_manager):
+    return pd.concat(data_manager.read_time_range(pd.Timestamp('2022-02-14'), pd.Timestamp('2022-02-15')))
+
+
+def test_compact_day_merges_row_groups(tmp_path, message_handler):
+    data_manager = ParquetDataManager(get_meter_info(tmp_path), message_handler)
+    for start in ['2022-02-14T10:00', '2022-02-14T10:01', '2022-02-14T10:02']:
+        data_manager.save_reading(make_block(start))
+    parts_dir = data_manager.get_parts_dir('2022-02-14')
+    assert len(list(parts_dir.glob('*.parquet'))) == 3
+    data_manager.compact_day('2022-02-14')
+    assert not parts_dir.exists()
+    assert pq.read_metadata(str(data_manager.get_day_path('2022-02-14'))).num_rows == 180
+    readings = read_day(data_manager)
+    assert len(readings) == 180
+    assert readings['timestamp'].is_monotonic_increasing
+    data_manager.close()
+
+
+def test_compact_day_skips_merged_parts(tmp_path, message_handler):
+    data_manager = ParquetDataManager(get_meter_info(tmp_path), message_handler)
+    data_manager.save_reading(make_block('2022-02-14T10:00'))
+    parts_dir = data_manager.get_parts_dir('2022-02-14')
+    kept_dir = tmp_path / 'kept'
+    shutil.copytree(str(parts_dir), str(kept_dir))
+    data_manager.compact_day('2022-02-14')
+    shutil.copytree(str(kept_dir), str(parts_dir))  # as if crashed before removal of merged parts
+    data_manager.save_reading(make_block('2022-02-14T10:01'))
+    data_manager.compact_day('2022-02-14')
+    assert len(read_day(data_manager)) == 120
+    data_manager.close()
+
+
+def test_day_change_compacts_previous_day(tmp_path, message_handler):
+    data_manager = ParquetDataManager(get_meter_info(tmp_path), message_handler)
+    data_manager.save_reading(make_block('2022-02-14T23:59'))
+    data_manager.save_reading(make_block('2022-02-15T00:00'))
+    assert data_manager.get_day_path('2022-02-14').exists()
+    assert not data_manager.get_parts_dir('2022-02-14').exists()
+    data_manager.close()
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from datatablecreate import PARAMS_COLUMNS
+from readingbuffer import ReadingBuffer
+
+NS_PER_SECOND = 1000000000
+
+
+def fill_buffer(capacity, n_readings, params_switch=None):
+    """
+    buffer with one reading per second from t = 0, lavg equal to reading number, params id 1 from params_switch
+    """
+    reading_buffer = ReadingBuffer(capacity, nsrt_id=3)
+    params_ids = [reading_buffer.register_params(OrderedDict((col, '{0}_{1}'.format(col, ii))
+                                                             for col in PARAMS_COLUMNS)) for ii in range(2)]
+    for ii in range(n_readings):
+        reading_buffer.append(ii * NS_PER_SECOND, float(ii), 50., 70.,
+                              params_ids[1] if params_switch is not None and ii >= params_switch else params_ids[0])
+    return reading_buffer
+
+
+def test_block_bounds_inclusive():
+    block = fill_buffer(100, 30).get_block(10 * NS_PER_SECOND, 20 * NS_PER_SECOND)
+    assert block.nsrt_id == 3
+    np.testing.assert_array_equal(block.lavg, np.arange(10., 21.))
+
+
+def test_block_after_wrap():
+    reading_buffer = fill_buffer(50, 175)
+    assert len(reading_buffer) == 50
+    block = reading_buffer.get_block(0, 200 * NS_PER_SECOND)
+    np.testing.assert_array_equal(block.lavg, np.arange(125., 175.))
+    assert np.all(np.diff(block.timestamp_ns) > 0)
+
+
+def test_block_outside_buffer_empty():
+    block = fill_buffer(50, 175).get_block(0, 100 * NS_PER_SECOND)
+    assert len(block) == 0
+    assert block.params == {}
+
+
+def test_block_params_of_readings_only():
+    reading_buffer = fill_buffer(100, 60, params_switch=30)
+    assert list(reading_buffer.get_block(0, 20 * NS_PER_SECOND).params) == [0]
+    block = reading_buffer.get_block(20 * NS_PER_SECOND, 40 * NS_PER_SECOND)
+    assert sorted(block.params) == [0, 1]
+    assert block.params[1]['tau'] == 'tau_1'
@@ -0,0 +1,108 @@
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyaudio')
+
+import mikemanager  # noqa: E402
+from mikemanager import RETENTION_INDEX_NAME, WAV_FILE_TIMESTAMP, RetentionManager  # noqa: E402
+
+
+@pytest.fixture
+def recorder_info(tmp_path):
+    (tmp_path / 'staging').mkdir()
+    (tmp_path / 'dest').mkdir()
+    return {'staging-dir': str(tmp_path / 'staging'), 'dest-dir': str(tmp_path / 'dest'), 'output-name': 'nsrt'}
+
+
+def save_segment(retention_manager, recorder_info, segment_key, suffixes=('.wav',), file_bytes=10):
+    """
+    write files of segment to destination and add them to retention index
+    """
+    for suffix in suffixes:
+        filename = '{0}nsrt{1}'.format(segment_key, suffix)
+        (Path(recorder_info['dest-dir']) / filename).write_bytes(b'\0' * file_bytes)
+        retention_manager.add(filename, file_bytes)
+
+
+def get_dest_files(recorder_info):
+    return sorted(path.name for path in Path(recorder_info['dest-dir']).iterdir())
+
+
+def get_minute_keys(n_minutes):
+    return ['20220214{0:02d}{1:02d}'.format(10 + ii // 60, ii % 60) for ii in range(n_minutes)]
+
+
+def test_segment_count_limit(recorder_info, message_handler):
+    retention_manager = RetentionManager(dict(recorder_info, **{'keep-segments': 3}), message_handler)
+    for segment_key in get_minute_keys(5):
+        save_segment(retention_manager, recorder_info, segment_key, suffixes=('.wav', '_levels.csv'))
+    assert retention_manager.delete_expired() == 4  # both files of two oldest segments
+    assert get_dest_files(recorder_info)[0] == '202202141002nsrt.wav'
+    assert len(get_dest_files(recorder_info)) == 6
+    assert retention_manager.delete_expired() == 0
+
+
+def test_segment_age_limit(recorder_info, message_handler):
+    retention_manager = RetentionManager(dict(recorder_info, **{'keep-hours': 1}), message_handler)
+    now = pd.Timestamp.now()
+    segment_keys = [(now - pd.Timedelta(minutes=minutes)).strftime(WAV_FILE_TIMESTAMP)
+                    for minutes in (180, 90, 30, 0)]
+    for segment_key in segment_keys:
+        save_segment(retention_manager, recorder_info, segment_key)
+    assert retention_manager.delete_expired() == 2
+    assert get_dest_files(recorder_info) == ['{0}nsrt.wav'.format(key) for key in segment_keys[2:]]
+
+
+def test_bytes_limit(recorder_info, message_handler):
+    retention_manager = RetentionManager(dict(recorder_info, **{'keep-megabytes': 0.0025}), message_handler)
+    for segment_key in get_minute_keys(4):
+        save_segment(retention_manager, recorder_info, segment_key, file_bytes=1000)
+    assert retention_manager.delete_expired() == 2  # 2000 bytes kept
+    assert get_dest_files(recorder_info) == ['202202141002nsrt.wav', '202202141003nsrt.wav']
+
+
+def test_deletion_in_batches(recorder_info, message_handler, monkeypatch):
+    monkeypatch.setattr(mikemanager, 'RETENTION_BATCH_FILES', 4)
+    retention_manager = RetentionManager(dict(recorder_info, **{'keep-segments': 1}), message_handler)
+    for segment_key in get_minute_keys(7):
+        save_segment(retention_manager, recorder_info, segment_key)
+    assert [retention_manager.delete_expired() for _ in range(3)] == [4, 2, 0]
+    assert get_dest_files(recorder_info) == ['202202141006nsrt.wav']
+
+
+def test_out_of_order_add(recorder_info, message_handler):
+    retention_manager = RetentionManager(dict(recorder_info, **{'keep-segments': 1}), message_handler)
+    for segment_key in ['202202141002', '202202141000', '202202141001']:
+        save_segment(retention_manager, recorder_info, segment_key)
+    assert retention_manager.delete_expired() == 2
+    assert get_dest_files(recorder_info) == ['202202141002nsrt.wav']
+
+
+def test_index_reloaded(recorder_info, message_handler, tmp_path):
+    retention_manager = RetentionManager(dict(recorder_info, **{'keep-segments': 3}), message_handler)
+    for segment_key in get_minute_keys(4):
+        save_segment(retention_manager, recorder_info, segment_key, file_bytes=100)
+    retention_manager.delete_expired()
+    assert (tmp_path / 'staging' / RETENTION_INDEX_NAME).exists()
+    reloaded_manager = RetentionManager(dict(recorder_info, **{'keep-segments': 3}), message_handler)
+    assert list(reloaded_manager._segments) == get_minute_keys(4)[1:]
+    assert reloaded_manager._total_bytes == 300
+    save_segment(reloaded_manager, recorder_info, '202202141004', file_bytes=100)
+    assert reloaded_manager.delete_expired() == 1
+    assert get_dest_files(recorder_info)[0] == '202202141002nsrt.wav'
+
+
+def test_destination_seeded_without_index(recorder_info, message_handler):
+    for segment_key in get_minute_keys(3):
+        (Path(recorder_info['dest-dir']) / '{0}nsrt.wav'.format(segment_key)).write_bytes(b'\0')
+    retention_manager = RetentionManager(dict(recorder_info, **{'keep-segments': 1}), message_handler)
+    retention_manager.start()
+    retention_manager._wake_event.set()  # rather than waiting for periodic check
+    deadline = time.monotonic() + 10.
+    while len(get_dest_files(recorder_info)) > 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    retention_manager.close(timeout=10.)
+    assert get_dest_files(recorder_info) == ['202202141002nsrt.wav']
@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyaudio')
+
+from mikemanager import SegmentQueue  # noqa: E402
+
+
+def test_segments_kept_in_order_and_oldest_dropped(tmp_path, message_handler):
+    recorder_info = {'staging-dir': str(tmp_path / 'staging'), 'queue-segments': 1, 'spill-segments': 2}
+    segment_queue = SegmentQueue(recorder_info, message_handler)
+    ends = pd.date_range('2022-02-14 10:01', periods=4, freq='60s')
+    for end in ends:
+        segment_path = tmp_path / '{0}.wav'.format(end.strftime('%Y%m%d%H%M'))
+        segment_path.write_bytes(b'RIFF')
+        segment_queue.put(segment_path, end)
+    segment_queue.stop()
+    handed_out = []
+    while True:
+        queued_segment = segment_queue.get()
+        if queued_segment is None:
+            break
+        handed_out.append(queued_segment[1])
+    assert handed_out == [ends[0], ends[2], ends[3]]
+    assert segment_queue.get_counts()['dropped'] == 1
+    assert any('dropped' in msg for msg in message_handler.messages)
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip('pyaudio')
+
+from mikemanager import UPLOAD_DIR_NAME, SegmentUploader  # noqa: E402
+
+
+def test_missing_file_dropped(tmp_path, message_handler):
+    dest_dir = tmp_path / 'dest'
+    dest_dir.mkdir()
+    recorder_info = {'staging-dir': str(tmp_path / 'staging'), 'dest-dir': str(dest_dir)}
+    uploader = SegmentUploader(recorder_info, message_handler)
+    for name in ['202202141000.wav', '202202141001.wav']:
+        (tmp_path / name).write_bytes(b'RIFF')
+        uploader.add(tmp_path / name)
+    (tmp_path / 'staging' / UPLOAD_DIR_NAME / '202202141000.wav').unlink()
+    uploader.start()
+    uploader.close(timeout=10.)
+    assert len(uploader) == 0
+    assert uploader.get_counts()['missing'] == 1
+    assert (dest_dir / '202202141001.wav').exists()
@@ -0,0 +1,59 @@
+import numpy as np
+
+from conftest import make_block
+from spool import DataSpool, SpoolForwarder
+
+
+def test_block_round_trip(tmp_path):
+    spool = DataSpool(str(tmp_path / 'spool.sqlite'))
+    block = make_block('2022-02-14T10:00')
+    spool.append(block)
+    [(spool_id, spooled)] = spool.read_batch(10)
+    assert spooled.nsrt_id == block.nsrt_id
+    np.testing.assert_array_equal(spooled.timestamp_ns, block.timestamp_ns)
+    np.testing.assert_allclose(spooled.lavg, block.lavg, rtol=1e-6)
+    assert spooled.params == block.params
+    spool.remove([spool_id])
+    assert spool.count() == 0
+    spool.close()
+
+
+def test_poison_block_dead_lettered(tmp_path, message_handler):
+    spool = DataSpool(str(tmp_path / 'spool.sqlite'))
+    for minute in ['10:00', '10:01', '10:02']:
+        spool.append(make_block('2022-02-14T{0}'.format(minute), nsrt_id=2 if minute == '10:01' else 1))
+    written = []
+
+    def write_blocks(blocks):
+        if any(block.nsrt_id == 2 for block in blocks):
+            raise ValueError('bad block')
+        written.extend(blocks)
+
+    forwarder = SpoolForwarder(spool, write_blocks, message_handler, dead_letter_attempts=2)
+    forwarder._stop_event.wait = lambda timeout: False  # no backoff waits in test
+    forwarder._wake_event.wait = lambda timeout: forwarder._stop_event.set()  # stop once spool is empty
+    forwarder.run_forwarder()
+    assert [block.nsrt_id for block in written] == [1, 1]
+    assert spool.count() == 0
+    assert spool.count('spool_dead') == 1
+    spool.close()
+
+
+def test_transient_failure_not_dead_lettered(tmp_path, message_handler):
+    spool = DataSpool(str(tmp_path / 'spool.sqlite'))
+    spool.append(make_block('2022-02-14T10:00'))
+    attempts = []
+
+    def write_blocks(blocks):
+        attempts.append(len(blocks))
+        if len(attempts) < 5:
+            raise ConnectionError('unreachable')
+
+    forwarder = SpoolForwarder(spool, write_blocks, message_handler, transient_errors=(ConnectionError,),
+                               dead_letter_attempts=2)
+    forwarder._stop_event.wait = lambda timeout: False
+    forwarder._wake_event.wait = lambda timeout: forwarder._stop_event.set()
+    forwarder.run_forwarder()
+    assert len(attempts) == 5
+    assert spool.count('spool_dead') == 0
+    spool.close()
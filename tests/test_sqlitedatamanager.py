@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+
+from conftest import make_block
+from datamanager import SQLiteDataManager
+from datatablecreate import PARAMS_COLUMNS
+
+
+def get_meter_info(sqlite_file):
+    return {'sqlite-file': str(sqlite_file), 'meter-id': 1,
+            'meta-entry': {'station_name': 'test', 'station_location': 'office', 'station_height_m': 15,
+                           'modified_by': 'test', 'modified_time': 'now'}}
+
+
+def count_rows(data_manager, table_name):
+    table = data_manager._db_info.get_table(table_name)
+    with data_manager._db_info.get_engine().connect() as con:
+        return con.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_blocks_written_and_read_back(tmp_path, message_handler):
+    data_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    data_manager.save_reading(make_block('2022-02-14T10:00'))
+    data_manager.save_reading(make_block('2022-02-14T10:01'))
+    readings = pd.concat(data_manager.read_time_range(pd.Timestamp('2022-02-14'), pd.Timestamp('2022-02-15')))
+    assert len(readings) == 120
+    assert readings['timestamp'].is_monotonic_increasing
+    assert count_rows(data_manager, 'nsrt_minute') == 2
+    assert count_rows(data_manager, 'nsrt_hour') == 1
+    data_manager.close()
+
+
+def test_reopened_file_keeps_rows(tmp_path, message_handler):
+    data_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    data_manager.save_reading(make_block('2022-02-14T10:00'))
+    data_manager.close()
+    data_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    data_manager.save_reading(make_block('2022-02-14T10:01'))
+    assert count_rows(data_manager, 'nsrt_data') == 120
+    data_manager.close()
+
+
+def test_replayed_block_written_once(tmp_path, message_handler):
+    data_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    block = make_block('2022-02-14T10:00')
+    data_manager.write_blocks([block])
+    data_manager.write_blocks([block, make_block('2022-02-14T10:01')])
+    hour_table = data_manager._db_info.get_table('nsrt_hour')
+    with data_manager._db_info.get_engine().connect() as con:
+        n_readings = con.execute(select(hour_table.c.n_readings)).scalar()
+    assert n_readings == 120
+    assert count_rows(data_manager, 'nsrt_data') == 120
+    data_manager.close()
+
+
+def test_duplicate_readings_ignored(tmp_path, message_handler):
+    data_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    block = make_block('2022-02-14T10:00')
+    data_manager.write_blocks([block])
+    with data_manager._db_info.get_engine().begin() as con:
+        data_manager.insert_blocks([block], con)
+    assert count_rows(data_manager, 'nsrt_data') == 60
+    data_manager.close()
+
+
+def test_params_shared_between_writers(tmp_path, message_handler):
+    params = dict((col, 'p_{0}'.format(col)) for col in PARAMS_COLUMNS)
+    first_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    second_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    assert first_manager.get_params_index(params) == 0
+    assert second_manager.get_params_index(params) == 0  # not in its registry, found after insert
+    assert second_manager.get_params_index(dict(params, tau='other')) == 1
+    assert count_rows(first_manager, 'nsrt_params') == 2
+    first_manager.close()
+    second_manager.close()
+
+
+def test_params_insert_errors_raised(tmp_path, message_handler):
+    data_manager = SQLiteDataManager(get_meter_info(tmp_path / 'nsrt.sqlite'), message_handler)
+    with data_manager._db_info.get_engine().begin() as con:
+        con.execute(text('CREATE TRIGGER audit_params AFTER INSERT ON nsrt_params '
+                         'BEGIN INSERT INTO params_audit VALUES (new.id); END'))  # audit table missing
+    with pytest.raises(OperationalError, match='params_audit'):
+        data_manager.get_params_index(dict((col, 'p_{0}'.format(col)) for col in PARAMS_COLUMNS))
+    data_manager.close()
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+import tickscheduler
+from tickscheduler import TickScheduler, NS_PER_SECOND, NS_PER_MINUTE
+
+NS_PER_MS = 1000000
+MINUTE_NS = 28333333 * NS_PER_MINUTE
+WALL_START_NS = MINUTE_NS + 20345 * NS_PER_MS
+
+
+class FakeClock:
+    """
+    stands in for time module in tickscheduler: monotonic and wall clocks advance together on sleep,
+    wake-up is late by wake_ns, wall clock can be stepped independently
+    """
+    def __init__(self, wake_ns=0):
+        self.mono_ns = 5 * NS_PER_SECOND
+        self.wall_ns = WALL_START_NS
+        self.wake_ns = wake_ns
+
+    def monotonic_ns(self):
+        return self.mono_ns
+
+    def time_ns(self):
+        return self.wall_ns
+
+    def advance(self, ns):
+        self.mono_ns += ns
+        self.wall_ns += ns
+
+    def sleep(self, seconds):
+        self.advance(int(round(seconds * NS_PER_SECOND)) + self.wake_ns)
+
+    @staticmethod
+    def localtime():
+        return time.gmtime()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(tickscheduler, 'time', fake_clock)
+    return fake_clock
+
+
+def test_ticks_on_grid_anchored_to_minute(clock):
+    scheduler = TickScheduler(0.25, padding_seconds=0.01)
+    scheduler.start()
+    assert scheduler.get_next_tick_local_ns() == MINUTE_NS + 20510 * NS_PER_MS
+    for expected_ms in (20510, 20760, 21010):
+        scheduler.wait_next_tick()
+        assert scheduler.local_time_ns() == MINUTE_NS + expected_ms * NS_PER_MS
+    assert scheduler.pop_stats() == {'ticks': 3, 'missed': 0, 'mean_jitter_ms': 0., 'max_jitter_ms': 0.}
+
+
+def test_query_time_does_not_move_grid(clock):
+    scheduler = TickScheduler(1.)
+    scheduler.start()
+    released = []
+    for _ in range(5):
+        scheduler.wait_next_tick()
+        released.append(scheduler.local_time_ns())
+        clock.advance(300 * NS_PER_MS)  # meter query
+    assert [tick % NS_PER_SECOND for tick in released] == [0] * 5
+    assert [later - earlier for earlier, later in zip(released, released[1:])] == [NS_PER_SECOND] * 4
+
+
+def test_late_ticks_skipped_and_counted(clock):
+    scheduler = TickScheduler(1.)
+    scheduler.start()
+    first = scheduler.wait_next_tick()
+    clock.advance(3500 * NS_PER_MS)  # stall past three deadlines
+    assert scheduler.get_slack_seconds() < 0.
+    released = scheduler.wait_next_tick()
+    assert released == first + 3  # deadline passed by less than a period is still released
+    assert scheduler.local_time_ns() % NS_PER_SECOND == 500 * NS_PER_MS
+    assert scheduler.wait_next_tick() == first + 4
+    stats = scheduler.pop_stats()
+    assert stats['ticks'] == 3
+    assert stats['missed'] == 2
+    assert stats['max_jitter_ms'] == 500.
+
+
+def test_pop_stats_resets(monkeypatch):
+    monkeypatch.setattr(tickscheduler, 'time', FakeClock(wake_ns=2 * NS_PER_MS))
+    scheduler = TickScheduler(0.5)
+    scheduler.start()
+    for _ in range(4):
+        scheduler.wait_next_tick()
+    stats = scheduler.pop_stats()
+    assert stats['ticks'] == 4
+    assert stats['mean_jitter_ms'] == pytest.approx(2.)
+    assert stats['max_jitter_ms'] == pytest.approx(2.)
+    assert scheduler.pop_stats() == {'ticks': 0, 'missed': 0, 'mean_jitter_ms': 0., 'max_jitter_ms': 0.}
+
+
+def test_small_wall_clock_drift_ignored(clock):
+    scheduler = TickScheduler(1.)
+    scheduler.start()
+    scheduler.wait_next_tick()
+    derived_ns = scheduler.local_time_ns()
+    clock.wall_ns += 200 * NS_PER_MS
+    assert scheduler.check_wall_clock() == 0.
+    assert scheduler.local_time_ns() == derived_ns
+
+
+@pytest.mark.parametrize('step_seconds', [3600., -90.5])
+def test_wall_clock_step_reanchors(clock, step_seconds):
+    scheduler = TickScheduler(1.)
+    scheduler.start()
+    scheduler.wait_next_tick()
+    clock.wall_ns += int(step_seconds * NS_PER_SECOND)
+    assert scheduler.check_wall_clock() == pytest.approx(step_seconds)
+    assert scheduler.local_time_ns() == clock.wall_ns
+    scheduler.wait_next_tick()
+    assert scheduler.local_time_ns() == clock.wall_ns
+    assert scheduler.local_time_ns() % NS_PER_SECOND == 0  # grid realigned to stepped wall clock
+    assert scheduler.check_wall_clock() == 0.
@@ -0,0 +1,137 @@
+#!/usr/bin/python -u
+# coding=utf-8
+"""
+Drift-free schedule for periodic meter queries
+Ticks are placed on a fixed grid of the monotonic clock, anchored to a wall-clock
+minute boundary, so the time taken by each query does not move the grid; a step of the
+wall clock (e.g. NTP sync on a host without RTC) is picked up by check_wall_clock, which
+re-anchors the grid and the timestamps derived from it
+"""
+import time
+
+NS_PER_SECOND = 1000000000
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+WALL_CLOCK_STEP_SECONDS = 1.  # divergence of wall clock from derived time that triggers re-anchoring
+
+
+class TickScheduler:
+    """
+    Sleeps until successive ticks of a fixed period, records jitter and missed ticks
+    """
+    _period_ns: int = None  # time between ticks
+    _padding_ns: int = None  # time after each grid mark at which tick is released
+    _anchor_mono_ns: int = None  # monotonic time of wall-clock anchor
+    _anchor_wall_ns: int = None  # wall-clock anchor, ns since epoch (UTC), on a minute boundary
+    _utc_offset_ns: int = 0  # local time offset from UTC, refreshed by refresh_utc_offset
+    _next_tick: int = 0  # index of next tick on grid
+    _tick_count: int = 0  # ticks released since stats last reset
+    _missed_count: int = 0  # ticks skipped because deadline had passed, since stats last reset
+    _jitter_sum_ns: int = 0  # sum of wake-up lateness, since stats last reset
+    _jitter_max_ns: int = 0  # maximum wake-up lateness, since stats last reset
+
+    def __init__(self, period_seconds: float, padding_seconds: float = 0.):
+        if period_seconds <= 0.:
+            raise ValueError("tick period must be positive")
+        self._period_ns = int(round(period_seconds * NS_PER_SECOND))
+        self._padding_ns = int(round(padding_seconds * NS_PER_SECOND))
+        self.refresh_utc_offset()
+
+    def start(self):
+        """
+        anchor grid to the current wall-clock minute, next tick is first grid mark after now
+        :return: None
+        """
+        self.anchor()
+        self.reset_stats()
+
+    def anchor(self):
+        """
+        anchor grid and derived timestamps to the current wall-clock minute, next tick is first grid mark after now
+        :return: None
+        """
+        mono_now = time.monotonic_ns()
+        wall_now = time.time_ns()
+        self._anchor_wall_ns = (wall_now // NS_PER_MINUTE) * NS_PER_MINUTE
+        self._anchor_mono_ns = mono_now - (wall_now - self._anchor_wall_ns)
+        self._next_tick = (mono_now - self._anchor_mono_ns) // self._period_ns + 1
+
+    def check_wall_clock(self, max_step_seconds: float = WALL_CLOCK_STEP_SECONDS):
+        """
+        compare wall clock with time derived from monotonic clock, e.g. at minute boundaries;
+        re-anchor if wall clock has been stepped by more than max_step_seconds
+        :param max_step_seconds: divergence tolerated without re-anchoring
+        :return: wall-clock step in seconds if re-anchored, else 0.
+        """
+        mono_now = time.monotonic_ns()
+        wall_now = time.time_ns()
+        step_ns = wall_now - (self._anchor_wall_ns + (mono_now - self._anchor_mono_ns))
+        if abs(step_ns) <= max_step_seconds * NS_PER_SECOND:
+            return 0.
+        self.anchor()
+        return step_ns / NS_PER_SECOND
+
+    def refresh_utc_offset(self):
+        """
+        re-read local offset from UTC, e.g. at minute boundaries to follow daylight saving changes
+        :return: None
+        """
+        self._utc_offset_ns = time.localtime().tm_gmtoff * NS_PER_SECOND
+
+    def get_tick_deadline_ns(self, tick: int):
+        return self._anchor_mono_ns + tick * self._period_ns + self._padding_ns
+
+    def get_next_tick_local_ns(self):
+        return self.local_time_ns(self.get_tick_deadline_ns(self._next_tick))
+
+    def get_slack_seconds(self):
+        """
+        :return: time left until next tick, negative if its deadline has passed
+        """
+        return (self.get_tick_deadline_ns(self._next_tick) - time.monotonic_ns()) / NS_PER_SECOND
+
+    def wait_next_tick(self):
+        """
+        sleep until next tick; ticks whose deadline passed by more than a period are skipped and counted
+        :return: index of tick released
+        """
+        now = time.monotonic_ns()
+        late_ticks = (now - self.get_tick_deadline_ns(self._next_tick)) // self._period_ns
+        if late_ticks > 0:
+            self._next_tick += late_ticks
+            self._missed_count += late_ticks
+        deadline = self.get_tick_deadline_ns(self._next_tick)
+        if deadline > now:
+            time.sleep((deadline - now) / NS_PER_SECOND)
+        jitter_ns = time.monotonic_ns() - deadline
+        self._jitter_sum_ns += jitter_ns
+        self._jitter_max_ns = max(self._jitter_max_ns, jitter_ns)
+        self._tick_count += 1
+        self._next_tick += 1
+        return self._next_tick - 1
+
+    def local_time_ns(self, mono_ns: int = None):
+        """
+        local wall-clock time derived from monotonic clock, in the form of pd.Timestamp.now().value
+        :param mono_ns: monotonic time, now if None
+        :return: ns since epoch, local time
+        """
+        if mono_ns is None:
+            mono_ns = time.monotonic_ns()
+        return self._anchor_wall_ns + (mono_ns - self._anchor_mono_ns) + self._utc_offset_ns
+
+    def reset_stats(self):
+        self._tick_count = 0
+        self._missed_count = 0
+        self._jitter_sum_ns = 0
+        self._jitter_max_ns = 0
+
+    def pop_stats(self):
+        """
+        tick statistics since last call, then reset
+        :return: dictionary of ticks, missed ticks, mean and maximum jitter (ms)
+        """
+        stats = {'ticks': self._tick_count, 'missed': self._missed_count,
+                 'mean_jitter_ms': self._jitter_sum_ns / self._tick_count / 1e6 if self._tick_count else 0.,
+                 'max_jitter_ms': self._jitter_max_ns / 1e6}
+        self.reset_stats()
+        return stats